@@ -1,19 +1,13 @@
+import importlib
+import threading
 import streamlit as st
-import pandas as pd
-import plotly.express as px
 from dotenv import load_dotenv
-import streamlit.components.v1 as components
-import subprocess
-import sys
-import atexit
-import tempfile
-import os
-import time
-import socket
-from utils import initialize_session_state, load_css, get_active_chat_state, create_chat_for_new_upload
-from data_handler import load_data, get_data_quality_report, get_data_summary
-from ui_components import display_chat_messages, setup_sidebar
-from llm_agent import AIAgent
+from utils import initialize_session_state, session_lock, load_css, get_active_chat_state, create_chat_for_new_upload, save_active_chat
+from data_handler import load_data, DataSummary
+from ui_components import display_chat_messages, display_agent_stream, setup_sidebar, render_figure, render_export_button
+from dataset_registry import get_dataset_registry
+from dtale_host import get_dtale_host
+from llm_scheduler import PRIORITY_DASHBOARD
 
 load_dotenv()
 st.set_page_config(
@@ -22,151 +16,130 @@ st.set_page_config(
     layout="wide"
 )
 
+@st.cache_resource(show_spinner=False)
+def prewarm_agent_imports():
+    """Imports the agent stack (LangChain, LangGraph, the Gemini SDK) in the background once per process, so the first page renders without waiting for it."""
+    threading.Thread(target=importlib.import_module, args=("llm_agent",), daemon=True).start()
+
+prewarm_agent_imports()
 initialize_session_state()
-load_css("styles.css")
-setup_sidebar()
-active_chat = get_active_chat_state()
 
 def initialize_agent(df):
     """Initializes and returns the AI agent for the active chat."""
     if df is None: return None
     if 'agent' not in active_chat or active_chat['agent'] is None:
-        active_chat['data_summary'] = get_data_summary(df)
-        active_chat['agent'] = AIAgent(df=df, data_summary=active_chat['data_summary'])
+        from llm_agent import AIAgent
+        dataset = active_chat.get('dataset')
+        active_chat['data_summary'] = dataset.summary if dataset else DataSummary(df)
+        active_chat['agent'] = AIAgent(df=df, data_summary=active_chat['data_summary'], dataset=dataset)
     return active_chat['agent']
 
-#Process Management for D-Tale
-def cleanup_temp_files():
-    if active_chat and 'dtale_temp_csv_file' in active_chat and active_chat['dtale_temp_csv_file'] and os.path.exists(active_chat['dtale_temp_csv_file']):
-        os.remove(active_chat['dtale_temp_csv_file'])
-    if active_chat and 'dtale_temp_script_file' in active_chat and active_chat['dtale_temp_script_file'] and os.path.exists(active_chat['dtale_temp_script_file']):
-        os.remove(active_chat['dtale_temp_script_file'])
+def sync_chat_data(agent):
+    """Points the chat at the agent's data after generated code modified it in place."""
+    if agent.df is not active_chat['df']:
+        active_chat.update({'df': agent.df, 'dataset': agent.dataset, 'data_summary': agent.summary_builder, 'frame_path': None, 'df_bytes': None})
 
-def kill_all_dtale_processes():
-    if "chat_history" in st.session_state:
-        for chat_id, chat_data in st.session_state.chat_history.items():
-            if 'dtale_process' in chat_data and chat_data['dtale_process']:
-                if chat_data['dtale_process'].poll() is None:
-                    chat_data['dtale_process'].terminate()
-                chat_data['dtale_process'] = None
+# Other sessions' script runs only spill this session's chats while the lock is free.
+with session_lock():
+    load_css("styles.css")
+    setup_sidebar()
+    active_chat = get_active_chat_state()
 
-atexit.register(kill_all_dtale_processes)
+    #Interactive Analysis (D-Tale): start the shared host early so it is warm by the first launch
+    get_dtale_host()
 
-#Main App Logic
-st.title("🤖 DataSense AI")
-st.markdown("Upload your data and start a conversation. Ask questions, request charts, and build dashboards.")
-user_prompt = None
-if "user_prompt_from_followup" in st.session_state and st.session_state.user_prompt_from_followup:
-    user_prompt = st.session_state.user_prompt_from_followup
-    st.session_state.user_prompt_from_followup = None
-else:
-    user_prompt = st.chat_input("Ask DataSense AI...")
+    #Main App Logic
+    st.title("🤖 DataSense AI")
+    st.markdown("Upload your data and start a conversation. Ask questions, request charts, and build dashboards.")
+    user_prompt = None
+    if "user_prompt_from_followup" in st.session_state and st.session_state.user_prompt_from_followup:
+        user_prompt = st.session_state.user_prompt_from_followup
+        st.session_state.user_prompt_from_followup = None
+    else:
+        user_prompt = st.chat_input("Ask DataSense AI...")
 
 
-if active_chat['df'] is None:
-    uploaded_file = st.file_uploader("Choose a CSV or Excel file", type=["csv", "xls", "xlsx"])
-    if uploaded_file is not None:
-        with st.spinner("Loading and analyzing data..."):
-            df = load_data(uploaded_file)
-            if df is not None:
-                report = get_data_quality_report(df)
-                create_chat_for_new_upload(df, uploaded_file.name, report)
-else:
-    st.info(f"**Dataset Loaded:** `{active_chat['df_name']}` ({active_chat['df'].shape[0]} rows, {active_chat['df'].shape[1]} columns)")
+    if active_chat['df'] is None:
+        uploaded_file = st.file_uploader("Choose a CSV or Excel file", type=["csv", "xls", "xlsx"])
+        if uploaded_file is not None:
+            with st.spinner("Loading and analyzing data..."):
+                progress_bar = st.progress(0.0, text="Reading file...")
+                df = load_data(uploaded_file, progress_callback=lambda fraction, text: progress_bar.progress(fraction, text=text))
+                progress_bar.empty()
+                if df is not None:
+                    # Identical data already open in another chat is shared, along with its report and summary.
+                    dataset = get_dataset_registry().acquire(df)
+                    create_chat_for_new_upload(dataset, uploaded_file.name, dataset.report)
+    else:
+        st.info(f"**Dataset Loaded:** `{active_chat['df_name']}` ({active_chat['df'].shape[0]} rows, {active_chat['df'].shape[1]} columns)")
 
-# Main Content Tabs
-if active_chat['df'] is not None:
-    agent = initialize_agent(active_chat['df'])
-    tab1, tab2, tab3 = st.tabs(["💬 Chat", "🗂️ Data View & Analysis", "📊 Dashboard"])
+    # Main Content Tabs
+    if active_chat['df'] is not None:
+        agent = initialize_agent(active_chat['df'])
+        tab1, tab2, tab3 = st.tabs(["💬 Chat", "🗂️ Data View & Analysis", "📊 Dashboard"])
 
-    with tab1:
-        st.header("Conversational Analysis")
-        display_chat_messages(active_chat['messages'], agent)
+        with tab1:
+            st.header("Conversational Analysis")
+            display_chat_messages(active_chat['messages'], agent)
 
-    with tab2:
-        st.header("Data Preview")
-        st.dataframe(active_chat['df'].head(20))
-        st.header("Interactive Analysis")
-        DTALE_PORT = 40000 
-        dtale_url = f"http://127.0.0.1:{DTALE_PORT}"
-        
-        if active_chat.get('dtale_process') is None:
-            if st.button("🚀 Launch Interactive Analysis"):
-                with st.spinner('Starting D-Tale...'):
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".csv", mode='w', newline='') as tmp_csv:
-                        active_chat['df'].to_csv(tmp_csv.name, index=False)
-                        active_chat['dtale_temp_csv_file'] = tmp_csv.name
-                    script_content = f"""
-import dtale, pandas as pd, sys, time
-try:
-    port = {DTALE_PORT}
-    csv_path = r'{active_chat['dtale_temp_csv_file']}'
-    df = pd.read_csv(csv_path)
-    dtale.show(df, port=port, open_browser=False, host='127.0.0.1', app_root='/', reaper_on=False)
-    while True: time.sleep(1)
-except KeyboardInterrupt: sys.exit(0)
-"""
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".py", mode='w') as tmp_script:
-                        tmp_script.write(script_content)
-                        active_chat['dtale_temp_script_file'] = tmp_script.name
-                    command = [sys.executable, active_chat['dtale_temp_script_file']]
-                    process = subprocess.Popen(command)
-                    active_chat['dtale_process'] = process
-                    
-                    is_ready = False
-                    start_time = time.time()
-                    with st.spinner("Waiting for Interactive Analysis to initialize..."):
-                        while time.time() - start_time < 30:
-                            try:
-                                with socket.create_connection(("127.0.0.1", DTALE_PORT), timeout=1):
-                                    is_ready = True
-                                    break
-                            except (ConnectionRefusedError, socket.timeout):
-                                time.sleep(0.5)
-                    if is_ready:
-                        st.rerun()
-                    else:
-                        proc = active_chat.get('dtale_process')
-                        if proc and proc.poll() is None: proc.terminate()
-                        active_chat['dtale_process'] = None
-                        cleanup_temp_files()
-                        st.error("Failed to start the interactive analysis tool within the time limit.")
-        else:
-            st.success(f"Interactive analysis is running! [Click here]({dtale_url})")
-            if st.button("❌ Terminate Interactive Analysis"):
-                proc = active_chat.get('dtale_process')
-                if proc and proc.poll() is None: proc.terminate()
-                active_chat['dtale_process'] = None
-                cleanup_temp_files()
-                st.rerun()
+        with tab2:
+            st.header("Data Preview")
+            st.dataframe(active_chat['df'].head(20))
+            st.header("Interactive Analysis")
+            if active_chat.get('dtale_data_id') is None:
+                if st.button("🚀 Launch Interactive Analysis"):
+                    with st.spinner('Starting D-Tale...'):
+                        try:
+                            active_chat['dtale_data_id'], active_chat['dtale_url'] = get_dtale_host().load(active_chat['df'])
+                            st.rerun()
+                        except (RuntimeError, TimeoutError) as e:
+                            st.error(f"Failed to start the interactive analysis tool: {e}")
+            else:
+                st.success(f"Interactive analysis is running! [Click here]({active_chat['dtale_url']})")
+                if st.button("❌ Terminate Interactive Analysis"):
+                    try:
+                        get_dtale_host().drop(active_chat['dtale_data_id'])
+                    except (RuntimeError, TimeoutError):
+                        pass
+                    active_chat['dtale_data_id'] = None
+                    active_chat['dtale_url'] = None
+                    st.rerun()
 
-    with tab3:
-        st.header("Automated Dashboards")
+        with tab3:
+            st.header("Automated Dashboards")
         
-        col1, _, _, _ = st.columns(4)
-        with col1:
-            if st.button("Generate Comprehensive Dashboard", use_container_width=True):
-                with st.spinner("Building your dashboard..."):
-                    response = agent.invoke_agent("Generate a comprehensive dashboard.")
-                    active_chat['dashboard_figures'] = response.get("plotly_dashboard")
-                    if not active_chat['dashboard_figures']:
-                        st.error(response.get("response_text", "Sorry, the dashboard could not be generated."))
+            col1, _, _, _ = st.columns(4)
+            with col1:
+                if st.button("Generate Comprehensive Dashboard", use_container_width=True):
+                    with st.spinner("Building your dashboard..."):
+                        response = agent.invoke_agent("Generate a comprehensive dashboard.", priority=PRIORITY_DASHBOARD)
+                        active_chat['dashboard_figures'] = response.get("plotly_dashboard")
+                        sync_chat_data(agent)
+                        save_active_chat()
+                        if not active_chat['dashboard_figures']:
+                            st.error(response.get("response_text", "Sorry, the dashboard could not be generated."))
                 
-        st.markdown("---")
-        if active_chat.get('dashboard_figures'):
-            st.subheader("Your Generated Dashboard")
-            dashboard_figs = active_chat['dashboard_figures']
-            if dashboard_figs and isinstance(dashboard_figs, list):
-                cols = st.columns(2)
-                for i, fig in enumerate(dashboard_figs):
-                    if fig: cols[i % 2].plotly_chart(fig, use_container_width=True)
-            else:
-                st.warning("The AI did not generate a valid list of figures for the dashboard.")
+            st.markdown("---")
+            if active_chat.get('dashboard_figures'):
+                st.subheader("Your Generated Dashboard")
+                dashboard_figs = active_chat['dashboard_figures']
+                if dashboard_figs and isinstance(dashboard_figs, list):
+                    with col1:
+                        render_export_button([fig for fig in dashboard_figs if fig], "dashboard.zip", key="dashboard")
+                    cols = st.columns(2)
+                    for i, fig in enumerate(dashboard_figs):
+                        if fig: render_figure(fig, cols[i % 2])
+                else:
+                    st.warning("The AI did not generate a valid list of figures for the dashboard.")
 
-# Process user input
-if user_prompt and agent:
-    active_chat['messages'].append({"role": "user", "content": user_prompt})
-    with st.spinner("Thinking..."):
-        response = agent.invoke_agent(user_prompt)
-        active_chat['messages'].append({"role": "assistant", "content": response})
-    st.rerun()
\ No newline at end of file
+    # Process user input
+    if user_prompt and agent:
+        active_chat['messages'].append({"role": "user", "content": user_prompt})
+        with tab1:
+            with st.chat_message("user"):
+                st.markdown(user_prompt)
+            response = display_agent_stream(agent.stream_agent(user_prompt), len(active_chat['messages']))
+            active_chat['messages'].append({"role": "assistant", "content": response})
+        sync_chat_data(agent)
+        save_active_chat()
+        st.rerun()
\ No newline at end of file
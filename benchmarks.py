@@ -0,0 +1,743 @@
+"""
+Offline benchmarks for DataSense AI.
+
+Run with `python benchmarks.py` to print wall times for the data handling
+hot paths over synthetic datasets of increasing size. `python benchmarks.py --suite`
+runs the scripted end-to-end suite only and writes a JSON report that can be
+compared against an earlier run with --compare.
+"""
+import argparse
+import asyncio
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from figure_utils import optimize_figure
+import upload_cache
+from dataset_registry import get_dataset_registry
+from data_handler import DataProfile, DataSummary, estimate_tokens, get_data_quality_report, get_data_summary, load_data
+from llm_agent import AIAgent, create_bar_chart, create_histogram
+from llm_cache import LLMCache
+from llm_scheduler import PRIORITY_DASHBOARD, LLMScheduler
+from result_cache import ResultCache
+
+DEFAULT_ROW_COUNTS = [1_000, 10_000, 100_000, 1_000_000]
+SUITE_ROW_COUNTS = [1_000, 100_000, 1_000_000, 10_000_000]
+REPORT_DIR = os.path.join(upload_cache.CACHE_DIR, "benchmarks")
+
+def make_synthetic_frame(rows, seed=0):
+    """Builds a mixed-dtype DataFrame resembling a typical business export."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "order_id": np.arange(rows),
+        "region": rng.choice(["North", "South", "East", "West"], rows).astype(object),
+        "product": rng.choice([f"SKU-{i}" for i in range(500)], rows).astype(object),
+        "quantity": rng.integers(1, 50, rows),
+        "price": rng.normal(100, 25, rows).round(2),
+        "order_date": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, rows), unit="D"),
+    })
+    df.loc[rng.random(rows) < 0.05, "price"] = np.nan
+    df.loc[rng.random(rows) < 0.01, "region"] = None
+    return df
+
+class FakeLLM:
+    """
+    A deterministic stand-in for ChatGoogleGenerativeAI. It answers each agent
+    prompt from a script after an injected delay, for both invoke and ainvoke.
+    """
+
+    def __init__(self, delay=0.0, intent="code_generator", code="result = df.describe()", questions=None, seconds_per_kchar=0.0):
+        self.delay = delay
+        self.seconds_per_kchar = seconds_per_kchar
+        self.prompt_chars = 0
+        self.intent = intent
+        self.code = code
+        self.questions = questions or ["What is the trend over time?", "Which region sells the most?"]
+        self.calls = 0
+
+    def with_structured_output(self, schema):
+        return _FakeRunnable(self, "structured")
+
+    def bind_tools(self, tools):
+        return _FakeRunnable(self, "tools", tools[0].__name__)
+
+    def invoke(self, prompt):
+        return _FakeRunnable(self, "text").invoke(prompt)
+
+    async def ainvoke(self, prompt):
+        return await _FakeRunnable(self, "text").ainvoke(prompt)
+
+    def stream(self, prompt):
+        content = self.invoke(prompt).content
+        for line in content.splitlines(keepends=True):
+            yield AIMessageChunk(content=line)
+
+    async def astream(self, prompt):
+        content = (await self.ainvoke(prompt)).content
+        for line in content.splitlines(keepends=True):
+            yield AIMessageChunk(content=line)
+
+    def latency(self, prompt):
+        """Fixed delay plus a prompt-size dependent part, mimicking input token processing."""
+        return self.delay + self.seconds_per_kchar * len(prompt) / 1000
+
+    def wait(self, prompt):
+        time.sleep(self.latency(prompt))
+
+    async def await_latency(self, prompt):
+        await asyncio.sleep(self.latency(prompt))
+
+    def respond(self, kind, prompt, tool_name=None):
+        self.calls += 1
+        self.prompt_chars += len(prompt)
+        if kind == "structured":
+            if "Re-Planner" in prompt:
+                return {"intent": "code_generator", "user_prompt": "Describe the dataset."}
+            return {"intent": self.intent}
+        if kind == "tools":
+            args = {"questions": self.questions} if tool_name == "FollowUp" else {}
+            return AIMessage(content="", tool_calls=[{"name": tool_name, "args": args, "id": f"call_{self.calls}"}])
+        return AIMessage(content=f"```python\n{self.code}\n```")
+
+class _FakeRunnable:
+    def __init__(self, llm, kind, tool_name=None):
+        self.llm, self.kind, self.tool_name = llm, kind, tool_name
+
+    def invoke(self, prompt):
+        self.llm.wait(prompt)
+        return self.llm.respond(self.kind, prompt, self.tool_name)
+
+    async def ainvoke(self, prompt):
+        await self.llm.await_latency(prompt)
+        return self.llm.respond(self.kind, prompt, self.tool_name)
+
+# Prompts over make_synthetic_frame() columns with the answers a model would script for them.
+# "code" lists the snippets returned on successive attempts, so a failing first one exercises the re-plan loop.
+# Prompts the fast router recognizes never reach the intent entry.
+BENCH_CORPUS = [
+    {"prompt": "Show a bar chart of price by region", "intent": "bar_chart"},
+    {"prompt": "Plot the distribution of quantity", "intent": "histogram"},
+    {"prompt": "Compare total quantity across regions", "intent": "bar_chart",
+     "tool_args": {"x_col": "region", "y_col": "quantity", "title": "Quantity by region"}},
+    {"prompt": "What is the average price per region?", "intent": "code_generator",
+     "code": ["result = df.groupby('region', observed=True)['price'].mean().reset_index()"]},
+    {"prompt": "Which 10 products sold the most units?", "intent": "code_generator",
+     "code": ["result = df.groupby('product', observed=True)['quantity'].sum().nlargest(10).reset_index()"]},
+    {"prompt": "Show the monthly revenue trend", "intent": "code_generator",
+     "code": ["result = px.line(df.groupby('month')['revenue'].sum().reset_index(), x='month', y='revenue')",
+              "monthly = df.assign(revenue=df['quantity'] * df['price']).groupby(pd.Grouper(key='order_date', freq='MS'))['revenue'].sum().reset_index()\n"
+              "result = px.line(monthly, x='order_date', y='revenue', title='Monthly revenue')"]},
+    {"prompt": "Build a sales dashboard", "intent": "dashboard",
+     "code": ["result = {'price': px.histogram(df, x='price'), 'regions': px.bar(df['region'].value_counts().reset_index(), x='region', y='count'), "
+              "'quantity': px.box(df.sample(min(len(df), 5000), random_state=0), x='region', y='quantity')}"]},
+]
+
+class ScriptedLLM(FakeLLM):
+    """A FakeLLM that answers every node from the BENCH_CORPUS entry whose prompt appears in the request."""
+
+    def __init__(self, corpus=None, **kwargs):
+        super().__init__(**kwargs)
+        self.corpus = sorted(corpus or BENCH_CORPUS, key=lambda entry: len(entry["prompt"]), reverse=True)
+        self.attempts = {}
+
+    def respond(self, kind, prompt, tool_name=None):
+        entry = next((entry for entry in self.corpus if entry["prompt"] in prompt), None)
+        if entry is None:
+            return super().respond(kind, prompt, tool_name)
+        self.calls += 1
+        self.prompt_chars += len(prompt)
+        if kind == "structured":
+            if "Re-Planner" in prompt:
+                return {"intent": "code_generator", "user_prompt": entry["prompt"]}
+            return {"intent": entry["intent"]}
+        if kind == "tools":
+            args = {"questions": self.questions} if tool_name == "FollowUp" else entry.get("tool_args", {})
+            return AIMessage(content="", tool_calls=[{"name": tool_name, "args": args, "id": f"call_{self.calls}"}])
+        attempts = entry.get("code") or [self.code]
+        attempt = self.attempts[entry["prompt"]] = self.attempts.get(entry["prompt"], -1) + 1
+        code = attempts[attempt % len(attempts)]
+        return AIMessage(content=f"```python\n{code}\n```")
+
+class FakeLLMServer:
+    """
+    A local HTTP endpoint that behaves like a rate-limited LLM API: each POST is
+    answered after delay seconds, and requests beyond max_concurrency in flight or
+    rate_per_second in the last second get HTTP 429, as Gemini quota errors do.
+    """
+
+    def __init__(self, delay=0.2, max_concurrency=4, rate_per_second=10):
+        self.delay = delay
+        self.max_concurrency = max_concurrency
+        self.rate_per_second = rate_per_second
+        self.served = 0
+        self.rejected = 0
+        self._inflight = 0
+        self._recent = []
+        self._lock = threading.Lock()
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status = server._admit()
+                if status == 200:
+                    try:
+                        time.sleep(server.delay)
+                    finally:
+                        with server._lock: server._inflight -= 1
+                self.send_response(status)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+            def log_message(self, *args):
+                pass
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}/generate"
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def _admit(self):
+        now = time.monotonic()
+        with self._lock:
+            self._recent = [t for t in self._recent if now - t < 1.0]
+            if self._inflight >= self.max_concurrency or len(self._recent) >= self.rate_per_second:
+                self.rejected += 1
+                return 429
+            self._inflight += 1
+            self._recent.append(now)
+            self.served += 1
+            return 200
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+class FakeRateLimitError(RuntimeError):
+    pass
+
+class HTTPScriptedLLM(ScriptedLLM):
+    """A ScriptedLLM whose latency and quota come from a FakeLLMServer instead of a local sleep."""
+
+    def __init__(self, url, corpus=None, **kwargs):
+        super().__init__(corpus, **kwargs)
+        self.url = url
+
+    def wait(self, prompt):
+        request = urllib.request.Request(self.url, data=prompt.encode("utf-8"), method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            e.close()
+            if e.code == 429: raise FakeRateLimitError("429 Resource exhausted: quota exceeded") from None
+            raise
+
+    async def await_latency(self, prompt):
+        await asyncio.to_thread(self.wait, prompt)
+
+def make_fake_agent(df, llm=None, **agent_kwargs):
+    """Builds an AIAgent wired to a FakeLLM and private, empty LLM and result caches."""
+    agent_kwargs.setdefault("result_cache", ResultCache(256 * 1024 * 1024))
+    agent_kwargs.setdefault("llm_cache", LLMCache())
+    return AIAgent(df=df, data_summary=get_data_summary(df), llm=llm or FakeLLM(), **agent_kwargs)
+
+def _time_call(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+def bench_quality_report(row_counts):
+    """Times get_data_quality_report against the number of rows."""
+    print("get_data_quality_report")
+    print(f"{'rows':>12} {'seconds':>10}")
+    for rows in row_counts:
+        df = make_synthetic_frame(rows)
+        print(f"{rows:>12,} {_time_call(get_data_quality_report, df):>10.3f}")
+
+def legacy_data_summary(df):
+    """The original df.info() + df.head() summary, kept as the benchmark baseline."""
+    buffer = io.StringIO()
+    df.info(buf=buffer)
+    return f"""
+    Dataset Overview:
+    - Shape: {df.shape} (rows, columns)
+    - Column Names and Data Types:
+    {buffer.getvalue()}
+    - First 5 rows (head):
+    {df.head().to_string()}
+    """.strip()
+
+def make_wide_frame(rows, columns, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {f"metric_{i}": rng.normal(size=rows) for i in range(columns - 2)}
+    data["segment"] = rng.choice([f"segment with a long descriptive label {i}" for i in range(20)], rows)
+    data["notes"] = rng.choice(["free text " * 20, "short note"], rows)
+    return pd.DataFrame(data)
+
+def bench_summary(column_counts, rows=5_000, prompt="Plot the average metric_7 per segment"):
+    """Compares prompt size and agent latency of the legacy and token-budgeted summaries."""
+    print("data summary size and agent latency (fake LLM, 0.05s + 0.02s per 1k prompt chars)")
+    print(f"{'columns':>8} {'summary':>8} {'tokens':>8} {'build_s':>8} {'prompt_kchars':>14} {'invoke_s':>9}")
+    for columns in column_counts:
+        df = make_wide_frame(rows, columns)
+        for name, build in (("legacy", legacy_data_summary), ("budget", DataSummary)):
+            start = time.perf_counter()
+            summary = build(df)
+            build_s = time.perf_counter() - start
+            text = summary.render(prompt) if isinstance(summary, DataSummary) else summary
+            llm = FakeLLM(delay=0.05, seconds_per_kchar=0.02)
+            agent = AIAgent(df=df, data_summary=summary, llm_cache=LLMCache(), llm=llm)
+            start = time.perf_counter()
+            agent.invoke_agent(prompt)
+            invoke_s = time.perf_counter() - start
+            print(f"{columns:>8} {name:>8} {estimate_tokens(text):>8} {build_s:>8.3f} {llm.prompt_chars / 1000:>14.1f} {invoke_s:>9.3f}")
+
+def bench_agent_latency(delays, rows=10_000, prompt="What is the average price per region?"):
+    """Compares time-to-answer and total latency of the sync and async agent modes."""
+    df = make_synthetic_frame(rows)
+    print("invoke_agent latency (fake LLM)")
+    print(f"{'delay':>8} {'mode':>6} {'answer_s':>10} {'total_s':>10}")
+    for delay in delays:
+        for async_mode in (False, True):
+            agent = make_fake_agent(df, FakeLLM(delay=delay), async_mode=async_mode)
+            answered = {}
+            start = time.perf_counter()
+            agent.invoke_agent(prompt, on_response=lambda response: answered.setdefault("at", time.perf_counter()))
+            total = time.perf_counter() - start
+            mode = "async" if async_mode else "sync"
+            print(f"{delay:>8.2f} {mode:>6} {answered['at'] - start:>10.3f} {total:>10.3f}")
+
+def bench_charts(row_counts):
+    """Compares build time and figure JSON size of raw-row and pre-aggregated chart tools."""
+    print("chart tools: raw rows vs pre-aggregated")
+    print(f"{'rows':>12} {'chart':>10} {'mode':>6} {'build_s':>9} {'json_kb':>10}")
+    for rows in row_counts:
+        df = make_synthetic_frame(rows)
+        charts = (
+            ("bar", lambda: px.bar(df, x="region", y="price", title="t"), lambda: create_bar_chart(df, "region", "price", "t")["plotly_fig"]),
+            ("histogram", lambda: px.histogram(df, x="price", title="t"), lambda: create_histogram(df, "price", "t")["plotly_fig"]),
+        )
+        for chart, raw, aggregated in charts:
+            for mode, build in (("raw", raw), ("agg", aggregated)):
+                start = time.perf_counter()
+                size = len(build().to_json())
+                print(f"{rows:>12,} {chart:>10} {mode:>6} {time.perf_counter() - start:>9.3f} {size / 1024:>10.1f}")
+
+def bench_figures(row_counts):
+    """Measures what optimize_figure does to large line and scatter figures from generated code."""
+    print("figure post-processing (WebGL + decimation)")
+    print(f"{'rows':>12} {'chart':>8} {'points_in':>10} {'points_out':>10} {'optimize_s':>10} {'json_kb_in':>11} {'json_kb_out':>11}")
+    for rows in row_counts:
+        df = make_synthetic_frame(rows).sort_values("order_date")
+        for chart, build in (("line", lambda: px.line(df, x="order_date", y="price")), ("scatter", lambda: px.scatter(df, x="quantity", y="price"))):
+            fig = build()
+            size_in, points_in = len(fig.to_json()), sum(len(trace.y) for trace in fig.data)
+            start = time.perf_counter()
+            fig = optimize_figure(fig)
+            elapsed = time.perf_counter() - start
+            points_out = sum(len(trace.y) for trace in fig.data)
+            print(f"{rows:>12,} {chart:>8} {points_in:>10,} {points_out:>10,} {elapsed:>10.3f} {size_in / 1024:>11.1f} {len(fig.to_json()) / 1024:>11.1f}")
+
+MUTATIONS = {
+    "impute price": lambda df: df.__setitem__("price", df["price"].fillna(df["price"].median())),
+    "drop duplicates": lambda df: df.drop_duplicates(inplace=True),
+    "dropna": lambda df: df.dropna(inplace=True),
+    "add column": lambda df: df.__setitem__("revenue", df["quantity"] * df["price"]),
+}
+
+def bench_reprofile(row_counts):
+    """Compares re-profiling a mutated frame from scratch with DataProfile.updated(), summary and report included."""
+    print("profile, summary and quality report after an in-chat mutation")
+    print(f"{'rows':>12} {'mutation':>16} {'full_s':>8} {'incr_s':>8} {'max_unique_err':>15}")
+    for rows in row_counts:
+        df = make_synthetic_frame(rows)
+        profile = DataProfile(df)
+        for name, mutate in MUTATIONS.items():
+            mutated = df.copy()
+            mutate(mutated)
+            timings = []
+            for build in (lambda: DataProfile(mutated), lambda: profile.updated(mutated)):
+                start = time.perf_counter()
+                result = build()
+                DataSummary(mutated, result).render()
+                get_data_quality_report(mutated, result)
+                timings.append(time.perf_counter() - start)
+            error = max(abs(result.stats[col]["unique"] - mutated[col].nunique()) / max(mutated[col].nunique(), 1) for col in mutated.columns)
+            print(f"{rows:>12,} {name:>16} {timings[0]:>8.3f} {timings[1]:>8.3f} {error:>15.2%}")
+
+RESULT_CACHE_CODE = """
+summary = df.groupby(["region", df["order_date"].dt.month.rename("month")]).agg(revenue=("price", "sum"), orders=("quantity", "count")).reset_index()
+result = {"revenue": px.bar(summary, x="month", y="revenue", color="region"), "orders": px.line(summary, x="month", y="orders", color="region")}
+"""
+
+def bench_result_cache(row_counts, prompt="Generate a comprehensive dashboard."):
+    """Times a repeated dashboard request: the first run executes the code, the repeat (same code, reformatted) is a result-cache hit."""
+    print("repeated dashboard request with the execution-result cache (fake LLM, no delay)")
+    print(f"{'rows':>12} {'miss_s':>8} {'hit_s':>8} {'speedup':>8}")
+    for rows in row_counts:
+        llm = FakeLLM(code=RESULT_CACHE_CODE)
+        agent = make_fake_agent(make_synthetic_frame(rows), llm=llm)
+        miss = _time_call(agent.invoke_agent, prompt)
+        # Different formatting and a comment: the LLM cache misses, the normalized code still matches.
+        llm.code = "# same analysis\n" + RESULT_CACHE_CODE.replace(", ", ",  ")
+        hit = _time_call(agent.invoke_agent, prompt)
+        assert agent.result_cache.stats()["hits"] == 1
+        print(f"{rows:>12,} {miss:>8.3f} {hit:>8.3f} {miss / hit:>7.1f}x")
+
+PROGRESSIVE_CODE = """
+summary = df.groupby("product").agg(revenue=("price", "sum"), median_quantity=("quantity", "median")).reset_index()
+result = px.bar(summary.nlargest(20, "revenue"), x="product", y="revenue")
+"""
+
+def bench_progressive(row_counts, prompt="Which products bring in the most revenue?"):
+    """Streams a request with progressive execution: preview latency, exact-answer latency, and how fast closing the stream stops the run."""
+    print("progressive execution (preview on a stratified sample, then the exact result)")
+    print(f"{'rows':>12} {'preview_s':>10} {'answer_s':>9} {'cancel_s':>9}")
+    for rows in row_counts:
+        df = make_synthetic_frame(rows)
+        dataset = get_dataset_registry().acquire(df)
+        dataset.report  # built at upload in the app, together with the profile the sampler stratifies by
+        agent = make_fake_agent(df, llm=FakeLLM(code=PROGRESSIVE_CODE), dataset=dataset)
+        for event in agent.stream_agent(prompt):
+            pass
+        timings = agent.stream_timings[-1]
+        # Ask again, bypassing the result cache, and cancel once the preview is shown.
+        agent.result_cache = ResultCache(0)
+        cancel, shown = threading.Event(), threading.Event()
+        run = threading.Thread(target=agent.invoke_agent, args=(prompt,), kwargs={
+            "cancel": cancel, "on_response": lambda response: shown.set(), "on_event": lambda event: event["type"] == "preview" and shown.set()})
+        run.start()
+        shown.wait()
+        start = time.perf_counter()
+        cancel.set()
+        run.join()
+        preview = f"{timings['preview_s']:>10.3f}" if timings["preview_s"] is not None else f"{'-':>10}"
+        print(f"{rows:>12,} {preview} {timings['answer_s']:>9.3f} {time.perf_counter() - start:>9.3f}")
+
+VALIDATOR_CASES = {
+    "valid": "result = df.groupby('region')['quantity'].mean()",
+    "near-miss column": "result = df.groupby('Region')['quantitty'].mean()",
+    "no result": "df.groupby('region')['quantity'].mean()",
+    "unknown column": "result = df.groupby('customer')['quantity'].mean()",
+    "import": "import os\nresult = os.getcwd()",
+}
+
+def bench_validator(rows=10_000, prompt="What is the average quantity per region?"):
+    """Runs typical broken snippets with and without static validation: LLM calls spent, executions and whether an answer came back."""
+    print("static validation of generated code (fake LLM that always returns the same snippet)")
+    print(f"{'case':>18} {'calls_off':>10} {'calls_on':>9} {'answered_off':>13} {'answered_on':>12}")
+    df = make_synthetic_frame(rows)
+    for name, code in VALIDATOR_CASES.items():
+        row = []
+        for validation in (False, True):
+            llm = FakeLLM(code=code)
+            agent = make_fake_agent(df, llm=llm)
+            agent.code_validation = validation
+            response = agent.invoke_agent(prompt)
+            row.append((llm.calls, "sorry" not in response["response_text"].lower() and "no specific output" not in response["response_text"]))
+        (calls_off, answered_off), (calls_on, answered_on) = row
+        print(f"{name:>18} {calls_off:>10} {calls_on:>9} {str(answered_off):>13} {str(answered_on):>12}")
+
+def make_chat_history(turns, points=2_000, seed=0):
+    """A synthetic chat with a chart per answer, a dashboard every fifth turn and a table every third."""
+    rng = np.random.default_rng(seed)
+    messages = []
+    for turn in range(turns):
+        frame = pd.DataFrame({"x": np.arange(points), "y": rng.normal(size=points).cumsum()})
+        content = {"response_text": f"Here is the chart for question {turn}.", "plotly_fig": px.line(frame, x="x", y="y")}
+        if turn % 5 == 0:
+            content["plotly_dashboard"] = [px.histogram(frame, x="y"), px.scatter(frame, x="x", y="y")]
+        if turn % 3 == 0:
+            content["dataframe"] = frame.head(200)
+        messages += [{"role": "user", "content": f"Question {turn}"}, {"role": "assistant", "content": content}]
+    return messages
+
+CHAT_RERUN_SCRIPT = """
+import sys
+sys.path.insert(0, {repo!r})
+import streamlit as st
+import benchmarks
+from ui_components import display_chat_messages
+st.session_state.setdefault("current_chat_id", "bench")
+if "messages" not in st.session_state:
+    st.session_state.messages = benchmarks.make_chat_history({turns})
+display_chat_messages(st.session_state.messages, None, window={window})
+"""
+
+def bench_chat_rerun(turn_counts, reruns=3):
+    """Times Streamlit reruns of display_chat_messages against history length, fully rendered vs windowed."""
+    from streamlit.testing.v1 import AppTest
+    from ui_components import CHAT_RENDER_WINDOW
+    print("chat history rerun latency")
+    print(f"{'turns':>8} {'window':>8} {'rerun_s':>10}")
+    for turns in turn_counts:
+        for window in (None, CHAT_RENDER_WINDOW):
+            script = CHAT_RERUN_SCRIPT.format(repo=os.path.dirname(os.path.abspath(__file__)), turns=turns, window=window)
+            app = AppTest.from_string(script, default_timeout=600).run()
+            start = time.perf_counter()
+            for _ in range(reruns):
+                app.run()
+            print(f"{turns:>8} {str(window or 'all'):>8} {(time.perf_counter() - start) / reruns:>10.3f}")
+
+STARTUP_SCRIPT = """
+import os, sys, tempfile, time
+os.environ.setdefault("DATASENSE_CACHE_DIR", tempfile.mkdtemp())
+sys.path.insert(0, {repo!r})
+os.chdir({repo!r})
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("app.py", default_timeout=120)
+streamlit_s = time.perf_counter() - start
+start = time.perf_counter()
+app.run()
+first_run_s = time.perf_counter() - start
+start = time.perf_counter()
+import llm_agent
+print(streamlit_s, first_run_s, time.perf_counter() - start)
+"""
+
+def bench_startup(runs=3):
+    """Times a cold first run of app.py (time to first interactive page) in fresh interpreters."""
+    script = STARTUP_SCRIPT.format(repo=os.path.dirname(os.path.abspath(__file__)))
+    print("cold start (fresh interpreter)")
+    print(f"{'run':>4} {'streamlit_s':>12} {'first_run_s':>12} {'agent_wait_s':>13}")
+    for run in range(runs):
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout.split()
+        streamlit_s, first_run_s, agent_wait_s = map(float, output[-3:])
+        print(f"{run:>4} {streamlit_s:>12.2f} {first_run_s:>12.2f} {agent_wait_s:>13.2f}")
+
+def bench_scheduler(session_counts, rounds=2, delay=0.2, server_concurrency=4, server_rate=10, rows=10_000):
+    """
+    Runs concurrent chat sessions (plus one dashboard session) against a
+    rate-limited FakeLLMServer, with every LLM call going straight to the server
+    and then through an LLMScheduler sized to the server's quota.
+    """
+    df = make_synthetic_frame(rows)
+    corpus = [entry for entry in BENCH_CORPUS if entry["intent"] != "dashboard"]
+    dashboard_prompt = next(entry["prompt"] for entry in BENCH_CORPUS if entry["intent"] == "dashboard")
+    print(f"LLM scheduler vs a rate-limited fake LLM server ({server_concurrency} concurrent, {server_rate}/s, {delay:.2f}s per call)")
+    print(f"{'sessions':>9} {'mode':>12} {'p50_s':>7} {'p95_s':>7} {'wall_s':>7} {'served':>7} {'429s':>5} {'errors':>7} {'replans':>8} {'coalesced':>10} {'wait_chat':>10} {'wait_dash':>10}")
+    for sessions in session_counts:
+        for mode in ("unscheduled", "scheduled"):
+            server = FakeLLMServer(delay=delay, max_concurrency=server_concurrency, rate_per_second=server_rate)
+            if mode == "scheduled":
+                scheduler = LLMScheduler(max_concurrency=server_concurrency, rate_per_second=server_rate * 0.9, burst=server_concurrency)
+            else:
+                scheduler = LLMScheduler(max_concurrency=1 << 30, rate_per_second=0, coalesce=False)
+            latencies, spans, lock = [], [], threading.Lock()
+            def chat(prompts, priority):
+                agent = make_fake_agent(df, HTTPScriptedLLM(server.url), scheduler=scheduler)
+                for prompt in prompts:
+                    start = time.perf_counter()
+                    agent.invoke_agent(prompt, priority=priority)
+                    with lock:
+                        if priority != PRIORITY_DASHBOARD: latencies.append(time.perf_counter() - start)
+                        spans.extend(agent.last_trace.spans)
+            # Sessions start at different prompts, so some requests overlap and others queue.
+            prompts = [entry["prompt"] for entry in corpus] * rounds
+            threads = [threading.Thread(target=chat, args=(prompts[i % len(corpus):] + prompts[:i % len(corpus)], 0)) for i in range(sessions)]
+            threads.append(threading.Thread(target=chat, args=([dashboard_prompt] * rounds, PRIORITY_DASHBOARD)))
+            start = time.perf_counter()
+            for thread in threads: thread.start()
+            for thread in threads: thread.join()
+            wall = time.perf_counter() - start
+            server.close()
+            stats, waits = scheduler.stats(), scheduler.stats()["avg_wait_s_by_priority"]
+            errors = sum(bool(span.error) for span in spans)
+            replans = sum(span.node == "replan_node" for span in spans)
+            print(f"{sessions:>9} {mode:>12} {np.percentile(latencies, 50):>7.2f} {np.percentile(latencies, 95):>7.2f} {wall:>7.2f} {server.served:>7} "
+                  f"{server.rejected:>5} {errors:>7} {replans:>8} {stats['coalesced']:>10} {waits.get('interactive', 0):>10.2f} {waits.get('dashboard', 0):>10.2f}")
+
+def _percentiles(samples):
+    values = np.asarray(samples, dtype="float64")
+    return {"count": len(values), "p50_s": float(np.percentile(values, 50)), "p95_s": float(np.percentile(values, 95)), "mean_s": float(values.mean())}
+
+def _measure(func, runs, setup=None):
+    """Times func over runs calls (setup runs untimed before each), then repeats it once under tracemalloc for the peak."""
+    samples = []
+    for _ in range(runs):
+        if setup: setup()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    if setup: setup()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return dict(_percentiles(samples), peak_mb=peak / 1024 / 1024)
+
+class _Upload(io.BytesIO):
+    """The parts of Streamlit's UploadedFile that load_data uses."""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+def _run_corpus(df, corpus, delay, async_mode):
+    """Runs every corpus prompt through a fresh agent; returns request latencies and the node spans."""
+    agent = make_fake_agent(df, ScriptedLLM(corpus, delay=delay), async_mode=async_mode)
+    latencies, spans = [], []
+    for entry in corpus:
+        start = time.perf_counter()
+        agent.invoke_agent(entry["prompt"])
+        latencies.append(time.perf_counter() - start)
+        spans.extend(agent.last_trace.spans)
+    return latencies, spans
+
+def bench_suite(row_counts, runs=5, delay=0.0, async_mode=False, corpus=None):
+    """
+    Runs load_data, get_data_quality_report, get_data_summary and the full
+    invoke_agent path over the scripted corpus for each dataset size, and returns
+    a report with p50/p95 latency per stage and per graph node, peak traced
+    memory and throughput.
+    """
+    corpus = corpus or BENCH_CORPUS
+    report = {
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "environment": _environment(),
+        "config": {"runs": runs, "llm_delay_s": delay, "async_mode": async_mode, "prompts": len(corpus)},
+        "datasets": [],
+    }
+    # Uploads go to a throwaway cache so cold loads really parse and the user's cache is left alone.
+    cache_dir = tempfile.mkdtemp(prefix="datasense-bench-")
+    previous_cache = upload_cache._upload_cache
+    upload_cache._upload_cache = upload_cache.UploadCache(cache_dir, 1 << 40)
+    print(f"benchmark suite ({runs} runs, fake LLM delay {delay:.2f}s, {'async' if async_mode else 'sync'})")
+    print(f"{'rows':>12} {'stage':>22} {'p50_s':>9} {'p95_s':>9} {'peak_mb':>9} {'throughput':>16}")
+    try:
+        for rows in row_counts:
+            df = make_synthetic_frame(rows)
+            csv = df.to_csv(index=False).encode("utf-8")
+            # Each rerun of the app hands load_data a fresh UploadedFile positioned at the start.
+            upload = lambda: _Upload(csv, f"bench_{rows}.csv")
+            def clear_cache():
+                for name in os.listdir(cache_dir): os.remove(os.path.join(cache_dir, name))
+            stages = {
+                "load_data_cold": _measure(lambda: load_data(upload()), runs, setup=clear_cache),
+                "load_data_cached": _measure(lambda: load_data(upload()), runs),
+            }
+            df = load_data(upload())
+            if df is None: raise RuntimeError(f"load_data failed for {rows:,} rows")
+            stages["get_data_quality_report"] = _measure(lambda: get_data_quality_report(df), runs)
+            stages["get_data_summary"] = _measure(lambda: get_data_summary(df), runs)
+            for stage in stages.values():
+                stage["rows_per_s"] = rows / stage["p50_s"] if stage["p50_s"] else None
+
+            latencies, spans = [], []
+            start = time.perf_counter()
+            for _ in range(runs):
+                run_latencies, run_spans = _run_corpus(df, corpus, delay, async_mode)
+                latencies += run_latencies
+                spans += run_spans
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            try:
+                _run_corpus(df, corpus, delay, async_mode)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            stages["invoke_agent"] = dict(_percentiles(latencies), peak_mb=peak / 1024 / 1024, requests_per_s=len(latencies) / elapsed)
+            nodes = {}
+            for span in spans:
+                nodes.setdefault(span.node, []).append(span)
+            node_stats = {
+                node: dict(_percentiles([span.wall_s for span in node_spans]), llm_calls=sum(span.llm_calls for span in node_spans),
+                           errors=sum(bool(span.error) for span in node_spans))
+                for node, node_spans in sorted(nodes.items())
+            }
+            report["datasets"].append({"rows": rows, "csv_mb": len(csv) / 1024 / 1024, "stages": stages, "nodes": node_stats})
+
+            for name, stage in stages.items():
+                throughput = f"{stage['requests_per_s']:.1f} req/s" if "requests_per_s" in stage else f"{stage['rows_per_s'] / 1e6:.2f} Mrows/s"
+                print(f"{rows:>12,} {name:>22} {stage['p50_s']:>9.4f} {stage['p95_s']:>9.4f} {stage['peak_mb']:>9.1f} {throughput:>16}")
+            for node, stage in node_stats.items():
+                print(f"{rows:>12,} {'node ' + node:>22} {stage['p50_s']:>9.4f} {stage['p95_s']:>9.4f} {'':>9} {stage['count']:>10} spans")
+    finally:
+        upload_cache._upload_cache = previous_cache
+        for name in os.listdir(cache_dir): os.remove(os.path.join(cache_dir, name))
+        os.rmdir(cache_dir)
+    return report
+
+def _environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"commit": commit or None, "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "pandas": pd.__version__, "numpy": np.__version__}
+
+def write_report(report, path=None):
+    """Writes a suite report as JSON, by default to a timestamped file under REPORT_DIR; returns the path."""
+    path = path or os.path.join(REPORT_DIR, f"suite-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+def compare_reports(baseline, current):
+    """Prints the p50 latency of every stage and node in current relative to baseline, for dataset sizes in both."""
+    print(f"comparison against the baseline from {baseline['started']} ({(baseline['environment'].get('commit') or '?')[:8]})")
+    print(f"{'rows':>12} {'stage':>22} {'base_p50':>9} {'p50':>9} {'ratio':>7}")
+    previous = {dataset["rows"]: dataset for dataset in baseline["datasets"]}
+    for dataset in current["datasets"]:
+        old = previous.get(dataset["rows"])
+        if old is None: continue
+        pairs = [(name, old["stages"].get(name), stage) for name, stage in dataset["stages"].items()]
+        pairs += [("node " + name, old["nodes"].get(name), stage) for name, stage in dataset["nodes"].items()]
+        for name, before, after in pairs:
+            if not before: continue
+            ratio = after["p50_s"] / before["p50_s"] if before["p50_s"] else float("nan")
+            print(f"{dataset['rows']:>12,} {name:>22} {before['p50_s']:>9.4f} {after['p50_s']:>9.4f} {ratio:>6.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="DataSense AI offline benchmarks")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROW_COUNTS, help="Row counts to benchmark.")
+    parser.add_argument("--llm-delays", type=float, nargs="+", default=[0.1, 0.5], help="Fake LLM delays (seconds) for the agent benchmark.")
+    parser.add_argument("--suite", action="store_true", help="Run only the scripted end-to-end suite and write a JSON report.")
+    parser.add_argument("--suite-rows", type=int, nargs="+", default=SUITE_ROW_COUNTS, help="Dataset sizes for the suite.")
+    parser.add_argument("--runs", type=int, default=5, help="Timed runs per suite stage.")
+    parser.add_argument("--suite-llm-delay", type=float, default=0.0, help="Fake LLM delay (seconds) in the suite; 0 measures the agent's own overhead.")
+    parser.add_argument("--async-agent", action="store_true", help="Run the suite's agent in async mode.")
+    parser.add_argument("--report", help="Where to write the suite report (default: a timestamped file under the cache directory).")
+    parser.add_argument("--compare", help="A previous suite report to compare against.")
+    args = parser.parse_args()
+    if args.suite:
+        report = bench_suite(args.suite_rows, runs=args.runs, delay=args.suite_llm_delay, async_mode=args.async_agent)
+        print(f"report written to {write_report(report, args.report)}")
+        if args.compare:
+            with open(args.compare) as f:
+                compare_reports(json.load(f), report)
+        return
+    bench_quality_report(args.rows)
+    bench_agent_latency(args.llm_delays)
+    bench_summary([30, 300])
+    bench_reprofile(args.rows)
+    bench_result_cache(args.rows)
+    bench_progressive(args.rows + [10_000_000])
+    bench_validator()
+    bench_charts(args.rows)
+    bench_figures(args.rows)
+    bench_chat_rerun([10, 50])
+    bench_startup()
+    bench_scheduler([4, 16])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import hashlib
+import io
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+
+from figure_utils import figure_json
+
+EXPORT_CACHE_MB = float(os.getenv("DATASENSE_EXPORT_CACHE_MB", "64"))
+EXPORT_SCALE = float(os.getenv("DATASENSE_EXPORT_SCALE", "2"))
+EXPORT_PREWARM = os.getenv("DATASENSE_EXPORT_PREWARM", "1") == "1"
+
+def figure_key(fig, format: str = "png", scale: float = EXPORT_SCALE) -> str:
+    """Hashes a figure's JSON together with the output format, so equal charts share an export."""
+    digest = hashlib.blake2b(figure_json(fig).encode("utf-8"), digest_size=16)
+    digest.update(f"{format}@{scale}".encode("utf-8"))
+    return digest.hexdigest()
+
+class ChartExporter:
+    """
+    Renders figures to images on demand through one long-lived Kaleido process and
+    keeps the bytes in an LRU cache keyed by figure hash, bounded by max_bytes.
+    Kaleido handles one request at a time, so renders are serialized.
+    """
+
+    def __init__(self, max_bytes: int, scale: float = EXPORT_SCALE):
+        self.max_bytes = max_bytes
+        self.scale = scale
+        self.hits = 0
+        self.renders = 0
+        self._cache = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()
+        self._warm_started = False
+
+    def cached(self, fig, format: str = "png"):
+        """Returns the exported bytes if this figure was rendered before, without rendering."""
+        key = figure_key(fig, format, self.scale)
+        with self._lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+            return data
+
+    def _store(self, key: str, data: bytes):
+        with self._lock:
+            if key in self._cache: return
+            self._cache[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _render(self, fig, format: str) -> bytes:
+        import plotly.io as pio
+        # The default Kaleido scope keeps its Chromium subprocess alive between calls.
+        with self._render_lock:
+            data = pio.to_image(fig, format=format, scale=self.scale, validate=False)
+        self.renders += 1
+        return data
+
+    def export(self, fig, format: str = "png") -> bytes:
+        """Returns the figure as image bytes, rendering it only on a cache miss."""
+        data = self.cached(fig, format)
+        if data is None:
+            data = self._render(fig, format)
+            self._store(figure_key(fig, format, self.scale), data)
+        return data
+
+    def export_zip(self, figs, format: str = "png", prefix: str = "chart") -> bytes:
+        """Exports several figures (e.g. a dashboard) in one call, returned as a zip archive."""
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+            for i, fig in enumerate(figs, start=1):
+                # PNGs are already compressed; storing them keeps the archive cheap to build.
+                archive.writestr(f"{prefix}_{i}.{format}", self.export(fig, format))
+        return buffer.getvalue()
+
+    def warm(self):
+        """Starts the Kaleido process in the background (once) so the first export does not pay its start-up."""
+        with self._lock:
+            if self._warm_started or not EXPORT_PREWARM: return
+            self._warm_started = True
+        def render_blank():
+            import plotly.graph_objects as go
+            try:
+                self._render(go.Figure(), "png")
+            except Exception:
+                pass
+        threading.Thread(target=render_blank, daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._cache), "size_bytes": self._size, "hits": self.hits, "renders": self.renders}
+
+_chart_exporter = None
+
+def get_chart_exporter() -> ChartExporter:
+    """Returns the process-wide chart exporter."""
+    global _chart_exporter
+    if _chart_exporter is None:
+        _chart_exporter = ChartExporter(int(EXPORT_CACHE_MB * 1024 * 1024))
+    return _chart_exporter
@@ -0,0 +1,105 @@
+import hashlib
+import html
+import io
+import os
+import tempfile
+
+import pandas as pd
+
+from figure_utils import figure_json
+
+EXPORT_PAGE_ROWS = int(os.getenv("DATASENSE_EXPORT_PAGE_ROWS", "100"))
+EXPORT_MAX_ROWS = int(os.getenv("DATASENSE_EXPORT_MAX_ROWS", "10000"))
+# "cdn" links plotly.js; "inline" embeds it once so the file also opens offline.
+EXPORT_PLOTLYJS = os.getenv("DATASENSE_EXPORT_PLOTLYJS", "cdn")
+EXPORT_SPOOL_MB = float(os.getenv("DATASENSE_EXPORT_SPOOL_MB", "16"))
+
+_STYLE = """body {font-family: sans-serif; max-width: 1100px; margin: auto;}
+.message {padding: 0.5em 0; border-bottom: 1px solid #ddd;}
+.user b {color: blue;} .assistant b {color: green;}
+.text {white-space: pre-wrap;}
+.plot {width: 100%; min-height: 420px;}
+table {border-collapse: collapse; font-size: 0.85em;} td, th {border: 1px solid #ccc; padding: 2px 6px;}"""
+
+# Draws every plot div from the figure JSON it references, so a figure shown twice is stored once.
+_RENDER_SCRIPT = """<script>
+document.querySelectorAll("div.plot").forEach(function (div) {
+  var spec = JSON.parse(document.getElementById(div.dataset.figure).textContent);
+  Plotly.newPlot(div, spec.data, spec.layout || {}, {responsive: true, showLink: false});
+});
+</script>"""
+
+def _plotlyjs_tag() -> str:
+    from plotly.offline import get_plotlyjs, get_plotlyjs_version
+    if EXPORT_PLOTLYJS == "inline":
+        return f"<script>{get_plotlyjs()}</script>"
+    return f'<script src="https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js" charset="utf-8"></script>'
+
+class _ChatHTMLWriter:
+    """Writes a chat as HTML straight to a file, emitting each distinct figure's JSON once."""
+
+    def __init__(self, out):
+        self.out = out
+        self.figures = {}
+
+    def figure(self, fig):
+        spec = figure_json(fig)
+        figure_id = self.figures.get(spec)
+        if figure_id is None:
+            figure_id = self.figures[spec] = f"fig-{hashlib.blake2b(spec.encode('utf-8'), digest_size=8).hexdigest()}"
+            # "</" would end the script element early.
+            escaped = spec.replace("</", "<\\/")
+            self.out.write(f'<script type="application/json" id="{figure_id}">{escaped}</script>\n')
+        self.out.write(f'<div class="plot" data-figure="{figure_id}"></div>\n')
+
+    def frame(self, df: pd.DataFrame):
+        shown = df.iloc[:EXPORT_MAX_ROWS]
+        for start in range(0, len(shown), EXPORT_PAGE_ROWS):
+            page = shown.iloc[start:start + EXPORT_PAGE_ROWS].to_html(border=0)
+            if start == 0:
+                self.out.write(page)
+            else:
+                self.out.write(f"<details><summary>Rows {start + 1}–{min(start + EXPORT_PAGE_ROWS, len(shown))}</summary>{page}</details>\n")
+        if len(df) > len(shown):
+            self.out.write(f"<p><i>{len(df) - len(shown)} more rows not exported.</i></p>\n")
+
+    def message(self, message):
+        role, content = message["role"], message["content"]
+        self.out.write(f'<div class="message {html.escape(role)}"><b>{html.escape(role.title())}:</b>\n')
+        if not isinstance(content, dict):
+            content = {"response_text": str(content)}
+        if content.get("response_text"):
+            self.out.write(f'<div class="text">{html.escape(content["response_text"])}</div>\n')
+        if content.get("plotly_fig"):
+            self.figure(content["plotly_fig"])
+        for fig in content.get("plotly_dashboard") or []:
+            if fig: self.figure(fig)
+        if isinstance(content.get("dataframe"), pd.DataFrame) and not content["dataframe"].empty:
+            self.frame(content["dataframe"])
+        if content.get("follow_up_questions"):
+            self.out.write("<ul>" + "".join(f"<li>{html.escape(q)}</li>" for q in content["follow_up_questions"]) + "</ul>\n")
+        self.out.write("</div>\n")
+
+def write_chat_html(messages, out, title: str = "Chat History"):
+    """Streams the chat to a text file object as standalone HTML, with charts and (paginated) result tables."""
+    out.write(f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title><style>{_STYLE}</style></head><body>\n")
+    writer = _ChatHTMLWriter(out)
+    for message in messages:
+        writer.message(message)
+    if writer.figures:
+        out.write(_plotlyjs_tag() + "\n" + _RENDER_SCRIPT + "\n")
+    out.write("</body></html>\n")
+
+def export_chat_html(messages, title: str = "Chat History") -> bytes:
+    """
+    Returns the chat export as bytes. It is rendered into a spooled temporary file, kept in
+    memory up to EXPORT_SPOOL_MB and on disk beyond, and removed as soon as it has been read.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=int(EXPORT_SPOOL_MB * 1024 * 1024), mode="w+b") as spool:
+        out = io.TextIOWrapper(spool, encoding="utf-8")
+        write_chat_html(messages, out, title)
+        out.flush()
+        spool.seek(0)
+        data = spool.read()
+        out.detach()
+    return data
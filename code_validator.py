@@ -0,0 +1,312 @@
+import ast
+import difflib
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+# Modules generated code may import; they are harmless and some (numpy) are not pre-imported.
+ALLOWED_IMPORTS = {"pandas", "numpy", "plotly.express", "plotly.graph_objects", "plotly.subplots", "math", "datetime"}
+DISALLOWED_BUILTINS = {
+    "eval", "exec", "compile", "open", "__import__", "input", "breakpoint", "globals", "locals", "vars",
+    "getattr", "setattr", "delattr", "exit", "quit", "help", "memoryview",
+}
+# Calls on df whose positional/keyword arguments name columns: method -> (positions, keywords).
+DF_COLUMN_ARGS = {
+    "groupby": ((0,), ("by",)),
+    "sort_values": ((0,), ("by",)),
+    "set_index": ((0,), ("keys",)),
+    "drop_duplicates": ((0,), ("subset",)),
+    "dropna": ((), ("subset",)),
+    "nlargest": ((1,), ("columns",)),
+    "nsmallest": ((1,), ("columns",)),
+    "pivot_table": ((), ("values", "index", "columns")),
+    "value_counts": ((0,), ("subset",)),
+}
+PX_COLUMN_KEYWORDS = {
+    "x", "y", "z", "color", "size", "symbol", "text", "facet_row", "facet_col", "hover_name", "names", "values",
+    "line_group", "animation_frame", "path", "dimensions", "hover_data", "custom_data",
+}
+# Calls whose keyword names become column names (df.assign(new=...), .agg(new=("col", "sum"))).
+NAMING_CALLS = {"assign", "agg", "aggregate"}
+# Methods that write into the object they are called on, and functions that write into their first argument.
+IN_PLACE_METHODS = {"update", "fill", "sort", "put", "itemset", "setflags", "resize", "__setitem__", "__delitem__"}
+IN_PLACE_FUNCTIONS = {"copyto", "place", "put", "putmask", "put_along_axis", "fill_diagonal", "shuffle"}
+REPAIR_CUTOFF = 0.8
+LLM_CALLS_PER_REPLAN = 2  # replan_node + code_generator
+
+def _fold(name: str) -> str:
+    return re.sub(r"[\s_\-]+", "", name).lower()
+
+def closest_column(name: str, columns: Iterable[str]) -> Optional[str]:
+    """Returns the one column name close to `name` (case, separators or a typo apart), or None if there is none or several."""
+    columns = list(columns)
+    folded = [column for column in columns if _fold(column) == _fold(name)]
+    if len(folded) == 1: return folded[0]
+    matches = difflib.get_close_matches(name, columns, n=2, cutoff=REPAIR_CUTOFF)
+    return matches[0] if len(matches) == 1 else None
+
+def _strings(node) -> List[ast.Constant]:
+    """String constants in a column position: a single string or a list/tuple of strings."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str): return [node]
+    if isinstance(node, (ast.List, ast.Tuple)): return [item for item in node.elts if isinstance(item, ast.Constant) and isinstance(item.value, str)]
+    return []
+
+def _is_df(node) -> bool:
+    return isinstance(node, ast.Name) and node.id == "df"
+
+def _is_df_groupby(node) -> bool:
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == "groupby" and _is_df(node.func.value)
+
+class _Checker(ast.NodeVisitor):
+    def __init__(self):
+        self.errors: List[str] = []
+        self.column_refs: List[ast.Constant] = []
+        # Names the snippet creates anywhere (columns, renames, aggregations); they are never repaired.
+        self.assigned = set()
+        self.assigns_result = False
+        # Once df is rebound or modified in place, its columns can no longer be known statically.
+        self.columns_unknown = False
+
+    def error(self, node, message: str):
+        self.errors.append(f"line {node.lineno}: {message}")
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            if alias.name not in ALLOWED_IMPORTS:
+                self.error(node, f"`import {alias.name}` is not allowed; `pd` and `px` are already available.")
+
+    def visit_ImportFrom(self, node):
+        if node.module not in ALLOWED_IMPORTS:
+            self.error(node, f"`from {node.module} import ...` is not allowed; `pd` and `px` are already available.")
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Store):
+            if node.id == "result": self.assigns_result = True
+            if node.id == "df": self.columns_unknown = True
+        elif node.id in DISALLOWED_BUILTINS:
+            self.error(node, f"`{node.id}` is not allowed.")
+
+    def visit_Attribute(self, node):
+        if isinstance(node.ctx, ast.Store) and _is_df(node.value):
+            self.columns_unknown = True
+        if node.attr.startswith("__"):
+            self.error(node, f"access to `{node.attr}` is not allowed.")
+        self.generic_visit(node)
+
+    def visit_Subscript(self, node):
+        if isinstance(node.ctx, ast.Store):
+            # Any write by label, to df or to a frame derived from it, may create the column it names.
+            keys = node.slice.elts if isinstance(node.slice, ast.Tuple) else [node.slice]
+            self.assigned.update(key.value for part in keys for key in _strings(part))
+        elif _is_df(node.value) or _is_df_groupby(node.value):
+            self.column_refs.extend(_strings(node.slice))
+        self.generic_visit(node)
+
+    def _record_names(self, node):
+        func = node.func
+        if not isinstance(func, ast.Attribute): return
+        if func.attr in NAMING_CALLS:
+            self.assigned.update(kw.arg for kw in node.keywords if kw.arg)
+        for kw in node.keywords:
+            if kw.arg == "name": self.assigned.update(key.value for key in _strings(kw.value))
+            if kw.arg == "columns" and isinstance(kw.value, ast.Dict): self._record_mapping(kw.value)
+        if func.attr in ("rename", "to_frame") and node.args:
+            if isinstance(node.args[0], ast.Dict): self._record_mapping(node.args[0])
+            else: self.assigned.update(key.value for key in _strings(node.args[0]))
+
+    def _record_mapping(self, node: ast.Dict):
+        self.assigned.update(key.value for value in node.values for key in _strings(value))
+
+    def visit_Call(self, node):
+        self._record_names(node)
+        func = node.func
+        if isinstance(func, ast.Attribute) and _is_df(func.value):
+            if any(kw.arg == "inplace" for kw in node.keywords) or func.attr in ("insert", "pop"):
+                self.columns_unknown = True
+            positions, keywords = DF_COLUMN_ARGS.get(func.attr, ((), ()))
+            for i in positions:
+                if i < len(node.args): self.column_refs.extend(_strings(node.args[i]))
+            for kw in node.keywords:
+                if kw.arg in keywords: self.column_refs.extend(_strings(kw.value))
+        elif isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name) and func.value.id == "px":
+            frame = node.args[0] if node.args else next((kw.value for kw in node.keywords if kw.arg == "data_frame"), None)
+            if frame is not None and _is_df(frame):
+                for kw in node.keywords:
+                    if kw.arg in PX_COLUMN_KEYWORDS: self.column_refs.extend(_strings(kw.value))
+        self.generic_visit(node)
+
+def _root(node) -> Optional[str]:
+    """The name an attribute, subscript or call chain starts from."""
+    while isinstance(node, (ast.Attribute, ast.Subscript, ast.Call, ast.Starred)):
+        node = node.func if isinstance(node, ast.Call) else node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+def _names(node) -> set:
+    return {n.id for n in ast.walk(node) if isinstance(n, ast.Name)}
+
+def _labels(node, iterated: bool) -> bool:
+    """True if node evaluates to column labels rather than data: a new list of them, or an Index being iterated."""
+    if isinstance(node, ast.Call) and node.args and isinstance(node.func, ast.Name) and node.func.id in ("list", "sorted"):
+        return isinstance(node.args[0], ast.Attribute) and node.args[0].attr == "columns"
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in ("tolist", "to_list"):
+        return isinstance(node.func.value, ast.Attribute) and node.func.value.attr == "columns"
+    return iterated and isinstance(node, ast.Attribute) and node.attr == "columns"
+
+def _bindings(tree):
+    """(bound names, value, iterated) for every assignment, loop, comprehension and with-target."""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign): targets, value, iterated = node.targets, node.value, False
+        elif isinstance(node, (ast.AnnAssign, ast.AugAssign, ast.NamedExpr)) and node.value is not None: targets, value, iterated = [node.target], node.value, False
+        elif isinstance(node, (ast.For, ast.AsyncFor, ast.comprehension)): targets, value, iterated = [node.target], node.iter, True
+        elif isinstance(node, ast.withitem) and node.optional_vars is not None: targets, value, iterated = [node.optional_vars], node.context_expr, False
+        else: continue
+        names = {n.id for target in targets for n in ast.walk(target) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store)}
+        if names: yield names, value, iterated
+
+def _is_column_key(node, tainted) -> bool:
+    """A key selecting whole columns, so `df[key] = ...` replaces them instead of writing into them."""
+    if isinstance(node, ast.Constant): return not isinstance(node.value, (bool, type(None)))
+    if isinstance(node, (ast.List, ast.Tuple)): return all(isinstance(item, ast.Constant) for item in node.elts)
+    return isinstance(node, ast.Name) and node.id not in tainted
+
+def writes_in_place(code: str) -> bool:
+    """
+    True if code may write into the arrays behind df or anything taken from it, so it must
+    run on a deep copy. Adding, replacing or deleting whole columns and rebinding df only
+    change the frame object, which a shallow copy keeps private. Anything unclear counts as a write.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return True
+    # Names that may hold df or a view of its data: df itself, function arguments, and
+    # anything computed from them except lists of column labels.
+    tainted = {"df"}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ClassDef): return True
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+            tainted.update(arg.arg for arg in ast.walk(node.args) if isinstance(arg, ast.arg))
+    bindings = list(_bindings(tree))
+    changed = True
+    while changed:
+        changed = False
+        for names, value, iterated in bindings:
+            if names - tainted and _names(value) & tainted and not _labels(value, iterated):
+                tainted |= names
+                changed = True
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.AugAssign) and not isinstance(node.target, ast.Name) and _root(node.target) in tainted:
+            return True
+        if isinstance(node, (ast.Subscript, ast.Attribute)) and isinstance(node.ctx, (ast.Store, ast.Del)) and _root(node) in tainted:
+            if isinstance(node, ast.Subscript) and _is_df(node.value) and _is_column_key(node.slice, tainted): continue
+            if isinstance(node, ast.Attribute) and _is_df(node.value): continue
+            return True
+        if isinstance(node, ast.Call):
+            if any(kw.arg == "inplace" and not (isinstance(kw.value, ast.Constant) and kw.value.value is False) for kw in node.keywords):
+                return True
+            func = node.func
+            if isinstance(func, ast.Attribute) and func.attr in IN_PLACE_METHODS and _root(func.value) in tainted:
+                return True
+            name = func.attr if isinstance(func, ast.Attribute) else func.id if isinstance(func, ast.Name) else None
+            if name in IN_PLACE_FUNCTIONS and node.args and _names(node.args[0]) & tainted:
+                return True
+    return False
+
+def _apply_edits(code: str, edits) -> str:
+    """Applies (lineno, col, end_lineno, end_col, text) edits; ast offsets are UTF-8 byte columns."""
+    data = code.encode("utf-8")
+    line_starts = [0] + [match.end() for match in re.finditer(b"\n", data)]
+    for lineno, col, end_lineno, end_col, text in sorted(edits, key=lambda edit: (edit[0], edit[1]), reverse=True):
+        start, end = line_starts[lineno - 1] + col, line_starts[end_lineno - 1] + end_col
+        data = data[:start] + text.encode("utf-8") + data[end:]
+    return data.decode("utf-8")
+
+class CodeCheck:
+    """The outcome of validate_code: the code to run (repaired if needed), the errors left and the repairs made."""
+
+    def __init__(self, code: str, errors: List[str], repairs: List[str], repaired_columns: bool = False):
+        self.code = code
+        self.errors = errors
+        self.repairs = repairs
+        self.repaired_columns = repaired_columns
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+def _check(code: str, columns: List[str]):
+    """One validation pass; returns (errors, edits, repairs)."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return [f"line {e.lineno}: syntax error: {e.msg}"], [], []
+    checker = _Checker()
+    checker.visit(tree)
+    errors, edits, repairs = list(checker.errors), [], []
+
+    if not checker.columns_unknown:
+        known = set(columns) | checker.assigned
+        for ref in checker.column_refs:
+            if ref.value in known: continue
+            match = closest_column(ref.value, columns)
+            if match is not None:
+                edits.append((ref.lineno, ref.col_offset, ref.end_lineno, ref.end_col_offset, repr(match)))
+                repairs.append(f"column '{ref.value}' -> '{match}'")
+            else:
+                shown = ", ".join(columns[:20]) + (", ..." if len(columns) > 20 else "")
+                errors.append(f"line {ref.lineno}: column '{ref.value}' is not in df (columns: {shown}).")
+
+    if not checker.assigns_result:
+        last = tree.body[-1] if tree.body else None
+        # A trailing expression is what the snippet meant to return, unless it only prints or shows something.
+        shows = isinstance(last, ast.Expr) and isinstance(last.value, ast.Call) and (
+            (isinstance(last.value.func, ast.Name) and last.value.func.id == "print")
+            or (isinstance(last.value.func, ast.Attribute) and last.value.func.attr == "show"))
+        if isinstance(last, ast.Expr) and not shows:
+            edits.append((last.lineno, last.col_offset, last.lineno, last.col_offset, "result = "))
+            repairs.append("assigned the last expression to `result`")
+        else:
+            errors.append("the code never assigns a variable named `result`.")
+    return errors, edits, repairs
+
+def validate_code(code: str, columns: Iterable[Any]) -> CodeCheck:
+    """
+    Checks generated code without running it: syntax, imports, disallowed builtins and
+    dunder attributes, a `result` assignment, and column names used on `df`. Near-miss
+    column names and a trailing expression without `result =` are repaired in place.
+    """
+    columns = [column for column in columns if isinstance(column, str)]
+    errors, edits, repairs = _check(code, columns)
+    if not edits:
+        return CodeCheck(code, errors, [])
+    repaired = _apply_edits(code, edits)
+    # Repairs only rewrite names and add an assignment, so the second pass has nothing left to repair.
+    errors, _, _ = _check(repaired, columns)
+    return CodeCheck(repaired, errors, repairs, repaired_columns=any(repair.startswith("column") for repair in repairs))
+
+class ValidatorStats:
+    """Tracks how many snippets were checked, rejected before execution and repaired locally, and the LLM calls saved."""
+
+    def __init__(self):
+        self.checked = 0
+        self.rejected = 0
+        self.repaired = 0
+        self.llm_calls_saved = 0
+        self._lock = threading.Lock()
+
+    def record(self, check: CodeCheck):
+        with self._lock:
+            self.checked += 1
+            if not check.ok:
+                self.rejected += 1
+            elif check.repairs:
+                self.repaired += 1
+                # A wrong column fails at execution and costs a re-plan and a regeneration.
+                if check.repaired_columns: self.llm_calls_saved += LLM_CALLS_PER_REPLAN
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {"checked": self.checked, "rejected": self.rejected, "repaired": self.repaired, "llm_calls_saved": self.llm_calls_saved}
+
+validator_stats = ValidatorStats()
@@ -1,53 +1,378 @@
+import numpy as np
 import pandas as pd
 import streamlit as st
 import io
+import os
+import re
+from frame_utils import same_memory
+from upload_cache import get_upload_cache
 
-def load_data(uploaded_file):
-    """Loads data from a CSV or Excel file into a pandas DataFrame."""
+CSV_CHUNK_ROWS = 200_000
+CATEGORY_MAX_RATIO = 0.5
+MEMORY_BUDGET_MB = float(os.getenv("DATASENSE_MEMORY_BUDGET_MB", "2048"))
+
+def optimize_dtypes(df, category_columns=None):
+    """
+    Shrinks a DataFrame in place by turning low-cardinality strings into categoricals.
+    Numbers keep their width: float32 sums drift over millions of rows, and narrower
+    integers silently wrap around in generated arithmetic (50000 * 100000 in int32).
+    """
+    for col in df.columns:
+        series = df[col]
+        if series.dtype == 'object':
+            if category_columns is not None:
+                if col in category_columns:
+                    df[col] = series.astype('category')
+            elif len(series) and series.nunique() / len(series) <= CATEGORY_MAX_RATIO:
+                df[col] = series.astype('category')
+    return df
+
+def _combine_chunks(chunks):
+    """Concatenates converted chunks, unioning categoricals so they stay categorical."""
+    if len(chunks) == 1:
+        return chunks[0]
+    column_order = list(chunks[0].columns)
+    categorical = [col for col in column_order if all(isinstance(c[col].dtype, pd.CategoricalDtype) for c in chunks)]
+    merged = {}
+    for col in categorical:
+        merged[col] = pd.api.types.union_categoricals([c[col] for c in chunks], ignore_order=True)
+        for c in chunks:
+            del c[col]
+    df = pd.concat(chunks, ignore_index=True)
+    chunks.clear()
+    for col in categorical:
+        df.insert(column_order.index(col), col, merged.pop(col))
+    return df
+
+class _DtypeConflict(Exception):
+    def __init__(self, columns):
+        super().__init__(f"Columns parsed with different types in different chunks: {sorted(columns)}")
+        self.columns = columns
+
+def _conflicting_columns(dtypes, chunk):
+    """Columns whose parsed type in chunk disagrees with earlier chunks; ints and floats mix safely."""
+    conflicts = set()
+    for col, dtype in chunk.dtypes.items():
+        first = dtypes.setdefault(col, dtype)
+        if dtype != first and not (first.kind in "iuf" and dtype.kind in "iuf"):
+            conflicts.add(col)
+    return conflicts
+
+def _read_csv_chunked(uploaded_file, progress_callback=None, memory_budget_mb=None):
+    """
+    Reads a CSV in chunks, converting each chunk before the next is parsed so the
+    raw and converted copies are never held at once. When the converted frame
+    outgrows the memory budget, it is thinned to a uniform random sample.
+    Columns whose type differs between chunks (numbers first, text later) are
+    read again as text throughout, as a single read would type them.
+    """
+    text_columns = set()
+    while True:
+        try:
+            return _read_csv_pass(uploaded_file, text_columns, progress_callback, memory_budget_mb)
+        except _DtypeConflict as conflict:
+            text_columns |= conflict.columns
+            uploaded_file.seek(0)
+
+def _read_csv_pass(uploaded_file, text_columns, progress_callback, memory_budget_mb):
+    budget_bytes = (memory_budget_mb or MEMORY_BUDGET_MB) * 1024 * 1024
+    total_bytes = getattr(uploaded_file, "size", None)
+    rng = np.random.default_rng(0)
+    sample_fraction = 1.0
+    chunks, held_bytes, category_columns, dtypes = [], 0, None, {}
+
+    # Closing the reader detaches it from the file, which a conflict needs to read again.
+    with pd.read_csv(uploaded_file, chunksize=CSV_CHUNK_ROWS, dtype={col: str for col in text_columns} or None) as reader:
+        for chunk in reader:
+            conflicts = _conflicting_columns(dtypes, chunk)
+            if conflicts: raise _DtypeConflict(conflicts)
+            if category_columns is None:
+                object_cols = chunk.select_dtypes(include='object')
+                category_columns = {col for col in object_cols.columns if object_cols[col].nunique() / max(len(chunk), 1) <= CATEGORY_MAX_RATIO}
+            if sample_fraction < 1.0:
+                chunk = chunk[rng.random(len(chunk)) < sample_fraction]
+            chunk = optimize_dtypes(chunk, category_columns)
+            chunks.append(chunk)
+            held_bytes += chunk.memory_usage(deep=True).sum()
+
+            while held_bytes > budget_bytes:
+                sample_fraction /= 2
+                chunks = [c[rng.random(len(c)) < 0.5] for c in chunks]
+                held_bytes = sum(c.memory_usage(deep=True).sum() for c in chunks)
+
+            if progress_callback:
+                rows_read = sum(len(c) for c in chunks)
+                fraction = min(uploaded_file.tell() / total_bytes, 1.0) if total_bytes else 0.0
+                progress_callback(fraction, f"Parsed {rows_read:,} rows...")
+
+    if not chunks:
+        return pd.read_csv(uploaded_file)
+    df = _combine_chunks(chunks)
+    df.attrs["sample_fraction"] = sample_fraction
+    return df
+
+def load_data(uploaded_file, progress_callback=None, memory_budget_mb=None):
+    """
+    Loads data from a CSV or Excel file into a pandas DataFrame.
+    CSV files are streamed in chunks; progress_callback(fraction, text) is called
+    after each chunk and memory_budget_mb overrides DATASENSE_MEMORY_BUDGET_MB.
+    """
     if uploaded_file is None:
         return None
     try:
+        cache = get_upload_cache()
+        cache_key = cache.key_for(uploaded_file)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         file_extension = uploaded_file.name.split('.')[-1].lower()
         if file_extension == 'csv':
-            df = pd.read_csv(uploaded_file)
+            df = _read_csv_chunked(uploaded_file, progress_callback, memory_budget_mb)
         elif file_extension in ['xls', 'xlsx']:
-            df = pd.read_excel(uploaded_file)
+            df = optimize_dtypes(pd.read_excel(uploaded_file))
         else:
             st.error("Unsupported file format. Please upload a CSV or Excel file.")
             return None
+        if df.attrs.get("sample_fraction", 1.0) < 1.0:
+            st.warning(f"The file exceeds the memory budget, so a {df.attrs['sample_fraction']:.1%} random sample of its rows was loaded.")
+        else:
+            cache.put(cache_key, df)
         return df
     except Exception as e:
         st.error(f"Error loading data: {e}")
         return None
 
-def get_data_quality_report(df):
-    """Generates a comprehensive data quality report for a DataFrame."""
+def _column_hash(series):
+    """Hashes every cell of a column into a uint64 array in one vectorized pass."""
+    try:
+        return pd.util.hash_pandas_object(series, index=False).to_numpy()
+    except TypeError:
+        # Unhashable cells (lists, dicts) are hashed by their string representation.
+        return pd.util.hash_pandas_object(series.astype(str), index=False).to_numpy()
+
+def _has_mixed_types(series):
+    """Detects mixed Python types in a column using pandas' dtype inference."""
+    if series.dtype != 'object':
+        return False
+    return pd.api.types.infer_dtype(series, skipna=True).startswith('mixed')
+
+PROFILE_SKETCH_ROWS = int(os.getenv("DATASENSE_PROFILE_SKETCH_ROWS", "100000"))
+SKETCH_PRECISION = 11
+SKETCH_MAX_RANK = 32
+
+class DistinctSketch:
+    """
+    A HyperLogLog distinct-count sketch (2**precision registers, ~2.3% error at the
+    default) that keeps a counter per register and rank instead of only the maximum
+    rank, so the hashes of deleted rows can be subtracted again.
+    """
+
+    def __init__(self, precision=SKETCH_PRECISION, counts=None):
+        self.precision = precision
+        self.counts = counts if counts is not None else np.zeros((1 << precision) * (SKETCH_MAX_RANK + 1), dtype=np.int64)
+
+    def _cells(self, hashes):
+        low_bits = 64 - self.precision
+        buckets = (hashes >> np.uint64(low_bits)).astype(np.int64)
+        rest = hashes & np.uint64((1 << low_bits) - 1)
+        # Rank = position of the first set bit in the low bits, counted from the top.
+        bit_length = np.where(rest > 0, np.floor(np.log2(np.maximum(rest, 1).astype(np.float64))) + 1, 0).astype(np.int64)
+        ranks = np.minimum(low_bits - bit_length + 1, SKETCH_MAX_RANK)
+        return buckets * (SKETCH_MAX_RANK + 1) + ranks
+
+    def add(self, hashes):
+        if len(hashes): self.counts += np.bincount(self._cells(hashes), minlength=len(self.counts))
+        return self
+
+    def remove(self, hashes):
+        if len(hashes): self.counts -= np.bincount(self._cells(hashes), minlength=len(self.counts))
+        return self
+
+    def copy(self):
+        return DistinctSketch(self.precision, self.counts.copy())
+
+    def estimate(self):
+        occupied = self.counts.reshape(1 << self.precision, SKETCH_MAX_RANK + 1) > 0
+        registers = np.where(occupied.any(axis=1), SKETCH_MAX_RANK - np.argmax(occupied[:, ::-1], axis=1), 0)
+        m = len(registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.exp2(-registers.astype(np.float64)))
+        empty = int((registers == 0).sum())
+        if estimate <= 2.5 * m and empty:
+            estimate = m * np.log(m / empty)
+        return int(round(estimate))
+
+def _row_weight(name):
+    """An odd per-column multiplier, so a column's share of the row hash can be subtracted again."""
+    return np.uint64(int(pd.util.hash_array(np.array([str(name)], dtype=object))[0]) | 1)
+
+def _positions(old_index, new_index):
+    """Maps new rows to old row positions: None if the rows are the same, False if they cannot be matched."""
+    if new_index.equals(old_index): return None
+    if not (old_index.is_unique and new_index.is_unique) or len(new_index) > len(old_index): return False
+    positions = old_index.get_indexer(new_index)
+    return False if (positions < 0).any() else positions
+
+def _same_values(old, new, positions):
+    if old.dtype != new.dtype: return False
+    if positions is None:
+        return same_memory(old, new) or old.equals(new)
+    return old.iloc[positions].equals(new)
+
+class DataProfile:
+    """
+    Per-column statistics of a frame (nulls, distinct values, dtype, mixed types)
+    and a row hash for duplicate detection. Frames above PROFILE_SKETCH_ROWS rows
+    count distinct values with DistinctSketch, which lets updated() re-profile a
+    mutated copy by hashing only changed columns and deleted rows.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.rows = len(df)
+        self.sketched = len(df) > PROFILE_SKETCH_ROWS
+        self.stats, self.sketches = {}, {}
+        self.row_hash = np.zeros(len(df), dtype=np.uint64)
+        self._duplicate_rows = None
+        for name in df.columns:
+            hashes = self._profile_column(name, df[name])
+            self.row_hash += hashes * _row_weight(name)
+
+    def _profile_column(self, name, series):
+        hashes = _column_hash(series)
+        is_missing = series.isna().to_numpy()
+        present = hashes[~is_missing]
+        self.sketches[name] = DistinctSketch().add(present) if self.sketched else None
+        self.stats[name] = {
+            "name": name,
+            "dtype": series.dtype,
+            "missing": int(is_missing.sum()),
+            "unique": self.sketches[name].estimate() if self.sketched else len(pd.unique(present)),
+            "approximate": self.sketched,
+            "mixed_types": _has_mixed_types(series),
+        }
+        self._exact_categories(series)
+        return hashes
+
+    def _exact_categories(self, series):
+        # Categorical columns count their used codes exactly; it is as cheap as the sketch.
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()
+            used = np.bincount(codes[codes >= 0], minlength=len(series.cat.categories)) > 0
+            self.stats[series.name].update(unique=int(used.sum()), approximate=False)
+
+    @property
+    def columns(self):
+        return [self.stats[name] for name in self.df.columns]
+
+    @property
+    def duplicate_rows(self):
+        if self._duplicate_rows is None:
+            self._duplicate_rows = int(pd.Series(self.row_hash).duplicated().sum()) if self.df.shape[1] else 0
+        return self._duplicate_rows
+
+    def updated(self, df):
+        """
+        Returns the profile of df, a modified version of this profile's frame. Columns
+        whose values are unchanged keep their statistics; if rows were only deleted or
+        reordered, their sketches drop the deleted rows' hashes. Everything else is
+        re-profiled. Small frames and unmatched rows fall back to a full profile.
+        """
+        old = self.df
+        positions = _positions(old.index, df.index)
+        if not self.sketched or len(df) <= PROFILE_SKETCH_ROWS or positions is False or df.columns.has_duplicates:
+            return DataProfile(df)
+        removed = None
+        if positions is not None:
+            keep = np.zeros(len(old), dtype=bool)
+            keep[positions] = True
+            removed = np.flatnonzero(~keep)
+        profile = DataProfile.__new__(DataProfile)
+        profile.df, profile.rows, profile.sketched = df, len(df), True
+        profile.stats, profile.sketches, profile._duplicate_rows = {}, {}, None
+        profile.row_hash = self.row_hash.copy() if positions is None else self.row_hash[positions]
+        for name in df.columns:
+            series = df[name]
+            if name in self.stats and _same_values(old[name], series, positions):
+                stats, sketch = dict(self.stats[name]), self.sketches[name]
+                if removed is not None and len(removed):
+                    gone = old[name].iloc[removed]
+                    gone_missing = gone.isna().to_numpy()
+                    sketch = sketch.copy().remove(_column_hash(gone)[~gone_missing])
+                    stats.update(missing=stats["missing"] - int(gone_missing.sum()), unique=sketch.estimate(), approximate=True)
+                    if stats["mixed_types"]: stats["mixed_types"] = _has_mixed_types(series)
+                profile.stats[name], profile.sketches[name] = stats, sketch
+                profile._exact_categories(series)
+                continue
+            if name in self.stats:
+                previous = old[name] if positions is None else old[name].iloc[positions]
+                profile.row_hash -= _column_hash(previous) * _row_weight(name)
+            profile.row_hash += profile._profile_column(name, series) * _row_weight(name)
+        for name in self.stats:
+            if name not in df.columns:
+                previous = old[name] if positions is None else old[name].iloc[positions]
+                profile.row_hash -= _column_hash(previous) * _row_weight(name)
+        return profile
+
+SAMPLE_STRATA_MAX = 200
+
+def _strata_column(profile):
+    """Picks the non-numeric column with the fewest distinct values (at least 2, at most SAMPLE_STRATA_MAX)."""
+    if profile is None: return None
+    candidates = [stats for stats in profile.columns if stats["dtype"].kind not in "biufcmM" and 2 <= stats["unique"] <= SAMPLE_STRATA_MAX]
+    return min(candidates, key=lambda stats: stats["unique"])["name"] if candidates else None
+
+def stratified_sample(df, rows, profile=None, seed=0):
+    """
+    Returns about `rows` rows of df in their original order. With a profile, every
+    group of the lowest-cardinality categorical column is sampled at the same rate
+    and keeps at least one row; otherwise rows are drawn uniformly.
+    """
+    if len(df) <= rows: return df
+    rng = np.random.default_rng(seed)
+    column = _strata_column(profile)
+    if column is None:
+        return df.iloc[np.sort(rng.choice(len(df), rows, replace=False))]
+    codes = pd.factorize(df[column], use_na_sentinel=True)[0] + 1
+    sizes = np.bincount(codes)
+    keep = rng.random(len(df)) < rows / len(df)
+    # The first row of every group is always kept, so small groups are represented.
+    first = np.empty(len(sizes), dtype=np.int64)
+    first[codes[::-1]] = np.arange(len(df) - 1, -1, -1)
+    keep[first[sizes > 0]] = True
+    return df.iloc[np.flatnonzero(keep)]
+
+def get_data_quality_report(df, profile=None):
+    """
+    Generates a comprehensive data quality report for a DataFrame. With a
+    DataProfile of the frame it only renders, without scanning the data.
+    """
     if df is None:
         return "No data available."
 
+    profile = profile or DataProfile(df)
     report_buffer = io.StringIO()
     
     report_buffer.write("### 📊 Data Quality & Cleaning Suggestions\n\n")
     report_buffer.write("Here's a quick overview of your dataset's quality:\n\n")
 
    
-    missing_values = df.isnull().sum()
-    total_missing = missing_values.sum()
+    total_missing = sum(col["missing"] for col in profile.columns)
     if total_missing > 0:
         report_buffer.write(f"**Missing Values:** Found **{total_missing}** missing values. \n")
-        missing_per_column = missing_values[missing_values > 0]
         report_buffer.write("Columns with missing data:\n")
-        for col, count in missing_per_column.items():
-            percentage = (count / len(df)) * 100
-            report_buffer.write(f"- **{col}:** {count} missing ({percentage:.2f}%)\n")
+        for col in profile.columns:
+            if col["missing"] > 0:
+                percentage = (col["missing"] / profile.rows) * 100
+                report_buffer.write(f"- **{col['name']}:** {col['missing']} missing ({percentage:.2f}%)\n")
         report_buffer.write("*Suggestion:* Consider imputation (e.g., filling with mean/median/mode) or removing rows/columns with excessive missing data.\n\n")
     else:
         report_buffer.write("**Missing Values:** ✅ Excellent! No missing values found.\n\n")
 
     
-    duplicate_rows = df.duplicated().sum()
+    duplicate_rows = profile.duplicate_rows
     if duplicate_rows > 0:
-        percentage = (duplicate_rows / len(df)) * 100
+        percentage = (duplicate_rows / profile.rows) * 100
         report_buffer.write(f"**Duplicate Rows:** Found **{duplicate_rows}** duplicate rows ({percentage:.2f}% of the data).\n")
         report_buffer.write("*Suggestion:* You can remove these duplicates to prevent skewed analysis.\n\n")
     else:
@@ -55,17 +380,15 @@ def get_data_quality_report(df):
 
    
     report_buffer.write("**Data Types & Column Summary:**\n")
-    for col in df.columns:
-        dtype = df[col].dtype
-        unique_vals = df[col].nunique()
-        report_buffer.write(f"- **{col}** (`{dtype}`): {unique_vals} unique values. \n")
+    for col in profile.columns:
+        dtype = col["dtype"]
+        unique_vals = col["unique"]
+        report_buffer.write(f"- **{col['name']}** (`{dtype}`): {'~' if col['approximate'] else ''}{unique_vals} unique values. \n")
         
-        if hasattr(df[col], 'apply'):
-            mixed_types = df[col].apply(type).nunique() > 1
-            if mixed_types:
-                report_buffer.write("  - ⚠️ *Warning:* This column might contain mixed data types.\n")
+        if col["mixed_types"]:
+            report_buffer.write("  - ⚠️ *Warning:* This column might contain mixed data types.\n")
         
-        if dtype == 'object' and unique_vals > 50:
+        if (dtype == 'object' or isinstance(dtype, pd.CategoricalDtype)) and unique_vals > 50:
              report_buffer.write(f"  - ℹ️ *Info:* High cardinality ({unique_vals} unique values). Consider grouping or feature engineering.\n")
 
 
@@ -73,21 +396,109 @@ def get_data_quality_report(df):
     
     return report_buffer.getvalue()
 
-def get_data_summary(df):
-    """Creates a concise summary of the dataframe for the LLM agent."""
+SUMMARY_TOKEN_BUDGET = int(os.getenv("DATASENSE_SUMMARY_TOKENS", "1500"))
+SUMMARY_CELL_CHARS = 24
+SUMMARY_EXAMPLES = 3
+SUMMARY_EXAMPLE_SCAN_ROWS = 1000
+SUMMARY_SAMPLE_ROWS = 3
+SUMMARY_SAMPLE_COLUMNS = 8
+
+def estimate_tokens(text):
+    """Approximates the LLM token count of a string (about four characters per token)."""
+    return len(text) // 4 + 1
+
+def _truncate(value, limit=SUMMARY_CELL_CHARS):
+    if isinstance(value, (float, np.floating)):
+        text = f"{value:.6g}"
+    elif isinstance(value, pd.Timestamp) and value == value.normalize():
+        text = value.date().isoformat()
+    else:
+        text = str(value).replace("\n", " ").replace("|", "/")
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+def _tokenize(text):
+    return set(re.findall(r"[a-z0-9]+", str(text).lower()))
+
+class DataSummary:
+    """
+    Holds per-column summary rows for one dataset, computed once, and renders a
+    compact, prompt-aware summary that fits a token budget. Columns named in the
+    prompt come first; the rest follow in their original order until the budget
+    runs out.
+    """
+
+    def __init__(self, df, profile=None):
+        self.df = df
+        self.shape = df.shape
+        self.profile = profile or DataProfile(df)
+        self.column_rows = {col: self._column_row(df[col], self.profile.stats[col]) for col in df.columns}
+
+    @staticmethod
+    def _column_row(series, stats):
+        # Examples come from the first rows so that building the summary does not scan the column.
+        examples = series.head(SUMMARY_EXAMPLE_SCAN_ROWS).dropna().drop_duplicates().head(SUMMARY_EXAMPLES)
+        if examples.empty and len(series) > SUMMARY_EXAMPLE_SCAN_ROWS:
+            examples = series.dropna().head(1)
+        example_text = ", ".join(_truncate(value) for value in examples)
+        unique = f"~{stats['unique']}" if stats["approximate"] else stats["unique"]
+        return f"{stats['name']}|{stats['dtype']}|{stats['missing']}|{unique}|{example_text}"
+
+    def _rank_columns(self, prompt):
+        columns = list(self.column_rows)
+        if not prompt:
+            return columns
+        lowered, words = prompt.lower(), _tokenize(prompt)
+        def relevance(col):
+            name = str(col).lower()
+            if re.search(rf"(?<!\w){re.escape(name)}(?!\w)", lowered):
+                return 2
+            return 1 if _tokenize(name) & words else 0
+        return sorted(columns, key=lambda col: -relevance(col))
+
+    def render(self, prompt=None, token_budget=SUMMARY_TOKEN_BUDGET):
+        """Renders the summary, prioritising columns relevant to prompt, within token_budget tokens."""
+        header = (
+            f"Dataset Overview:\n- Shape: {self.shape} (rows, columns)\n"
+            f"- Columns (name|dtype|nulls|unique|examples):"
+        )
+        lines, used = [header], estimate_tokens(header)
+        ranked = self._rank_columns(prompt)
+        # Keep room to at least name every column the detailed rows cannot cover.
+        names_reserve = min(sum(estimate_tokens(str(col)) + 1 for col in ranked), token_budget // 3)
+        included = []
+        for col in ranked:
+            row = self.column_rows[col]
+            cost = estimate_tokens(row) + 1
+            if used + cost > token_budget - (names_reserve if len(included) + 1 < len(ranked) else 0):
+                break
+            lines.append(row)
+            included.append(col)
+            used += cost
+
+        omitted = [str(col) for col in ranked[len(included):]]
+        if omitted:
+            names = []
+            for name in omitted:
+                cost = estimate_tokens(name) + 1
+                if used + cost > token_budget - 4:
+                    break
+                names.append(name)
+                used += cost
+            rest = f" (+{len(omitted) - len(names)} more)" if len(names) < len(omitted) else ""
+            lines.append(f"- Other columns: {', '.join(names)}{rest}")
+            used += 4
+
+        sample_cols = included[:SUMMARY_SAMPLE_COLUMNS]
+        if sample_cols:
+            head = self.df[sample_cols].head(SUMMARY_SAMPLE_ROWS)
+            sample = "\n".join(["|".join(_truncate(col) for col in sample_cols)] + ["|".join(_truncate(v) for v in row) for row in head.itertuples(index=False)])
+            sample = f"- First {len(head)} rows:\n{sample}"
+            if used + estimate_tokens(sample) <= token_budget:
+                lines.append(sample)
+        return "\n".join(lines)
+
+def get_data_summary(df, prompt=None, token_budget=SUMMARY_TOKEN_BUDGET, profile=None):
+    """Creates a concise, token-budgeted summary of the dataframe for the LLM agent, from profile when given."""
     if df is None:
         return ""
-        
-    buffer = io.StringIO()
-    df.info(buf=buffer)
-    info_str = buffer.getvalue()
-
-    summary = f"""
-    Dataset Overview:
-    - Shape: {df.shape} (rows, columns)
-    - Column Names and Data Types:
-    {info_str}
-    - First 5 rows (head):
-    {df.head().to_string()}
-    """
-    return summary.strip()
+    return DataSummary(df, profile).render(prompt, token_budget)
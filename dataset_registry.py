@@ -0,0 +1,120 @@
+import hashlib
+import threading
+import uuid
+import weakref
+
+import pandas as pd
+
+from data_handler import DataProfile, DataSummary, get_data_quality_report
+
+def dataset_key(df: pd.DataFrame) -> str:
+    """Hashes a frame's contents, column names and dtypes."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def derived_key(parent_key: str) -> str:
+    """A key for a frame derived from a registered one; derived frames are not shared by content."""
+    return f"{parent_key.split('/')[0]}/{uuid.uuid4().hex[:16]}"
+
+class _Dataset:
+    def __init__(self, key: str, df: pd.DataFrame):
+        self.key = key
+        self.df = df
+        self.refs = 0
+        self.nbytes = int(df.memory_usage(deep=True).sum())
+        self.profile = None
+        self.summary = None
+        self.report = None
+        self.lock = threading.Lock()
+
+class DatasetHandle:
+    """A chat's reference to a shared dataset. The dataset is freed when its last handle is collected."""
+
+    def __init__(self, dataset: _Dataset):
+        self._dataset = dataset
+
+    @property
+    def key(self) -> str:
+        return self._dataset.key
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """The shared frame; treat it as read-only."""
+        return self._dataset.df
+
+    def _profile(self) -> DataProfile:
+        if self._dataset.profile is None:
+            self._dataset.profile = DataProfile(self._dataset.df)
+        return self._dataset.profile
+
+    @property
+    def profile(self) -> DataProfile:
+        with self._dataset.lock:
+            return self._profile()
+
+    @property
+    def summary(self) -> DataSummary:
+        with self._dataset.lock:
+            if self._dataset.summary is None:
+                self._dataset.summary = DataSummary(self._dataset.df, self._profile())
+            return self._dataset.summary
+
+    @property
+    def report(self) -> str:
+        with self._dataset.lock:
+            if self._dataset.report is None:
+                self._dataset.report = get_data_quality_report(self._dataset.df, self._profile())
+            return self._dataset.report
+
+class DatasetRegistry:
+    """
+    A process-wide, reference-counted registry of immutable DataFrames keyed by
+    content hash. Chats that load the same data share one frame together with its
+    profile, DataSummary and quality report, each of which is computed once.
+    """
+
+    def __init__(self):
+        self._datasets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, df: pd.DataFrame, key: str = None, profile: DataProfile = None) -> DatasetHandle:
+        """
+        Registers df (or finds an identical frame already registered) and returns a new handle to it.
+        A caller that derived df from a registered frame can pass its own key, which skips hashing the
+        contents, and a profile of df to seed the dataset with.
+        """
+        key = key or dataset_key(df)
+        with self._lock:
+            dataset = self._datasets.get(key)
+            if dataset is None:
+                dataset = self._datasets[key] = _Dataset(key, df)
+                dataset.profile = profile
+            dataset.refs += 1
+        handle = DatasetHandle(dataset)
+        weakref.finalize(handle, self._release, key)
+        return handle
+
+    def _release(self, key: str):
+        with self._lock:
+            dataset = self._datasets.get(key)
+            if dataset is None: return
+            dataset.refs -= 1
+            if dataset.refs <= 0:
+                del self._datasets[key]
+
+    def stats(self):
+        """Returns the number of shared datasets, the handles pointing at them and their memory footprint."""
+        with self._lock:
+            datasets = list(self._datasets.values())
+        return {"datasets": len(datasets), "references": sum(d.refs for d in datasets), "size_bytes": sum(d.nbytes for d in datasets)}
+
+_dataset_registry = None
+
+def get_dataset_registry() -> DatasetRegistry:
+    """Returns the process-wide dataset registry."""
+    global _dataset_registry
+    if _dataset_registry is None:
+        _dataset_registry = DatasetRegistry()
+    return _dataset_registry
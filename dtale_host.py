@@ -0,0 +1,152 @@
+"""
+A long-lived D-Tale server that hosts every chat's data under its own data ID.
+
+The app starts this module as a subprocess once per server process and talks
+to it over stdin/stdout with one JSON message per line. Every reply echoes its
+request's id, so a late answer to a timed-out request is never taken for the
+next one. DataFrames are handed over as uncompressed Arrow (Feather) files in
+shared memory, which the host memory-maps, so dtypes survive and nothing is
+re-parsed from CSV.
+"""
+import atexit
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+from sandbox import SHARED_DIR, arrow_compatible
+
+DTALE_HOST = "127.0.0.1"
+DTALE_START_TIMEOUT = float(os.getenv("DATASENSE_DTALE_START_TIMEOUT", "60"))
+
+def _serve():
+    """Host side: binds the D-Tale app, reports readiness, then serves load/drop requests."""
+    # Keep the real stdout for the protocol and send library chatter to stderr.
+    protocol = os.fdopen(os.dup(1), "w", buffering=1)
+    os.dup2(2, 1)
+
+    import pyarrow.feather as feather
+    from werkzeug.serving import make_server
+    import dtale.app
+    import dtale.global_state as global_state
+    from dtale.views import startup
+
+    app = dtale.app.build_app(reaper_on=False, host=DTALE_HOST)
+    server = make_server(DTALE_HOST, 0, app, threaded=True)
+    dtale.app.ACTIVE_HOST, dtale.app.ACTIVE_PORT = DTALE_HOST, server.server_port
+    base_url = f"http://{DTALE_HOST}:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # The socket is bound and listening once make_server returns, so the server is ready now.
+    protocol.write(json.dumps({"ready": True, "port": server.server_port}) + "\n")
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        try:
+            if request["op"] == "load":
+                df = feather.read_table(request["path"], memory_map=True).to_pandas()
+                instance = startup(base_url, data=df, name=request.get("name"), ignore_duplicate=True)
+                data_id = str(instance._data_id)
+                reply = {"ok": True, "data_id": data_id, "url": f"{base_url}/dtale/main/{data_id}"}
+            elif request["op"] == "drop":
+                global_state.cleanup(request["data_id"])
+                reply = {"ok": True}
+            else:
+                reply = {"ok": False, "error": f"Unknown operation '{request['op']}'."}
+        except Exception as e:
+            reply = {"ok": False, "error": str(e)}
+        reply["id"] = request.get("id")
+        protocol.write(json.dumps(reply) + "\n")
+
+class DtaleHost:
+    """App side handle for the D-Tale host process."""
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1,
+        )
+        self._replies = queue.Queue()
+        self._lock = threading.Lock()
+        self.port = None
+        threading.Thread(target=self._read_replies, daemon=True).start()
+
+    def _read_replies(self):
+        for line in self.process.stdout:
+            self._replies.put(json.loads(line))
+        self._replies.put({"ok": False, "error": "The interactive analysis host exited."})
+
+    def _reply(self, timeout):
+        try:
+            return self._replies.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("The interactive analysis host did not respond in time.")
+
+    def wait_ready(self, timeout=DTALE_START_TIMEOUT):
+        """Blocks until the host has sent its readiness handshake."""
+        if self.port is None:
+            with self._lock:
+                if self.port is None:
+                    handshake = self._reply(timeout)
+                    if not handshake.get("ready"):
+                        raise RuntimeError(handshake.get("error", "The interactive analysis host failed to start."))
+                    self.port = handshake["port"]
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def _request(self, message, timeout):
+        self.wait_ready()
+        message = dict(message, id=uuid.uuid4().hex)
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self.process.stdin.write(json.dumps(message) + "\n")
+            self.process.stdin.flush()
+            while True:
+                reply = self._reply(max(deadline - time.monotonic(), 0))
+                # Replies to earlier requests that timed out are dropped; the exit notice has no id.
+                if reply.get("id") in (message["id"], None): break
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error", "Unknown D-Tale host error."))
+        return reply
+
+    def load(self, df, name=None, timeout=DTALE_START_TIMEOUT):
+        """Hands df to the host and returns (data_id, url)."""
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        path = os.path.join(SHARED_DIR, f"datasense-dtale-{uuid.uuid4().hex}.feather")
+        try:
+            try:
+                feather.write_feather(arrow_compatible(df.reset_index(drop=True)), path, compression="uncompressed")
+            except (pa.ArrowException, TypeError, ValueError) as e:
+                raise RuntimeError(f"The data could not be handed to the interactive analysis host: {e}")
+            reply = self._request({"op": "load", "path": path, "name": name}, timeout)
+        finally:
+            if os.path.exists(path): os.remove(path)
+        return reply["data_id"], reply["url"]
+
+    def drop(self, data_id, timeout=10):
+        if self.is_alive():
+            self._request({"op": "drop", "data_id": data_id}, timeout)
+
+    def terminate(self):
+        if self.is_alive():
+            self.process.terminate()
+
+_dtale_host = None
+_dtale_host_lock = threading.Lock()
+
+def get_dtale_host() -> DtaleHost:
+    """Returns the process-wide D-Tale host, starting (and thereby pre-warming) it if needed."""
+    global _dtale_host
+    with _dtale_host_lock:
+        if _dtale_host is None or not _dtale_host.is_alive():
+            _dtale_host = DtaleHost()
+            atexit.register(_dtale_host.terminate)
+    return _dtale_host
+
+if __name__ == "__main__":
+    _serve()
@@ -0,0 +1,103 @@
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+DASHBOARD_PATTERN = re.compile(r"\bdashboard\b", re.IGNORECASE)
+HISTOGRAM_PATTERN = re.compile(r"\b(histogram|distribution)\b", re.IGNORECASE)
+BAR_CHART_PATTERN = re.compile(r"\bbar\s*(chart|graph|plot)s?\b", re.IGNORECASE)
+GROUP_BY_PATTERN = re.compile(r"\s(by|per|for each|across)\s", re.IGNORECASE)
+# Prompts that ask for anything beyond a plain sum/count chart need the LLM to write code.
+ANALYTIC_PATTERN = re.compile(
+    r"\b(average|avg|mean|median|count|top|bottom|max|min|maximum|minimum|percent|percentage|ratio|rate|trend|"
+    r"over time|where|filter|only|compare|correlat\w*|growth|change|excluding|without|group|grouped|stacked|color|log)\b",
+    re.IGNORECASE,
+)
+
+def find_columns(prompt: str, columns: Iterable[Any]) -> List[str]:
+    """Returns the column names mentioned verbatim (case-insensitive) in the prompt, in order of appearance."""
+    found = []
+    for col in sorted((str(c) for c in columns), key=len, reverse=True):
+        match = re.search(rf"(?<![\w]){re.escape(col)}(?![\w])", prompt, re.IGNORECASE)
+        if match and not any(match.start() < end and start < match.end() for start, end, _ in found):
+            found.append((match.start(), match.end(), col))
+    return [col for _, _, col in sorted(found)]
+
+def fast_route(prompt: str, columns: Iterable[Any]) -> Optional[Dict[str, Any]]:
+    """
+    Classifies obvious prompts locally. Returns {"intent", "tool_params"} when the
+    intent is unambiguous (tool_params is empty if the columns could not be resolved),
+    or None to defer to the LLM router.
+    """
+    if DASHBOARD_PATTERN.search(prompt):
+        return {"intent": "dashboard", "tool_params": {}}
+
+    is_histogram = bool(HISTOGRAM_PATTERN.search(prompt))
+    is_bar_chart = bool(BAR_CHART_PATTERN.search(prompt))
+    if is_histogram == is_bar_chart or ANALYTIC_PATTERN.search(prompt):
+        return None
+
+    mentioned = find_columns(prompt, columns)
+    if is_histogram:
+        params = {"col": mentioned[0], "title": f"Distribution of {mentioned[0]}"} if len(mentioned) == 1 else {}
+        return {"intent": "histogram", "tool_params": params}
+
+    params = {}
+    if len(mentioned) == 2:
+        split = GROUP_BY_PATTERN.search(prompt)
+        if split:
+            # "bar chart of <value> by <category>": the column after the split is the x-axis.
+            before = find_columns(prompt[:split.start()], mentioned)
+            after = find_columns(prompt[split.end():], mentioned)
+            if len(before) == 1 and len(after) == 1:
+                params = {"x_col": after[0], "y_col": before[0], "title": f"{before[0]} by {after[0]}"}
+    return {"intent": "bar_chart", "tool_params": params}
+
+class RouterStats:
+    """Tracks how often the fast path answers and the LLM latency it avoids."""
+
+    SMOOTHING = 0.2
+
+    def __init__(self):
+        self.requests = 0
+        self.fast_hits = 0
+        self.saved_seconds = 0.0
+        self.last_saved_seconds = 0.0
+        self.router_latency = None
+        self.extractor_latency = None
+        self._lock = threading.Lock()
+
+    def _smooth(self, current, observed):
+        return observed if current is None else current + self.SMOOTHING * (observed - current)
+
+    def record_llm_route(self, seconds: float):
+        with self._lock:
+            self.requests += 1
+            self.last_saved_seconds = 0.0
+            self.router_latency = self._smooth(self.router_latency, seconds)
+
+    def record_llm_extraction(self, seconds: float):
+        with self._lock:
+            self.extractor_latency = self._smooth(self.extractor_latency, seconds)
+
+    def record_fast_route(self, filled_params: bool):
+        with self._lock:
+            self.requests += 1
+            self.fast_hits += 1
+            saved = (self.router_latency or 0.0) + ((self.extractor_latency or 0.0) if filled_params else 0.0)
+            self.last_saved_seconds = saved
+            self.saved_seconds += saved
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.fast_hits / self.requests if self.requests else 0.0
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "requests": self.requests,
+            "fast_hits": self.fast_hits,
+            "hit_ratio": self.hit_ratio,
+            "last_saved_seconds": self.last_saved_seconds,
+            "avg_saved_seconds": self.saved_seconds / self.requests if self.requests else 0.0,
+        }
+
+router_stats = RouterStats()
@@ -0,0 +1,132 @@
+import datetime
+import os
+import weakref
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+
+WEBGL_POINT_THRESHOLD = int(os.getenv("DATASENSE_WEBGL_POINTS", "5000"))
+LINE_TARGET_POINTS = int(os.getenv("DATASENSE_LINE_POINTS", "2000"))
+DECIMATION_METHOD = os.getenv("DATASENSE_DECIMATION", "lttb")
+# Plotly Express already picks scattergl for large frames; figures built with graph_objects do not.
+SCATTER_TYPES = ("scatter", "scattergl")
+
+_figure_json = {}
+
+def figure_json(fig) -> str:
+    """Serializes a finished figure once; later calls return the cached JSON until the figure is collected."""
+    key = id(fig)
+    spec = _figure_json.get(key)
+    if spec is None:
+        spec = _figure_json[key] = pio.to_json(fig, validate=False)
+        weakref.finalize(fig, _figure_json.pop, key, None)
+    return spec
+
+def figure_from_json(spec: str):
+    """Rebuilds a figure from figure_json() output and keeps the JSON, so rendering it does not serialize it again."""
+    fig = pio.from_json(spec, skip_invalid=True)
+    key = id(fig)
+    _figure_json[key] = spec
+    weakref.finalize(fig, _figure_json.pop, key, None)
+    return fig
+
+def _numeric_axis(values: np.ndarray) -> np.ndarray:
+    """Maps x values onto floats for area computations; falls back to positions for categorical axes."""
+    if values.dtype.kind == "O" and len(values) and isinstance(values[0], datetime.date):
+        # Plotly Express hands datetime axes over as datetime objects.
+        try:
+            values = pd.to_datetime(values).to_numpy()
+        except (TypeError, ValueError):
+            return np.arange(len(values), dtype="float64")
+    if values.dtype.kind == "M":
+        return values.astype("datetime64[ns]").astype("int64").astype("float64")
+    if values.dtype.kind in "iuf":
+        return values.astype("float64")
+    return np.arange(len(values), dtype="float64")
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: picks n_out points that preserve the visual shape of the line."""
+    n = len(y)
+    if n_out >= n or n_out < 3: return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    anchor = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        next_y = y[next_start:next_end]
+        avg_x = x[next_start:next_end].mean()
+        avg_y = np.nanmean(next_y) if np.isfinite(next_y).any() else y[anchor]
+        area = np.abs((x[anchor] - avg_x) * (y[start:end] - y[anchor]) - (x[anchor] - x[start:end]) * (avg_y - y[anchor]))
+        anchor = start + int(np.argmax(np.nan_to_num(area, nan=-1.0)))
+        selected[i + 1] = anchor
+    return selected
+
+def min_max_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """Keeps the minimum and maximum of each bucket, so spikes survive decimation."""
+    n = len(y)
+    if n_out >= n or n_out < 4: return np.arange(n)
+    edges = np.linspace(0, n, n_out // 2 + 1).astype(int)
+    selected = [0, n - 1]
+    for start, end in zip(edges[:-1], edges[1:]):
+        bucket = y[start:end]
+        if not np.isfinite(bucket).any(): continue
+        bucket = np.where(np.isfinite(bucket), bucket, np.nanmean(bucket))
+        selected.extend((start + int(np.argmin(bucket)), start + int(np.argmax(bucket))))
+    return np.unique(selected)
+
+def _per_point_paths(props: dict, n: int, prefix=()):
+    """Yields the property paths of every per-point array of a trace (x, y, customdata, marker arrays, ...)."""
+    for key, value in props.items():
+        if isinstance(value, dict):
+            yield from _per_point_paths(value, n, prefix + (key,))
+        elif isinstance(value, (list, tuple, np.ndarray)) and len(value) == n:
+            yield prefix + (key,)
+
+def _implicit_x(trace, indices):
+    """The x positions plotly gives points without x: x0 + i * dx, with dx in milliseconds on date axes."""
+    x0 = 0 if trace.x0 is None else trace.x0
+    dx = 1 if trace.dx is None else trace.dx
+    if isinstance(x0, (int, float, np.number)):
+        return x0 + indices * dx
+    return pd.Timestamp(x0) + pd.to_timedelta(indices * dx, unit="ms")
+
+def _optimize_trace(trace, point_threshold: int, line_points: int, method: str):
+    n = len(trace.y) if getattr(trace, "y", None) is not None else 0
+    if trace.type not in SCATTER_TYPES or n <= point_threshold:
+        return trace
+    y = np.asarray(trace.y)
+    if "lines" in (trace.mode or "lines") and y.dtype.kind in "iuf":
+        y = y.astype("float64")
+        if method == "minmax":
+            indices = min_max_indices(y, line_points)
+        else:
+            x = _numeric_axis(np.asarray(trace.x)) if trace.x is not None else np.arange(n, dtype="float64")
+            indices = lttb_indices(x, y, line_points)
+        implicit_x = trace.x is None
+        # Slice in place: to_plotly_json() deep-copies every point, which dominates on large traces.
+        for path in list(_per_point_paths(trace._props, n)):
+            trace[path] = np.asarray(trace[path])[indices]
+        if implicit_x:
+            # Without x, points sit at x0 + i * dx; the kept points must stay where they were.
+            trace.x = _implicit_x(trace, indices)
+    if trace.type == "scattergl":
+        return trace
+    props = trace.to_plotly_json()
+    props.pop("type", None)
+    return go.Scattergl(props, skip_invalid=True)
+
+def optimize_figure(fig, point_threshold: int = WEBGL_POINT_THRESHOLD, line_points: int = LINE_TARGET_POINTS, method: str = DECIMATION_METHOD):
+    """
+    Prepares a figure for the browser: scatter traces with more than point_threshold
+    points are switched to WebGL (scattergl), and line traces are additionally
+    decimated to about line_points points with LTTB or min-max bucketing.
+    Large traces are reduced in place; figures without them are returned unchanged.
+    """
+    if not any(trace.type in SCATTER_TYPES and trace.y is not None and len(trace.y) > point_threshold for trace in fig.data):
+        return fig
+    traces = [_optimize_trace(trace, point_threshold, line_points, method) for trace in fig.data]
+    return go.Figure(data=traces, layout=fig.layout)
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+def _column_memory(series):
+    """
+    What identifies the memory behind a column, read through public accessors without
+    copying: an array view for numpy and datetime-like columns, else the extension array.
+    """
+    if isinstance(series.dtype, np.dtype):
+        return series.to_numpy(copy=False)
+    if series.dtype.kind in "mM" or isinstance(series.dtype, pd.PeriodDtype):
+        # to_numpy() would build a copy of tz-aware and period values.
+        return series.array.view("i8")
+    return series.array
+
+def same_memory(old: pd.Series, new: pd.Series) -> bool:
+    """True if two columns of the same dtype are backed by exactly the same memory, hence equal without a scan."""
+    if old.dtype != new.dtype: return False
+    # Both arrays stay referenced while their addresses are compared, so a freed one cannot be reused.
+    a, b = _column_memory(old), _column_memory(new)
+    if isinstance(a, np.ndarray) and isinstance(b, np.ndarray):
+        return a is b or (a.__array_interface__["data"][0] == b.__array_interface__["data"][0]
+                          and a.shape == b.shape and a.strides == b.strides and a.dtype == b.dtype)
+    return a is b
+
+def same_data(original: pd.DataFrame, candidate: pd.DataFrame) -> bool:
+    """
+    True if candidate, a copy of original or a frame generated code left in `df`, still has
+    original's columns, index, dtypes and values. Columns backed by the same memory are not scanned.
+    """
+    if candidate is original: return True
+    if original.shape != candidate.shape or not original.columns.equals(candidate.columns): return False
+    if not original.index.equals(candidate.index): return False
+    for i in range(original.shape[1]):
+        old, new = original.iloc[:, i], candidate.iloc[:, i]
+        if old.dtype != new.dtype: return False
+        if not same_memory(old, new) and not old.equals(new): return False
+    return True
@@ -1,15 +1,54 @@
+import asyncio
+import contextlib
+import contextvars
 import os
+import queue
+import threading
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.io as pio
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
 from typing import TypedDict, List, Dict, Any
 import re
 import json
+import logging
+import time
+import weakref
+from collections import deque
+from fast_router import fast_route, router_stats
+from code_validator import validate_code, validator_stats, writes_in_place
+from data_handler import DataSummary, stratified_sample
+from figure_utils import optimize_figure
+from sandbox import CANCEL_POLL_SECONDS, SANDBOX_ENABLED, SandboxPool, get_sandbox_pool
+from llm_cache import LLMCache, get_llm_cache, hash_text
+from result_cache import ResultCache, get_result_cache, result_key
+from dataset_registry import DatasetHandle, dataset_key, derived_key, get_dataset_registry
+from frame_utils import same_data
+from llm_scheduler import PRIORITY_FOLLOW_UP, PRIORITY_INTERACTIVE, LLMScheduler, get_llm_scheduler
+from telemetry import RequestTrace, record_cache_lookup, record_error, record_llm_call
 
 pio.templates.default = "plotly_white"
+logger = logging.getLogger(__name__)
+MAX_HISTOGRAM_BINS = 200
+ASYNC_AGENT = os.getenv("DATASENSE_ASYNC_AGENT", "0") == "1"
+# Streamed requests on frames with at least this many rows show a preview computed on PREVIEW_ROWS sampled rows first (0 disables).
+PROGRESSIVE_MIN_ROWS = int(os.getenv("DATASENSE_PROGRESSIVE_ROWS", "1000000"))
+PREVIEW_ROWS = int(os.getenv("DATASENSE_PREVIEW_ROWS", "50000"))
+PROGRESS_INTERVAL_SECONDS = 0.5
+CODE_VALIDATION = os.getenv("DATASENSE_CODE_VALIDATION", "1") == "1"
+NODE_LABELS = {
+    "intent_router": "Routing",
+    "parameter_extractor": "Extracting chart parameters",
+    "tool_executor": "Building chart",
+    "code_generator": "Generating code",
+    "code_validator": "Checking code",
+    "code_executor": "Executing",
+    "replan_node": "Re-planning",
+    "response_generator": "Preparing answer",
+}
 
 class BarChartParams(BaseModel):
     x_col: str = Field(description="The column for the x-axis.")
@@ -23,6 +62,31 @@ class HistogramParams(BaseModel):
 class FollowUp(BaseModel):
     questions: List[str] = Field(description="List of 2-3 follow-up questions.", max_items=3)
 
+class RequestCancelled(Exception):
+    """Raised inside the graph when a streamed request is abandoned, e.g. because the user asked something new."""
+
+class AgentRequest:
+    """One invocation's own state: its trace, LLM priority, cancel flag and event sink."""
+
+    def __init__(self, user_prompt: str, priority: int = PRIORITY_INTERACTIVE, cancel: threading.Event = None, on_event=None):
+        self.trace = RequestTrace(user_prompt)
+        self.priority = priority
+        self.cancel = cancel
+        self.on_event = on_event
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel is not None and self.cancel.is_set()
+
+    def emit(self, event: Dict[str, Any]):
+        if self.on_event: self.on_event(event)
+
+# The request being run; agents are shared by a chat's requests, so nothing request-specific lives on them.
+_current_request = contextvars.ContextVar("datasense_request", default=None)
+
+def current_request() -> "AgentRequest":
+    return _current_request.get()
+
 class AgentState(TypedDict):
     user_prompt: str
     data_summary: str
@@ -34,70 +98,419 @@ class AgentState(TypedDict):
     final_response: Dict[str, Any]
     error: str
     retries: int
+    code_cache_key: str
+    result_cache_key: str
+    cached_response: Dict[str, Any]
+    defer_follow_ups: bool
+
+def _log_figure(kind: str, fig, started: float):
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("%s figure: %d bytes of JSON, built in %.1f ms", kind, len(fig.to_json()), (time.perf_counter() - started) * 1000)
+
+def histogram_bins(values: np.ndarray) -> np.ndarray:
+    """Chooses bin edges with NumPy's 'auto' rule (max of Sturges and Freedman-Diaconis), capped at MAX_HISTOGRAM_BINS."""
+    edges = np.histogram_bin_edges(values, bins="auto")
+    if len(edges) - 1 > MAX_HISTOGRAM_BINS:
+        edges = np.histogram_bin_edges(values, bins=MAX_HISTOGRAM_BINS)
+    return edges
 
 def create_bar_chart(df: pd.DataFrame, x_col: str, y_col: str, title: str) -> dict:
     try:
+        started = time.perf_counter()
+        if pd.api.types.is_numeric_dtype(df[y_col]):
+            # One bar per category with the summed value, which is what stacking every row would draw.
+            df = df.groupby(x_col, sort=False, observed=True)[y_col].sum().reset_index()
         fig = px.bar(df, x=x_col, y=y_col, title=title)
+        _log_figure("bar_chart", fig, started)
         return {"plotly_fig": fig}
     except Exception as e:
         return {"error": str(e)}
 
 def create_histogram(df: pd.DataFrame, col: str, title: str) -> dict:
     try:
-        fig = px.histogram(df, x=col, title=title)
+        started = time.perf_counter()
+        series = df[col].dropna()
+        is_datetime = pd.api.types.is_datetime64_any_dtype(series)
+        if (pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)) or is_datetime:
+            values = series.to_numpy(dtype="int64") if is_datetime else series.to_numpy(dtype="float64")
+            counts, edges = np.histogram(values, bins=histogram_bins(values))
+            centers, widths = (edges[:-1] + edges[1:]) / 2, np.diff(edges)
+            if is_datetime:
+                # Plotly measures bar widths on date axes in milliseconds.
+                centers, widths = pd.to_datetime(centers.astype("int64")), widths / 1e6
+            fig = px.bar(x=centers, y=counts, title=title, labels={"x": col, "y": "count"})
+            fig.update_traces(width=widths)
+            fig.update_layout(bargap=0)
+        else:
+            counts = series.value_counts(sort=False)
+            fig = px.bar(x=counts.index.astype(str), y=counts.to_numpy(), title=title, labels={"x": col, "y": "count"})
+        _log_figure("histogram", fig, started)
         return {"plotly_fig": fig}
     except Exception as e:
         return {"error": str(e)}
 
+def _first_tool_call_args(response) -> Dict[str, Any]:
+    if not response.tool_calls: raise ValueError("Missing necessary information (e.g., column names).")
+    return response.tool_calls[0]['args']
+
+def _follow_up_questions(response) -> List[str]:
+    return response.tool_calls[0]['args'].get('questions', []) if response.tool_calls else []
+
+_llm = None
+_agent_graph = None
+
+def _extract_code(code_string: str) -> str:
+    code_match = re.search(r"```python\n(.*?)```", code_string, re.DOTALL)
+    return code_match.group(1).strip() if code_match else code_string
+
+def get_llm():
+    """Returns the process-wide Gemini client. The SDK is imported here because it alone takes over a second to import."""
+    global _llm
+    if _llm is None:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        _llm = ChatGoogleGenerativeAI(model="models/gemini-2.5-flash", temperature=0, google_api_key=os.getenv("GOOGLE_API_KEY"))
+    return _llm
+
+@contextlib.contextmanager
+def _node_request(name: str, config):
+    """Makes the invocation's AgentRequest current for one node, after checking it was not cancelled."""
+    request = config["configurable"]["request"]
+    if request.cancelled: raise RequestCancelled()
+    token = _current_request.set(request)
+    try:
+        request.emit({"type": "node", "node": name, "label": NODE_LABELS.get(name, name)})
+        yield
+    finally:
+        _current_request.reset(token)
+
+def _graph_node(name: str, method: str, amethod: str = None):
+    """A graph node that runs on the invocation's agent and announces itself to the request's event stream."""
+    def run(state: AgentState, config):
+        agent = config["configurable"]["agent"]
+        with _node_request(name, config), agent._span(name, state):
+            return _traced_result(getattr(agent, method)(state))
+    async def arun(state: AgentState, config):
+        agent = config["configurable"]["agent"]
+        with _node_request(name, config), agent._span(name, state):
+            return _traced_result(await getattr(agent, amethod)(state))
+    return RunnableLambda(run, afunc=arun if amethod else None)
+
+def _traced_result(result):
+    # Nodes report most failures through the "error" key rather than by raising.
+    if isinstance(result, dict) and result.get("error"): record_error("ErrorState")
+    return result
+
+def _graph_branch(method: str):
+    return RunnableLambda(lambda state, config: getattr(config["configurable"]["agent"], method)(state))
+
+def get_agent_graph():
+    """
+    Returns the agent graph, compiled once per process. Nodes hold no dataset state:
+    each invocation passes its AIAgent and AgentRequest in config["configurable"].
+    """
+    global _agent_graph
+    if _agent_graph is None:
+        _agent_graph = _build_agent_graph()
+    return _agent_graph
+
+def _build_agent_graph():
+    workflow = StateGraph(AgentState)
+    workflow.add_node("intent_router", _graph_node("intent_router", "intent_router_node", "aintent_router_node"))
+    workflow.add_node("parameter_extractor", _graph_node("parameter_extractor", "parameter_extractor_node", "aparameter_extractor_node"))
+    workflow.add_node("tool_executor", _graph_node("tool_executor", "tool_executor_node"))
+    workflow.add_node("code_generator", _graph_node("code_generator", "code_generator_node", "acode_generator_node"))
+    workflow.add_node("code_validator", _graph_node("code_validator", "code_validator_node"))
+    workflow.add_node("code_executor", _graph_node("code_executor", "code_executor_node"))
+    workflow.add_node("response_generator", _graph_node("response_generator", "response_generator_node"))
+    workflow.add_node("replan_node", _graph_node("replan_node", "replan_node", "areplan_node"))
+
+    workflow.set_entry_point("intent_router")
+    workflow.add_conditional_edges("intent_router", _graph_branch("decide_next_node"), {"tool_user": "parameter_extractor", "code_generator": "code_generator"})
+    workflow.add_conditional_edges("parameter_extractor", _graph_branch("decide_after_params"), {"execute_tool": "tool_executor", "fallback_to_code": "code_generator"})
+    workflow.add_edge("tool_executor", "response_generator")
+    workflow.add_edge("code_generator", "code_validator")
+    workflow.add_conditional_edges("code_validator", _graph_branch("decide_after_validation"), {"execute": "code_executor", "re-plan": "replan_node", "end_with_error": END})
+    workflow.add_conditional_edges("code_executor", _graph_branch("decide_after_code_execution"), {"re-plan": "replan_node", "generate_response": "response_generator", "end_with_error": END})
+    workflow.add_edge("replan_node", "code_generator")
+    workflow.add_edge("response_generator", END)
+    return workflow.compile()
+
 class AIAgent:
+    """
+    Per-chat agent state: the dataset, its summary and timings. Per-request state
+    (trace, priority, cancel flag, event sink) is carried by an AgentRequest.
+    The LLM client and the compiled graph are shared by every agent in the process.
+    """
     MAX_RETRIES = 2
 
-    def __init__(self, df: pd.DataFrame, data_summary: str):
+    def __init__(self, df: pd.DataFrame, data_summary, llm_cache: LLMCache = None, async_mode: bool = ASYNC_AGENT, sandbox: SandboxPool = None,
+                 dataset: DatasetHandle = None, scheduler: LLMScheduler = None, result_cache: ResultCache = None, llm=None):
         self.df = df
-        self.data_summary = data_summary
-        self.llm = ChatGoogleGenerativeAI(model="models/gemini-2.5-flash", temperature=0, google_api_key=os.getenv("GOOGLE_API_KEY"))
-        self.graph = self._build_graph()
-
-    def _build_graph(self):
-        workflow = StateGraph(AgentState)
-        workflow.add_node("intent_router", self.intent_router_node)
-        workflow.add_node("parameter_extractor", self.parameter_extractor_node)
-        workflow.add_node("tool_executor", self.tool_executor_node)
-        workflow.add_node("code_generator", self.code_generator_node)
-        workflow.add_node("code_executor", self.code_executor_node)
-        workflow.add_node("response_generator", self.response_generator_node)
-        workflow.add_node("replan_node", self.replan_node)
-
-        workflow.set_entry_point("intent_router")
-        workflow.add_conditional_edges("intent_router", self.decide_next_node, {"tool_user": "parameter_extractor", "code_generator": "code_generator"})
-        workflow.add_conditional_edges("parameter_extractor", self.decide_after_params, {"execute_tool": "tool_executor", "fallback_to_code": "code_generator"})
-        workflow.add_edge("tool_executor", "response_generator")
-        workflow.add_edge("code_generator", "code_executor")
-        workflow.add_conditional_edges("code_executor", self.decide_after_code_execution, {"re-plan": "replan_node", "generate_response": "response_generator", "end_with_error": END})
-        workflow.add_edge("replan_node", "code_generator")
-        workflow.add_edge("response_generator", END)
-        return workflow.compile()
-
-    def invoke_agent(self, user_prompt: str) -> Dict[str, Any]:
-        inputs = {"user_prompt": user_prompt, "data_summary": self.data_summary, "dataframe": self.df, "retries": 0, "error": ""}
+        self.dataset = dataset
+        self._frame_version = None
+        self._preview_sample = None
+        self.result_cache = result_cache or get_result_cache()
+        self.sandbox = sandbox or (get_sandbox_pool() if SANDBOX_ENABLED else None)
+        self._shared_frame_path = None
+        self.async_mode = async_mode
+        self._set_summary(data_summary)
+        self.llm_cache = llm_cache or get_llm_cache()
+        self.llm = llm or get_llm()
+        # Part of every LLM cache key, so answers from one model are not served for another.
+        self.model_name = getattr(self.llm, "model", "")
+        self.scheduler = scheduler or get_llm_scheduler()
+        self.code_validation = CODE_VALIDATION
+        self.stream_timings = deque(maxlen=50)
+        self.last_trace = None
+        self.graph = get_agent_graph()
+
+    def _set_summary(self, data_summary):
+        # A DataSummary renders a prompt-specific summary per request; a plain string is used as-is.
+        self.summary_builder = data_summary if isinstance(data_summary, DataSummary) else None
+        self.data_summary = self.summary_builder.render() if self.summary_builder else data_summary
+        self.summary_hash = hash_text(self.data_summary or "")
+
+    @contextlib.contextmanager
+    def _tracing(self, request: AgentRequest):
+        """Makes request current and collects its per-node spans; they are logged and exported when it finishes."""
+        token = _current_request.set(request)
         try:
-            final_state = self.graph.invoke(inputs, {"recursion_limit": 15})
-            if final_state.get("error") and not final_state.get("final_response"):
-                return {"response_text": f"I'm sorry, I was unable to complete your request. The final error was:\n\n`{final_state['error']}`"}
-            return final_state.get("final_response", {"response_text": "Sorry, I couldn't process your request."})
-        except Exception as e:
-            return {"response_text": f"An unexpected system error occurred: {str(e)}"}
-
-    def intent_router_node(self, state: AgentState) -> Dict[str, str]:
+            yield request.trace
+        finally:
+            _current_request.reset(token)
+            request.trace.finish()
+            # A cancelled run that finishes late must not replace the trace of the request that superseded it.
+            if not request.cancelled: self.last_trace = request.trace
+
+    def _span(self, node: str, state: Dict[str, Any]):
+        request = current_request()
+        return request.trace.span(node, state.get("retries", 0)) if request else contextlib.nullcontext()
+
+    def _emit(self, event: Dict[str, Any]):
+        request = current_request()
+        if request: request.emit(event)
+
+    @staticmethod
+    def _streaming() -> bool:
+        request = current_request()
+        return request is not None and request.on_event is not None
+
+    @staticmethod
+    def _priority() -> int:
+        request = current_request()
+        return request.priority if request else PRIORITY_INTERACTIVE
+
+    def _flight_key(self, node: str, prompt: str) -> str:
+        # Requests with the same cache key are interchangeable, so the scheduler may coalesce them.
+        return LLMCache.make_key(node, prompt, self.summary_hash, self.model_name)
+
+    def _stream_text(self, node: str, prompt: str) -> str:
+        """
+        Streams a plain-text LLM response, emitting each delta as a token event.
+        A request coalesced with an identical one from another chat gets the full text without deltas.
+        """
+        def request():
+            parts = []
+            for chunk in self.llm.stream(prompt):
+                parts.append(chunk.content)
+                self._emit({"type": "token", "node": node, "text": chunk.content})
+            record_llm_call(prompt, response_text="".join(parts))
+            return "".join(parts)
+        return self.scheduler.run(self._flight_key(node, prompt), request, self._priority())
+
+    async def _astream_text(self, node: str, prompt: str) -> str:
+        async def request():
+            parts = []
+            async for chunk in self.llm.astream(prompt):
+                parts.append(chunk.content)
+                self._emit({"type": "token", "node": node, "text": chunk.content})
+            record_llm_call(prompt, response_text="".join(parts))
+            return "".join(parts)
+        return await self.scheduler.arun(self._flight_key(node, prompt), request, self._priority())
+
+    def _cached_llm_call(self, node: str, prompt: str, call):
+        """Runs an LLM call through the prompt-level cache; call must return JSON-serializable data."""
+        called = []
+        value = self.llm_cache.get_or_call(node, prompt, self.summary_hash, lambda: called.append(True) or call(), self.model_name)
+        record_cache_lookup(hit=not called)
+        return value
+
+    async def _acached_llm_call(self, node: str, prompt: str, acall):
+        called = []
+        value = await self.llm_cache.aget_or_call(node, prompt, self.summary_hash, lambda: called.append(True) or acall(), self.model_name)
+        record_cache_lookup(hit=not called)
+        return value
+
+    def _llm_step(self, node: str, prompt: str, runnable, parse=None, priority: int = None):
+        """
+        Invokes runnable on prompt through the cache and the process-wide scheduler, applying
+        parse to the raw response. priority defaults to that of the current request.
+        """
+        parse = parse or (lambda response: response)
+        def request():
+            response = runnable.invoke(prompt)
+            record_llm_call(prompt, response)
+            return response
+        priority = self._priority() if priority is None else priority
+        return self._cached_llm_call(node, prompt, lambda: parse(self.scheduler.run(self._flight_key(node, prompt), request, priority)))
+
+    async def _allm_step(self, node: str, prompt: str, runnable, parse=None, priority: int = None):
+        parse = parse or (lambda response: response)
+        async def request():
+            response = await runnable.ainvoke(prompt)
+            record_llm_call(prompt, response)
+            return response
+        priority = self._priority() if priority is None else priority
+        async def call():
+            return parse(await self.scheduler.arun(self._flight_key(node, prompt), request, priority))
+        return await self._acached_llm_call(node, prompt, call)
+
+    def _initial_state(self, user_prompt: str, defer_follow_ups: bool = False) -> Dict[str, Any]:
+        data_summary = self.summary_builder.render(user_prompt) if self.summary_builder else self.data_summary
+        return {"user_prompt": user_prompt, "data_summary": data_summary, "dataframe": self.df, "retries": 0, "error": "", "tool_params": {}, "defer_follow_ups": defer_follow_ups}
+
+    def _run_config(self, request: AgentRequest) -> Dict[str, Any]:
+        return {"recursion_limit": 15, "configurable": {"agent": self, "request": request}}
+
+    @staticmethod
+    def _final_response(final_state: Dict[str, Any]) -> Dict[str, Any]:
+        if final_state.get("error") and not final_state.get("final_response"):
+            return {"response_text": f"I'm sorry, I was unable to complete your request. The final error was:\n\n`{final_state['error']}`"}
+        return final_state.get("final_response", {"response_text": "Sorry, I couldn't process your request."})
+
+    def invoke_agent(self, user_prompt: str, on_response=None, priority: int = PRIORITY_INTERACTIVE, cancel: threading.Event = None,
+                     on_event=None) -> Dict[str, Any]:
+        """
+        Runs the agent on a prompt. When on_response is given it receives the answer
+        before follow-up questions are generated and attached. priority orders this
+        request's LLM calls against other sessions' (see llm_scheduler); setting cancel
+        abandons the request at the next node or during code execution. on_event receives
+        the request's progress events (see stream_agent). In async mode this is a blocking
+        wrapper around ainvoke_agent.
+        """
+        if self.async_mode:
+            return asyncio.run(self.ainvoke_agent(user_prompt, on_response, priority, cancel, on_event))
+        request = AgentRequest(user_prompt, priority, cancel, on_event)
+        with self._tracing(request):
+            try:
+                final_state = self.graph.invoke(self._initial_state(user_prompt, defer_follow_ups=on_response is not None), self._run_config(request))
+            except RequestCancelled:
+                return {"response_text": "The request was cancelled."}
+            except Exception as e:
+                return {"response_text": f"An unexpected system error occurred: {str(e)}"}
+            response = self._final_response(final_state)
+            if request.cancelled: return {"response_text": "The request was cancelled."}
+            if on_response and final_state.get("final_response"):
+                on_response(response)
+                with self._span("follow_up", {}):
+                    response["follow_up_questions"] = self._generate_follow_ups(user_prompt, response.get("response_text", "A chart or data was generated."))
+            return response
+
+    async def ainvoke_agent(self, user_prompt: str, on_response=None, priority: int = PRIORITY_INTERACTIVE, cancel: threading.Event = None,
+                            on_event=None) -> Dict[str, Any]:
+        """
+        Runs the graph with async LLM calls. Follow-up suggestions only depend on the
+        prompt and data summary here, so they are generated concurrently with the graph
+        and attached after on_response has been given the main answer.
+        """
+        request = AgentRequest(user_prompt, priority, cancel, on_event)
+        with self._tracing(request):
+            follow_ups = asyncio.create_task(self._atraced_follow_ups(user_prompt))
+            try:
+                final_state = await self.graph.ainvoke(self._initial_state(user_prompt, defer_follow_ups=True), self._run_config(request))
+            except RequestCancelled:
+                follow_ups.cancel()
+                return {"response_text": "The request was cancelled."}
+            except Exception as e:
+                follow_ups.cancel()
+                return {"response_text": f"An unexpected system error occurred: {str(e)}"}
+            response = self._final_response(final_state)
+            if request.cancelled or not final_state.get("final_response"):
+                follow_ups.cancel()
+                return {"response_text": "The request was cancelled."} if request.cancelled else response
+            if on_response: on_response(response)
+            response["follow_up_questions"] = await follow_ups
+            return response
+
+    async def _atraced_follow_ups(self, user_prompt: str):
+        with self._span("follow_up", {}):
+            return await self._agenerate_follow_ups(user_prompt)
+
+    def stream_agent(self, user_prompt: str):
+        """
+        Runs the agent on a background thread and yields its progress as events:
+        {"type": "node"} when a graph node starts, {"type": "token"} for LLM text deltas,
+        {"type": "answer"} once the answer is ready and {"type": "final"} with follow-ups attached.
+        On large frames a {"type": "preview"} answer computed on a sample comes first, and
+        {"type": "progress"} events follow while the exact result is computed. Closing the
+        generator early cancels the request. Time to first event, preview and answer
+        latency and total latency are recorded in stream_timings.
+        """
+        events = queue.Queue()
+        cancel = threading.Event()
+        def run():
+            try:
+                response = self.invoke_agent(user_prompt, on_response=lambda answer: events.put({"type": "answer", "response": answer}), cancel=cancel,
+                                             on_event=events.put)
+            except Exception as e:
+                response = {"response_text": f"An unexpected system error occurred: {str(e)}"}
+            events.put({"type": "final", "response": response})
+
+        start = time.perf_counter()
+        timings = {"ttfb_s": None, "first_token_s": None, "preview_s": None, "answer_s": None, "total_s": None}
+        threading.Thread(target=run, daemon=True).start()
+        try:
+            while True:
+                event = events.get()
+                elapsed = time.perf_counter() - start
+                if timings["ttfb_s"] is None: timings["ttfb_s"] = elapsed
+                if event["type"] == "token" and timings["first_token_s"] is None: timings["first_token_s"] = elapsed
+                if event["type"] == "preview" and timings["preview_s"] is None: timings["preview_s"] = elapsed
+                if event["type"] in ("answer", "final") and timings["answer_s"] is None: timings["answer_s"] = elapsed
+                if event["type"] == "final":
+                    timings["total_s"] = elapsed
+                    self.stream_timings.append(timings)
+                yield event
+                if event["type"] == "final": break
+        finally:
+            # The consumer stopped early, e.g. a Streamlit rerun because the user asked something new.
+            if timings["total_s"] is None: cancel.set()
+
+    def _fast_route(self, state: AgentState):
+        fast_result = fast_route(state['user_prompt'], state['dataframe'].columns)
+        if fast_result:
+            router_stats.record_fast_route(bool(fast_result["tool_params"]))
+        return fast_result
+
+    def _intent_request(self, state: AgentState):
         prompt = f"""You are an expert intent router. Classify the user's intent into ONE of the following: 'bar_chart', 'histogram', 'dashboard', or 'code_generator'.
 Data Summary: {state['data_summary']}
 User Prompt: "{state['user_prompt']}"
 Respond with a single, valid JSON object with one key, "intent". Example: {{"intent": "bar_chart"}}"""
+        return "intent_router", prompt, self.llm.with_structured_output({"intent": str})
+
+    def intent_router_node(self, state: AgentState) -> Dict[str, Any]:
+        fast_result = self._fast_route(state)
+        if fast_result: return fast_result
         try:
-            structured_llm = self.llm.with_structured_output({"intent": str})
-            response = structured_llm.invoke(prompt)
+            start = time.perf_counter()
+            response = self._llm_step(*self._intent_request(state))
+            router_stats.record_llm_route(time.perf_counter() - start)
             return {"intent": response['intent']}
-        except Exception:
+        except Exception as e:
+            record_error(e)
+            return {"intent": "code_generator"}
+
+    async def aintent_router_node(self, state: AgentState) -> Dict[str, Any]:
+        fast_result = self._fast_route(state)
+        if fast_result: return fast_result
+        try:
+            start = time.perf_counter()
+            response = await self._allm_step(*self._intent_request(state))
+            router_stats.record_llm_route(time.perf_counter() - start)
+            return {"intent": response['intent']}
+        except Exception as e:
+            record_error(e)
             return {"intent": "code_generator"}
 
     def decide_next_node(self, state: AgentState) -> str:
@@ -106,16 +519,36 @@ Respond with a single, valid JSON object with one key, "intent". Example: {{"int
     def decide_after_params(self, state: AgentState) -> str:
         return "fallback_to_code" if state.get("error") else "execute_tool"
 
-    def parameter_extractor_node(self, state: AgentState) -> Dict[str, Any]:
+    def _extractor_request(self, state: AgentState):
         schema = {"bar_chart": BarChartParams, "histogram": HistogramParams}.get(state["intent"])
-        if not schema: return {"error": "Invalid intent for parameter extraction."}
-        tool_llm = self.llm.bind_tools(tools=[schema])
+        if not schema: return None
         prompt = f"""Extract parameters for '{state['intent']}'. Data Summary: {state['data_summary']}. User Prompt: "{state['user_prompt']}". Ensure column names are exact."""
+        return "parameter_extractor", prompt, self.llm.bind_tools(tools=[schema]), _first_tool_call_args
+
+    def parameter_extractor_node(self, state: AgentState) -> Dict[str, Any]:
+        if state.get("tool_params"): return {"error": ""}
+        request = self._extractor_request(state)
+        if not request: return {"error": "Invalid intent for parameter extraction."}
+        try:
+            start = time.perf_counter()
+            tool_params = self._llm_step(*request)
+            router_stats.record_llm_extraction(time.perf_counter() - start)
+            return {"tool_params": tool_params, "error": ""}
+        except Exception as e:
+            record_error(e)
+            return {"error": f"Parameter Extraction Failed: {e}"}
+
+    async def aparameter_extractor_node(self, state: AgentState) -> Dict[str, Any]:
+        if state.get("tool_params"): return {"error": ""}
+        request = self._extractor_request(state)
+        if not request: return {"error": "Invalid intent for parameter extraction."}
         try:
-            response = tool_llm.invoke(prompt)
-            if not response.tool_calls: raise ValueError("Missing necessary information (e.g., column names).")
-            return {"tool_params": response.tool_calls[0]['args'], "error": ""}
+            start = time.perf_counter()
+            tool_params = await self._allm_step(*request)
+            router_stats.record_llm_extraction(time.perf_counter() - start)
+            return {"tool_params": tool_params, "error": ""}
         except Exception as e:
+            record_error(e)
             return {"error": f"Parameter Extraction Failed: {e}"}
 
     def tool_executor_node(self, state: AgentState) -> Dict[str, Any]:
@@ -126,27 +559,44 @@ Respond with a single, valid JSON object with one key, "intent". Example: {{"int
             result = tool_func(df=state["dataframe"], **state["tool_params"])
             return {"execution_result": result}
         except Exception as e:
+            record_error(e)
             return {"error": f"Tool execution failed: {str(e)}"}
 
-    def replan_node(self, state: AgentState) -> Dict[str, Any]:
+    def _replan_request(self, state: AgentState):
         prompt = f"""You are a Re-Planner AI. A previous attempt failed. Your job is to create a new, simplified plan.
 **Analyze:** 1. Original Request: "{state['user_prompt']}" 2. Error: "{state['error']}"
 **Task:** Decide on a new `intent` and a new `user_prompt` to try next.
 Respond with a single, valid JSON object with two keys: "intent" and "user_prompt".
 Example: {{"intent": "code_generator", "user_prompt": "Calculate the average of the 'flat_price' column."}}"""
+        return "replan", prompt, self.llm.with_structured_output({"intent": str, "user_prompt": str})
+
+    def replan_node(self, state: AgentState) -> Dict[str, Any]:
+        try:
+            response = self._llm_step(*self._replan_request(state))
+            return {"intent": response['intent'], "user_prompt": response['user_prompt'], "error": ""}
+        except Exception as e:
+            record_error(e)
+            return {"error": "Failed to create a new plan."}
+
+    async def areplan_node(self, state: AgentState) -> Dict[str, Any]:
         try:
-            structured_llm = self.llm.with_structured_output({"intent": str, "user_prompt": str})
-            response = structured_llm.invoke(prompt)
+            response = await self._allm_step(*self._replan_request(state))
             return {"intent": response['intent'], "user_prompt": response['user_prompt'], "error": ""}
-        except Exception:
+        except Exception as e:
+            record_error(e)
             return {"error": "Failed to create a new plan."}
 
+    def decide_after_validation(self, state: AgentState) -> str:
+        if state.get("error"):
+            return "re-plan" if state.get("retries", 0) < self.MAX_RETRIES else "end_with_error"
+        return "execute"
+
     def decide_after_code_execution(self, state: AgentState) -> str:
         if state.get("error"):
             return "re-plan" if state.get("retries", 0) < self.MAX_RETRIES else "end_with_error"
         return "generate_response"
 
-    def code_generator_node(self, state: AgentState) -> Dict[str, str]:
+    def _code_request(self, state: AgentState):
         error_context = f"The previous attempt failed: --- {state['error']} ---. Please create a new, corrected response." if state.get("error") else ""
         if state['intent'] == 'dashboard':
             # --- THIS IS THE NEW, STRICTER PROMPT ---
@@ -188,37 +638,206 @@ Now, write the Python code block to generate the dashboard components."""
 ```python
 # Your code starts here.
 ```"""
+        return "code_generator", prompt_template, self.llm, lambda response: response.content
+
+    def _code_result(self, state: AgentState, prompt: str, content: str) -> Dict[str, Any]:
+        cache_key = self.llm_cache.make_key("code_generator", prompt, self.summary_hash, self.model_name)
+        return {"code_string": content.strip(), "retries": state.get("retries", 0) + 1, "code_cache_key": cache_key}
+
+    def code_generator_node(self, state: AgentState) -> Dict[str, Any]:
+        request = self._code_request(state)
         try:
-            response = self.llm.invoke(prompt_template)
-            return {"code_string": response.content.strip(), "retries": state.get("retries", 0) + 1}
+            if self._streaming():
+                content = self._cached_llm_call(request[0], request[1], lambda: self._stream_text(request[0], request[1]))
+                return self._code_result(state, request[1], content)
+            return self._code_result(state, request[1], self._llm_step(*request))
         except Exception as e:
+            record_error(e)
             return {"error": f"Generation failed: {e}"}
 
+    async def acode_generator_node(self, state: AgentState) -> Dict[str, Any]:
+        request = self._code_request(state)
+        try:
+            if self._streaming():
+                content = await self._acached_llm_call(request[0], request[1], lambda: self._astream_text(request[0], request[1]))
+                return self._code_result(state, request[1], content)
+            return self._code_result(state, request[1], await self._allm_step(*request))
+        except Exception as e:
+            record_error(e)
+            return {"error": f"Generation failed: {e}"}
+
+    def code_validator_node(self, state: AgentState) -> Dict[str, Any]:
+        """
+        Checks the generated code statically before it runs. Rejected code goes straight to
+        re-planning with precise errors; near-miss column names are repaired here instead.
+        """
+        if state.get("error") or not self.code_validation: return {}
+        code = _extract_code(state["code_string"])
+        if not code: return {}
+        check = validate_code(code, self.df.columns)
+        validator_stats.record(check)
+        if not check.ok:
+            if state.get("code_cache_key"): self.llm_cache.invalidate(state["code_cache_key"])
+            return {"error": "Generated code failed validation: " + " ".join(check.errors)}
+        if check.repairs:
+            logger.info("Repaired generated code: %s", "; ".join(check.repairs))
+        return {"code_string": check.code}
+
     def code_executor_node(self, state: AgentState) -> Dict[str, Any]:
-        code_match = re.search(r"```python\n(.*?)```", state["code_string"], re.DOTALL)
-        code = code_match.group(1).strip() if code_match else state["code_string"]
-        if not code: return {"error": "No Python code was generated."}
+        code = _extract_code(state["code_string"])
+        if not code:
+            if state.get("code_cache_key"): self.llm_cache.invalidate(state["code_cache_key"])
+            return {"error": "No Python code was generated."}
+        key = result_key(code, self._data_version())
+        if key:
+            cached = self.result_cache.get(key)
+            record_cache_lookup(cached is not None)
+            if cached is not None:
+                return {"execution_result": None, "cached_response": cached, "result_cache_key": None, "error": ""}
+        cancel = current_request().cancel if current_request() else None
         try:
-            local_scope = {'df': self.df, 'pd': pd, 'px': px}
-            exec(code, {}, local_scope)
-            return {"execution_result": local_scope.get('result'), "error": ""}
+            if self._streaming() and 0 < PROGRESSIVE_MIN_ROWS <= len(self.df):
+                self._preview(code, state)
+            if self.sandbox is not None:
+                result, frame = self._cancellable(lambda: self.sandbox.run(code, self._shared_frame(), cancel=cancel), cancel)
+            else:
+                result, frame = self._cancellable(lambda: self._exec(code, self.df), cancel)
+            if frame is not None:
+                # Replaying a cached result would skip the modification, so this run is not cached.
+                self._adopt_frame(frame)
+                key = None
+            return {"execution_result": result, "cached_response": None, "result_cache_key": key, "error": ""}
+        except RequestCancelled:
+            raise
         except Exception as e:
+            record_error(e)
+            if state.get("code_cache_key"): self.llm_cache.invalidate(state["code_cache_key"])
             return {"error": f"Code execution failed: {str(e)}"}
 
+    @staticmethod
+    def _exec(code: str, df: pd.DataFrame):
+        """
+        Runs code against df and returns (result, frame): frame is what the code left in `df`,
+        modified in place or rebound, or None if it still holds df's data. Code that writes
+        into arrays gets a deep copy; anything else a shallow one, so df itself is never touched.
+        """
+        frame = df.copy(deep=writes_in_place(code))
+        local_scope = {'df': frame, 'pd': pd, 'px': px}
+        exec(code, {}, local_scope)
+        frame = local_scope.get('df')
+        if not isinstance(frame, pd.DataFrame) or same_data(df, frame): frame = None
+        return local_scope.get('result'), frame
+
+    def _cancellable(self, func, cancel: threading.Event = None):
+        """
+        Runs func on a worker thread and waits for it, emitting progress events, until it
+        finishes or cancel is set. Sandboxed runs are killed on cancellation; in-process
+        runs cannot be interrupted, so they finish in the background and are discarded.
+        """
+        if cancel is None: return func()
+        done, outcome = threading.Event(), {}
+        def work():
+            try:
+                outcome["value"] = func()
+            except BaseException as e:
+                outcome["error"] = e
+            finally:
+                done.set()
+        started = reported = time.perf_counter()
+        threading.Thread(target=work, daemon=True).start()
+        while not done.wait(CANCEL_POLL_SECONDS):
+            if cancel.is_set(): raise RequestCancelled()
+            if time.perf_counter() - reported >= PROGRESS_INTERVAL_SECONDS:
+                reported = time.perf_counter()
+                self._emit({"type": "progress", "label": f"Computing the exact result ({reported - started:.0f}s)"})
+        if "error" in outcome: raise outcome["error"]
+        return outcome["value"]
+
+    def _preview_frame(self) -> pd.DataFrame:
+        """A stratified sample of the agent's data, drawn once per frame."""
+        if self._preview_sample is None:
+            profile = self.dataset.profile if self.dataset is not None else getattr(self.summary_builder, "profile", None)
+            self._preview_sample = stratified_sample(self.df, PREVIEW_ROWS, profile)
+        return self._preview_sample
+
+    def _preview(self, code: str, state: AgentState):
+        """Runs the code on a sample and emits the approximate answer; failures are left to the full run."""
+        with self._span("preview", state):
+            sample = self._preview_frame()
+            try:
+                if self.sandbox is not None:
+                    path = self.sandbox.share_frame(sample)
+                    try:
+                        result, frame = self.sandbox.run(code, path)
+                    finally:
+                        self.sandbox.release_frame(path)
+                else:
+                    result, frame = self._exec(code, sample)
+                # Code that modifies the data has nothing worth previewing.
+                if frame is not None: return
+                response = self._build_response(result)
+            except Exception:
+                return
+            response["preview"] = {"rows": len(sample), "total_rows": len(self.df)}
+            self._emit({"type": "preview", "response": response})
+
+    def _adopt_frame(self, df: pd.DataFrame):
+        """
+        Makes the frame generated code modified or rebound the agent's data, registering it as a new dataset.
+        The previous profile is updated for the changed columns and rows, so the summary
+        and quality report are rendered without re-scanning the whole frame.
+        """
+        self.df = df
+        self._shared_frame_path = None
+        self._frame_version = None
+        self._preview_sample = None
+        previous = self.dataset.profile if self.dataset is not None else getattr(self.summary_builder, "profile", None)
+        profile = previous.updated(df) if previous is not None else None
+        if self.dataset is not None:
+            self.dataset = get_dataset_registry().acquire(df, key=derived_key(self.dataset.key), profile=profile)
+            self._set_summary(self.dataset.summary)
+        else:
+            # A plain string summary describes the old data; the new one also keys the LLM cache afresh.
+            self._set_summary(DataSummary(df, profile))
+
+    def _data_version(self) -> str:
+        """Identifies the agent's current data: the dataset key, or a content hash of a frame outside the registry."""
+        if self.dataset is not None: return self.dataset.key
+        if self._frame_version is None:
+            self._frame_version = dataset_key(self.df)
+        return self._frame_version
+
+    def _shared_frame(self) -> str:
+        """Publishes the DataFrame to the sandbox once and frees it when the agent is collected."""
+        if self._shared_frame_path is None:
+            self._shared_frame_path = self.sandbox.share_frame(self.df)
+            weakref.finalize(self, self.sandbox.release_frame, self._shared_frame_path)
+        return self._shared_frame_path
+
     def response_generator_node(self, state: AgentState) -> Dict[str, Dict]:
-        result = state.get("execution_result")
+        final_response = state.get("cached_response")
+        if final_response is None:
+            final_response = self._build_response(state.get("execution_result"))
+            if state.get("result_cache_key"): self.result_cache.put(state["result_cache_key"], final_response)
+
+        if not state.get("defer_follow_ups"):
+            final_response["follow_up_questions"] = self._generate_follow_ups(state['user_prompt'], final_response.get("response_text", "A chart or data was generated."))
+
+        return {"final_response": final_response}
+
+    def _build_response(self, result) -> Dict[str, Any]:
         final_response = {}
 
 
         if isinstance(result, list) and all('plotly.graph_objs._figure.Figure' in str(type(item)) for item in result):
-            final_response["plotly_dashboard"] = result
+            final_response["plotly_dashboard"] = [optimize_figure(fig) for fig in result]
             final_response["response_text"] = "I have generated the dashboard for you."
 
 
         elif isinstance(result, dict):
             figures = [v for v in result.values() if 'plotly.graph_objs._figure.Figure' in str(type(v))]
             if figures:
-                final_response["plotly_dashboard"] = figures
+                final_response["plotly_dashboard"] = [optimize_figure(fig) for fig in figures]
                 final_response["response_text"] = "Here is the dashboard you requested."
                 other_data = {k: v for k, v in result.items() if 'plotly.graph_objs._figure.Figure' not in str(type(v))}
                 if other_data:
@@ -226,14 +845,14 @@ Now, write the Python code block to generate the dashboard components."""
                     for key, val in other_data.items():
                         final_response["response_text"] += f"\n**{key.replace('_', ' ').title()}**\n```\n{str(val)}\n```\n"
             elif "plotly_fig" in result:
-                final_response["plotly_fig"] = result["plotly_fig"]
+                final_response["plotly_fig"] = optimize_figure(result["plotly_fig"])
                 final_response["response_text"] = "Here is the chart you requested."
             else:
                 final_response["response_text"] = "Here is the analysis result:\n```\n" + json.dumps(result, indent=2) + "\n```"
 
 
         elif 'plotly.graph_objs._figure.Figure' in str(type(result)):
-            final_response["plotly_fig"] = result
+            final_response["plotly_fig"] = optimize_figure(result)
             final_response["response_text"] = "Here is the chart you requested."
         elif isinstance(result, pd.DataFrame):
             final_response["dataframe"] = result
@@ -242,24 +861,23 @@ Now, write the Python code block to generate the dashboard components."""
             final_response["response_text"] = str(result)
         else:
             final_response["response_text"] = "I have processed your request, but there was no specific output to display."
+        return final_response
 
+    def _follow_up_request(self, user_prompt: str, answer_text: str = None):
+        answer = f" Generated Answer: {answer_text}" if answer_text is not None else ""
+        prompt = f"""Generate 2-3 concise follow-up questions. Data Summary: {self.data_summary}. User's last prompt: "{user_prompt}".{answer}"""
+        return "follow_up", prompt, self.llm.bind_tools(tools=[FollowUp]), _follow_up_questions
 
+    def _generate_follow_ups(self, user_prompt: str, answer_text: str = None) -> List[str]:
         try:
-            suggester_llm = self.llm.bind_tools(tools=[FollowUp])
-            prompt = f"""Generate 2-3 concise follow-up questions. Data Summary: {self.data_summary}. User's last prompt: "{state['user_prompt']}". Generated Answer: {final_response.get("response_text", "A chart or data was generated.")}"""
-            response = suggester_llm.invoke(prompt)
-            if response.tool_calls:
-                final_response["follow_up_questions"] = response.tool_calls[0]['args'].get('questions', [])
-            else: final_response["follow_up_questions"] = []
-        except Exception:
-            final_response["follow_up_questions"] = []
-
-        return {"final_response": final_response}
-
-
-
-
-
-
-
+            return self._llm_step(*self._follow_up_request(user_prompt, answer_text), priority=max(self._priority(), PRIORITY_FOLLOW_UP))
+        except Exception as e:
+            record_error(e)
+            return []
 
+    async def _agenerate_follow_ups(self, user_prompt: str, answer_text: str = None) -> List[str]:
+        try:
+            return await self._allm_step(*self._follow_up_request(user_prompt, answer_text), priority=max(self._priority(), PRIORITY_FOLLOW_UP))
+        except Exception as e:
+            record_error(e)
+            return []
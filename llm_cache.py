@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+LLM_CACHE_PATH = os.getenv("DATASENSE_LLM_CACHE_PATH")
+LLM_CACHE_TTL_SECONDS = float(os.getenv("DATASENSE_LLM_CACHE_TTL", "3600"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("DATASENSE_LLM_CACHE_SIZE", "512"))
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapses whitespace so formatting-only differences share a cache entry."""
+    return re.sub(r"\s+", " ", prompt).strip()
+
+class MemoryBackend:
+    """An in-memory LRU store of (value, expires_at) pairs."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None: return None
+            if entry[1] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, value: Any, expires_at: float):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+class SQLiteBackend:
+    """A file-backed LRU store that survives restarts and is shared between processes."""
+
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL, last_access REAL)")
+        self._conn.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None: return None
+            if row[1] < time.time():
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, expires_at: float):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)", (key, json.dumps(value), expires_at, time.time()))
+            self._conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+class LLMCache:
+    """
+    A prompt-level cache for agent LLM calls. Entries are keyed by graph node, model,
+    normalized prompt and data-summary hash, and hold JSON-serializable results.
+    Lookups go to the in-memory LRU first and then to the optional SQLite file.
+    """
+
+    def __init__(self, ttl_seconds: float = LLM_CACHE_TTL_SECONDS, max_entries: int = LLM_CACHE_MAX_ENTRIES, sqlite_path: Optional[str] = None):
+        self.ttl_seconds = ttl_seconds
+        self.memory = MemoryBackend(max_entries)
+        self.sqlite = SQLiteBackend(sqlite_path, max_entries * 8) if sqlite_path else None
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    @staticmethod
+    def make_key(node: str, prompt: str, summary_hash: str, model: str = "") -> str:
+        return hash_text(f"{node}\x00{model}\x00{summary_hash}\x00{normalize_prompt(prompt)}")
+
+    def _lookup(self, node: str, key: str):
+        entry = self.memory.get(key)
+        if entry is None and self.sqlite is not None:
+            entry = self.sqlite.get(key)
+            if entry is not None:
+                self.memory.set(key, *entry)
+        if entry is not None:
+            self.hits[node] += 1
+        else:
+            self.misses[node] += 1
+        return entry
+
+    def _store(self, key: str, value: Any):
+        expires_at = time.time() + self.ttl_seconds
+        self.memory.set(key, value, expires_at)
+        if self.sqlite is not None:
+            self.sqlite.set(key, value, expires_at)
+
+    def get_or_call(self, node: str, prompt: str, summary_hash: str, call: Callable[[], Any], model: str = "") -> Any:
+        """Returns the cached result for this prompt or invokes call() and caches what it returns."""
+        key = self.make_key(node, prompt, summary_hash, model)
+        entry = self._lookup(node, key)
+        if entry is not None: return entry[0]
+        value = call()
+        self._store(key, value)
+        return value
+
+    async def aget_or_call(self, node: str, prompt: str, summary_hash: str, acall: Callable[[], Awaitable[Any]], model: str = "") -> Any:
+        """Async variant of get_or_call for coroutine-returning calls."""
+        key = self.make_key(node, prompt, summary_hash, model)
+        entry = self._lookup(node, key)
+        if entry is not None: return entry[0]
+        value = await acall()
+        self._store(key, value)
+        return value
+
+    def invalidate(self, key: str):
+        """Drops an entry, e.g. generated code that turned out not to run."""
+        self.memory.delete(key)
+        if self.sqlite is not None:
+            self.sqlite.delete(key)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns per-node hit, miss and hit-rate counters."""
+        stats = {}
+        for node in sorted(set(self.hits) | set(self.misses)):
+            hits, misses = self.hits[node], self.misses[node]
+            stats[node] = {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses)}
+        return stats
+
+_llm_cache = None
+
+def get_llm_cache() -> LLMCache:
+    """Returns the process-wide LLM cache, backed by SQLite when DATASENSE_LLM_CACHE_PATH is set."""
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LLMCache(sqlite_path=LLM_CACHE_PATH)
+    return _llm_cache
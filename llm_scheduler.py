@@ -0,0 +1,230 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from telemetry import metrics, record_queue_wait
+
+LLM_MAX_CONCURRENCY = int(os.getenv("DATASENSE_LLM_CONCURRENCY", "8"))
+LLM_RATE_PER_SECOND = float(os.getenv("DATASENSE_LLM_RATE", "10"))
+LLM_BURST = int(os.getenv("DATASENSE_LLM_BURST", "20"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("DATASENSE_LLM_QUEUE_TIMEOUT", "300"))
+# How long the bucket stays empty after the provider answers with a rate-limit error.
+RATE_LIMIT_COOLDOWN = float(os.getenv("DATASENSE_LLM_COOLDOWN", "2"))
+
+# Lower values are served first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_FOLLOW_UP = 1
+PRIORITY_DASHBOARD = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_FOLLOW_UP: "follow_up", PRIORITY_DASHBOARD: "dashboard"}
+
+class SchedulerTimeout(TimeoutError):
+    """Raised when a request waited longer than the queue timeout for a slot."""
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """Recognizes provider throttling (HTTP 429 / ResourceExhausted) without importing the provider's exceptions."""
+    text = f"{type(error).__name__} {error}".lower()
+    return "429" in text or "resourceexhausted" in text or "resource exhausted" in text or "rate limit" in text
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class LLMScheduler:
+    """
+    A process-wide gate for LLM requests from every session. Requests wait in a
+    priority queue for one of max_concurrency slots and a token from a bucket
+    refilled at rate_per_second; a rate-limit error from the provider empties the
+    bucket for a cooldown. Identical requests already in flight are coalesced and
+    share the first caller's response. Works from threads and from event loops.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, rate_per_second: float = LLM_RATE_PER_SECOND,
+                 burst: int = LLM_BURST, queue_timeout: float = LLM_QUEUE_TIMEOUT, coalesce: bool = True):
+        self.max_concurrency = max_concurrency
+        self.coalesce = coalesce
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._inflight = {}
+        self._stats = {"submitted": 0, "coalesced": 0, "completed": 0, "failed": 0, "timeouts": 0, "rate_limited": 0,
+                       "throttled": 0, "max_queue_depth": 0, "wait_s": 0.0}
+        self._waits_by_priority = {}
+
+    def _take_token(self) -> float:
+        """Takes a token if one is available; otherwise returns the seconds until the next one."""
+        if self.rate_per_second <= 0: return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate_per_second)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate_per_second
+
+    def _acquire(self, priority: int) -> float:
+        """Blocks until this request is first in line, a slot is free and a token is available; returns the wait."""
+        ticket = (priority, next(self._sequence))
+        start = time.monotonic()
+        deadline = start + self.queue_timeout
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], len(self._waiting))
+            throttled = False
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise SchedulerTimeout(f"No LLM slot became free within {self.queue_timeout:.0f}s.")
+                    if self._waiting[0] == ticket and self._active < self.max_concurrency:
+                        delay = self._take_token()
+                        if not delay: break
+                        throttled = True
+                        self._cond.wait(min(delay, remaining))
+                    else:
+                        self._cond.wait(remaining)
+            except BaseException:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self._active += 1
+            waited = time.monotonic() - start
+            self._stats["wait_s"] += waited
+            self._stats["throttled"] += throttled
+            name = PRIORITY_NAMES.get(priority, str(priority))
+            count, total = self._waits_by_priority.get(name, (0, 0.0))
+            self._waits_by_priority[name] = (count + 1, total + waited)
+            self._cond.notify_all()
+        return waited
+
+    def _release(self, error: Optional[BaseException] = None):
+        with self._cond:
+            self._active -= 1
+            self._stats["completed" if error is None else "failed"] += 1
+            if error is not None and is_rate_limit_error(error):
+                self._stats["rate_limited"] += 1
+                self._tokens = min(self._tokens, 0.0) - self.rate_per_second * RATE_LIMIT_COOLDOWN
+            self._cond.notify_all()
+
+    def _join(self, key: Optional[str]):
+        """Returns (flight, is_leader); followers of an identical in-flight request get the leader's flight."""
+        with self._cond:
+            self._stats["submitted"] += 1
+            key = key if self.coalesce else None
+            flight = self._inflight.get(key) if key else None
+            if flight is not None:
+                self._stats["coalesced"] += 1
+                return flight, False
+            flight = _Flight()
+            if key: self._inflight[key] = flight
+            return flight, True
+
+    def _land(self, key: Optional[str], flight: _Flight):
+        with self._cond:
+            if key and self._inflight.get(key) is flight:
+                del self._inflight[key]
+        flight.done.set()
+
+    @staticmethod
+    def _result(flight: _Flight):
+        if flight.error is not None: raise flight.error
+        return flight.value
+
+    def run(self, key: Optional[str], call: Callable[[], Any], priority: int = PRIORITY_INTERACTIVE) -> Any:
+        """Runs call() once a slot is granted, or waits for an identical in-flight request keyed by key."""
+        flight, leader = self._join(key)
+        if not leader:
+            flight.done.wait()
+            return self._result(flight)
+        try:
+            record_queue_wait(self._acquire(priority))
+            try:
+                flight.value = call()
+            except BaseException as e:
+                self._release(e)
+                raise
+            self._release()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight)
+        return flight.value
+
+    async def arun(self, key: Optional[str], acall: Callable[[], Awaitable[Any]], priority: int = PRIORITY_INTERACTIVE) -> Any:
+        """Async variant of run. Waiting happens on executor threads so any event loop can share the scheduler."""
+        loop = asyncio.get_running_loop()
+        flight, leader = self._join(key)
+        if not leader:
+            await asyncio.shield(loop.run_in_executor(None, flight.done.wait))
+            return self._result(flight)
+        try:
+            granted = loop.run_in_executor(None, self._acquire, priority)
+            try:
+                waited = await asyncio.shield(granted)
+            except asyncio.CancelledError:
+                # The slot may still be granted after cancellation; hand it straight back.
+                granted.add_done_callback(lambda future: future.cancelled() or future.exception() or self._release())
+                raise
+            record_queue_wait(waited)
+            try:
+                flight.value = await acall()
+            except BaseException as e:
+                self._release(e)
+                raise
+            self._release()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight)
+        return flight.value
+
+    def stats(self) -> dict:
+        """Returns the current queue depth and slot usage with cumulative request, coalescing and wait counters."""
+        with self._cond:
+            stats = dict(self._stats, queue_depth=len(self._waiting), active=self._active, inflight=len(self._inflight))
+            waits = dict(self._waits_by_priority)
+        granted = stats["completed"] + stats["failed"] + stats["active"]
+        stats["avg_wait_s"] = stats["wait_s"] / granted if granted else 0.0
+        stats["avg_wait_s_by_priority"] = {name: total / count for name, (count, total) in waits.items()}
+        return stats
+
+    def gauges(self) -> dict:
+        stats = self.stats()
+        return {
+            "datasense_llm_queue_depth": stats["queue_depth"],
+            "datasense_llm_active_requests": stats["active"],
+            "datasense_llm_max_queue_depth": stats["max_queue_depth"],
+            "datasense_llm_scheduled_total": stats["submitted"],
+            "datasense_llm_coalesced_total": stats["coalesced"],
+            "datasense_llm_rate_limited_total": stats["rate_limited"],
+            "datasense_llm_queue_timeouts_total": stats["timeouts"],
+            "datasense_llm_queue_wait_seconds_sum": stats["wait_s"],
+        }
+
+_llm_scheduler = None
+_llm_scheduler_lock = threading.Lock()
+
+def get_llm_scheduler() -> LLMScheduler:
+    """Returns the process-wide LLM scheduler, configured from DATASENSE_LLM_* environment variables."""
+    global _llm_scheduler
+    with _llm_scheduler_lock:
+        if _llm_scheduler is None:
+            _llm_scheduler = LLMScheduler()
+            metrics.register_gauges(_llm_scheduler.gauges)
+    return _llm_scheduler
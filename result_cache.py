@@ -0,0 +1,107 @@
+import ast
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import pandas as pd
+
+from figure_utils import figure_from_json, figure_json
+from llm_cache import hash_text
+
+RESULT_CACHE_MB = float(os.getenv("DATASENSE_RESULT_CACHE_MB", "256"))
+
+def _is_figure(value) -> bool:
+    return 'plotly.graph_objs._figure.Figure' in str(type(value))
+
+def normalize_code(code: str) -> Optional[str]:
+    """Returns the code's AST without positions, so comments and formatting do not matter; None if it does not parse."""
+    try:
+        return ast.dump(ast.parse(code), annotate_fields=False, include_attributes=False)
+    except (SyntaxError, ValueError):
+        return None
+
+def result_key(code: str, data_version: str) -> Optional[str]:
+    """Keys a code execution by its normalized code and the version of the data it runs against."""
+    normalized = normalize_code(code)
+    return hash_text(f"{data_version}\x00{normalized}") if normalized is not None else None
+
+def _encode(value):
+    """Returns (encoded, nbytes): figures as JSON, frames as Arrow tables, anything else as-is."""
+    if _is_figure(value):
+        spec = figure_json(value)
+        return ("figure", spec), len(spec)
+    if isinstance(value, list) and value and all(_is_figure(v) for v in value):
+        specs = [figure_json(v) for v in value]
+        return ("figures", specs), sum(len(spec) for spec in specs)
+    if isinstance(value, pd.DataFrame):
+        import pyarrow as pa
+        table = pa.Table.from_pandas(value)
+        return ("frame", table), table.nbytes
+    return ("value", value), len(str(value))
+
+def _decode(encoded):
+    kind, value = encoded
+    if kind == "figure": return figure_from_json(value)
+    if kind == "figures": return [figure_from_json(spec) for spec in value]
+    if kind == "frame": return value.to_pandas()
+    return value
+
+class ResultCache:
+    """
+    A size-bounded LRU of finished agent responses for generated code, keyed by
+    result_key(). Figures are kept as JSON and frames as Arrow, so every hit hands
+    out fresh objects. The data version in the key is the dataset key, which
+    changes whenever a chat modifies its frame, so stale entries are never hit
+    and simply age out.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return {name: _decode(value) for name, value in entry[0].items()}
+
+    def put(self, key: str, response: Dict[str, Any]) -> bool:
+        """Stores a response; returns False if it could not be encoded or is larger than the whole cache."""
+        import pyarrow as pa
+        try:
+            encoded = {name: _encode(value) for name, value in response.items()}
+        except (pa.ArrowException, TypeError, ValueError):
+            return False
+        nbytes = sum(size for _, size in encoded.values())
+        if nbytes > self.max_bytes: return False
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None: self._size -= previous[1]
+            self._entries[key] = ({name: value for name, (value, _) in encoded.items()}, nbytes)
+            self._size += nbytes
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "size_bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+_result_cache = None
+
+def get_result_cache() -> ResultCache:
+    """Returns the process-wide execution-result cache."""
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache(int(RESULT_CACHE_MB * 1024 * 1024))
+    return _result_cache
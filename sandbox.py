@@ -0,0 +1,301 @@
+import atexit
+import json
+import math
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from multiprocessing.connection import Client, Listener
+
+from code_validator import writes_in_place
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SANDBOX_ENABLED = os.getenv("DATASENSE_SANDBOX", "1") == "1"
+SANDBOX_WORKERS = int(os.getenv("DATASENSE_SANDBOX_WORKERS", "2"))
+SANDBOX_WALL_SECONDS = float(os.getenv("DATASENSE_SANDBOX_WALL_SECONDS", "60"))
+SANDBOX_CPU_SECONDS = int(os.getenv("DATASENSE_SANDBOX_CPU_SECONDS", "45"))
+SANDBOX_MEMORY_MB = int(os.getenv("DATASENSE_SANDBOX_MEMORY_MB", "4096"))
+SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+CANCEL_POLL_SECONDS = 0.1
+# Frames a worker keeps materialized, so the full frame and a preview sample do not evict each other.
+WORKER_FRAME_CACHE = 2
+
+class SandboxError(Exception):
+    """Raised when a sandboxed job is killed for exceeding its time or memory limits, or its data cannot be shared."""
+
+def arrow_compatible(df):
+    """Turns object columns Arrow cannot type (mixed ints and strings, say) into strings; missing values stay missing."""
+    import pyarrow as pa
+    converted = None
+    for i, dtype in enumerate(df.dtypes):
+        if dtype != object: continue
+        column = df.iloc[:, i]
+        try:
+            pa.array(column, from_pandas=True)
+        except (pa.ArrowException, TypeError, ValueError):
+            if converted is None: converted = df.copy(deep=False)
+            converted.isetitem(i, column.astype(str).where(column.notna(), None))
+    return df if converted is None else converted
+
+def _frame_bytes(df) -> bytes:
+    """A frame as Arrow IPC stream bytes, index included."""
+    import pyarrow as pa
+    table = pa.Table.from_pandas(arrow_compatible(df))
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def _read_frame_bytes(data: bytes):
+    import pyarrow as pa
+    return pa.ipc.open_stream(data).read_all().to_pandas()
+
+def _json_key(key):
+    return key if isinstance(key, (str, int, float, bool)) or key is None else str(key)
+
+def _encode_result(value, blobs):
+    """
+    Converts an execution result into JSON-serializable parts: figures as Plotly JSON, frames
+    and series as Arrow IPC bytes appended to blobs, scalars as JSON values, anything else as text.
+    """
+    import numpy as np
+    import pandas as pd
+    if 'plotly.graph_objs._figure.Figure' in str(type(value)):
+        return {"__kind__": "figure", "json": value.to_json()}
+    if isinstance(value, pd.DataFrame):
+        blobs.append(_frame_bytes(value))
+        return {"__kind__": "frame", "blob": len(blobs) - 1}
+    if isinstance(value, pd.Series):
+        blobs.append(_frame_bytes(value.to_frame("values")))
+        return {"__kind__": "series", "blob": len(blobs) - 1, "name": _json_key(value.name)}
+    if isinstance(value, dict):
+        return {"__kind__": "dict", "items": [(_json_key(k), _encode_result(v, blobs)) for k, v in value.items()]}
+    if isinstance(value, (list, tuple)):
+        return {"__kind__": type(value).__name__, "items": [_encode_result(v, blobs) for v in value]}
+    if isinstance(value, np.generic) and not isinstance(value, (np.datetime64, np.timedelta64)):
+        value = value.item()
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return {"__kind__": "value", "value": value}
+    return {"__kind__": "value", "value": str(value)}
+
+def _decode_result(encoded, blobs):
+    kind = encoded["__kind__"]
+    if kind == "figure":
+        import plotly.io as pio
+        return pio.from_json(encoded["json"])
+    if kind == "frame":
+        return _read_frame_bytes(blobs[encoded["blob"]])
+    if kind == "series":
+        return _read_frame_bytes(blobs[encoded["blob"]])["values"].rename(encoded["name"])
+    if kind == "dict":
+        return {k: _decode_result(v, blobs) for k, v in encoded["items"]}
+    if kind in ("list", "tuple"):
+        items = [_decode_result(v, blobs) for v in encoded["items"]]
+        return tuple(items) if kind == "tuple" else items
+    return encoded["value"]
+
+def _send_reply(conn, reply, blobs=()):
+    """Sends a JSON header and then the binary blobs it refers to; nothing the parent reads back is pickled."""
+    conn.send_bytes(json.dumps(dict(reply, blobs=len(blobs))).encode("utf-8"))
+    for blob in blobs:
+        conn.send_bytes(blob)
+
+def _recv_reply(conn):
+    reply = json.loads(conn.recv_bytes())
+    return reply, [conn.recv_bytes() for _ in range(reply["blobs"])]
+
+def _load_frame(path):
+    """Materializes a DataFrame from a memory-mapped Arrow file."""
+    import pyarrow as pa
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+def _worker_main(conn, memory_mb):
+    """
+    Worker loop: pre-imports the analysis stack, then runs jobs until the pipe closes.
+    Shared frames are converted from Arrow once and kept; each job runs on a copy (a deep
+    one only if the code writes into arrays), and a frame the code modified or rebound
+    `df` to is sent back so the app can adopt it.
+    """
+    from collections import OrderedDict
+    import pandas as pd
+    import plotly.express as px
+    import pyarrow  # noqa: F401  (pre-warm)
+    from frame_utils import same_data
+    if resource is not None and memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    frames = OrderedDict()
+    _send_reply(conn, {"ready": True})
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if resource is not None and job.get("cpu_seconds"):
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            soft = math.ceil(usage.ru_utime + usage.ru_stime) + job["cpu_seconds"]
+            # Only the soft limit moves; exceeding it delivers SIGXCPU, which kills the worker.
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, resource.getrlimit(resource.RLIMIT_CPU)[1]))
+        try:
+            path = job["frame_path"]
+            if path not in frames:
+                frames[path] = _load_frame(path)
+                while len(frames) > WORKER_FRAME_CACHE: frames.popitem(last=False)
+            frames.move_to_end(path)
+            original = frames[path]
+            local_scope = {'df': original.copy(deep=job["deep_copy"]), 'pd': pd, 'px': px}
+            exec(job["code"], {}, local_scope)
+            blobs = []
+            reply = {"ok": True, "result": _encode_result(local_scope.get('result'), blobs), "frame": None}
+            frame = local_scope.get('df')
+            if isinstance(frame, pd.DataFrame) and not same_data(original, frame):
+                blobs.append(_frame_bytes(frame))
+                reply["frame"] = len(blobs) - 1
+            _send_reply(conn, reply, blobs)
+        except MemoryError:
+            _send_reply(conn, {"ok": False, "error": f"Job exceeded the {memory_mb} MB memory limit."})
+        except Exception as e:
+            _send_reply(conn, {"ok": False, "error": str(e)})
+
+class _Worker:
+    # Started as a plain script rather than a multiprocessing child: spawn would re-run the
+    # Streamlit script (the parent's __main__) in every worker.
+    def __init__(self, memory_mb):
+        authkey = os.urandom(32)
+        self._listener = Listener(authkey=authkey)
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), self._listener.address, str(memory_mb)],
+            stdin=subprocess.PIPE,
+        )
+        self.process.stdin.write(authkey.hex().encode() + b"\n")
+        self.process.stdin.close()
+        self.conn = None
+        self._connected = threading.Event()
+        threading.Thread(target=self._accept, daemon=True).start()
+        self.ready = False
+
+    def _accept(self):
+        try:
+            self.conn = self._listener.accept()
+        except OSError:
+            pass
+        finally:
+            self._listener.close()
+            self._connected.set()
+
+    def wait_ready(self, timeout):
+        if not self.ready:
+            deadline = time.monotonic() + timeout
+            if not self._connected.wait(timeout) or self.conn is None or not self.conn.poll(max(deadline - time.monotonic(), 0)):
+                raise SandboxError("Sandbox worker did not start in time.")
+            _recv_reply(self.conn)
+            self.ready = True
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait(timeout=5)
+        self._listener.close()
+        if self.conn is not None: self.conn.close()
+
+class SandboxPool:
+    """
+    A pool of pre-warmed worker processes that execute generated code with a
+    wall-clock timeout, a CPU-time limit and an address-space cap. DataFrames are
+    handed over as Arrow files in shared memory and memory-mapped by the workers;
+    results come back as JSON with Plotly JSON and Arrow IPC bytes, never pickled,
+    so a compromised worker cannot run code in the app. A killed worker is
+    replaced and the job fails with SandboxError.
+    """
+
+    def __init__(self, workers=SANDBOX_WORKERS, wall_seconds=SANDBOX_WALL_SECONDS, cpu_seconds=SANDBOX_CPU_SECONDS, memory_mb=SANDBOX_MEMORY_MB):
+        self.wall_seconds = wall_seconds
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self._idle = queue.Queue()
+        self._shared_paths = []
+        self._lock = threading.Lock()
+        for _ in range(workers):
+            self._idle.put(_Worker(memory_mb))
+
+    def share_frame(self, df) -> str:
+        """Writes df once to an Arrow IPC file in shared memory and returns its path."""
+        import pyarrow as pa
+        path = os.path.join(SHARED_DIR, f"datasense-{uuid.uuid4().hex}.arrow")
+        try:
+            table = pa.Table.from_pandas(arrow_compatible(df))
+            with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            if os.path.exists(path): os.remove(path)
+            raise SandboxError(f"The data could not be handed to the sandbox: {e}") from e
+        with self._lock:
+            self._shared_paths.append(path)
+        return path
+
+    def release_frame(self, path: str):
+        with self._lock:
+            if path in self._shared_paths: self._shared_paths.remove(path)
+        if os.path.exists(path): os.remove(path)
+
+    def run(self, code: str, frame_path: str, cancel=None):
+        """
+        Executes code against a copy of the shared frame and returns (result, frame): the decoded
+        `result`, and the frame if the code modified or rebound `df`, else None. Setting cancel (an Event) kills the job.
+        """
+        worker = self._idle.get()
+        started = time.monotonic()
+        try:
+            worker.wait_ready(self.wall_seconds)
+            worker.conn.send({"code": code, "frame_path": frame_path, "cpu_seconds": self.cpu_seconds, "deep_copy": writes_in_place(code)})
+            while not worker.conn.poll(min(CANCEL_POLL_SECONDS, max(started + self.wall_seconds - time.monotonic(), 0))):
+                if cancel is not None and cancel.is_set():
+                    raise SandboxError("Execution was cancelled.")
+                if time.monotonic() - started >= self.wall_seconds:
+                    raise SandboxError(f"Execution timed out after {self.wall_seconds:.0f} seconds.")
+            reply, blobs = _recv_reply(worker.conn)
+        except (EOFError, OSError, ValueError, KeyError, SandboxError) as e:
+            worker.kill()
+            worker = _Worker(self.memory_mb)
+            if isinstance(e, SandboxError): raise
+            raise SandboxError(f"Execution was killed after {time.monotonic() - started:.1f}s (CPU or memory limit exceeded).") from e
+        finally:
+            self._idle.put(worker)
+        if not reply["ok"]:
+            raise RuntimeError(reply["error"])
+        frame = _read_frame_bytes(blobs[reply["frame"]]) if reply["frame"] is not None else None
+        return _decode_result(reply["result"], blobs), frame
+
+    def shutdown(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().kill()
+        for path in list(self._shared_paths):
+            self.release_frame(path)
+
+_sandbox_pool = None
+
+def get_sandbox_pool() -> SandboxPool:
+    """Returns the process-wide sandbox pool, starting its workers on first use."""
+    global _sandbox_pool
+    if _sandbox_pool is None:
+        _sandbox_pool = SandboxPool()
+        atexit.register(_sandbox_pool.shutdown)
+    return _sandbox_pool
+
+def _serve_worker():
+    """Entry point of a worker process: connects back to the pool and runs jobs."""
+    address, memory_mb = sys.argv[1], int(sys.argv[2])
+    authkey = bytes.fromhex(sys.stdin.readline().strip())
+    _worker_main(Client(address, authkey=authkey), memory_mb)
+
+if __name__ == "__main__":
+    _serve_worker()
@@ -0,0 +1,324 @@
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+from dataset_registry import get_dataset_registry
+from upload_cache import CACHE_DIR
+
+SESSION_DB_PATH = os.getenv("DATASENSE_SESSION_DB", os.path.join(CACHE_DIR, "sessions.sqlite"))
+SESSION_BLOB_DIR = os.getenv("DATASENSE_SESSION_BLOB_DIR", os.path.join(CACHE_DIR, "sessions"))
+# Signs the resume tokens put in the URL; a random key is kept next to the database when unset.
+SESSION_SECRET = os.getenv("DATASENSE_SESSION_SECRET")
+SESSION_MEMORY_MB = float(os.getenv("DATASENSE_SESSION_MEMORY_MB", "1024"))
+SESSION_IDLE_MINUTES = float(os.getenv("DATASENSE_SESSION_IDLE_MINUTES", "30"))
+SESSION_RETENTION_DAYS = float(os.getenv("DATASENSE_SESSION_RETENTION_DAYS", "30"))
+# How often last-seen times are written and expired sessions are purged from disk.
+SESSION_SWEEP_SECONDS = 60
+
+def _is_figure(value) -> bool:
+    return 'plotly.graph_objs._figure.Figure' in str(type(value))
+
+class SessionStore:
+    """
+    Persists chats to SQLite (one row per chat and per message) plus a blob
+    directory holding frames as Parquet and figures as gzipped Plotly JSON.
+    Chats are checkpointed incrementally as messages arrive. When the frames
+    held in memory exceed the cap, the least recently used inactive chats are
+    spilled: their heavy fields are dropped and rehydrated from disk on demand.
+    Sessions idle for idle_seconds are spilled and forgotten; the rows and
+    blobs of sessions not seen for retention_seconds are deleted. A chat is
+    only spilled while its session's lock is free, i.e. outside its script runs.
+    Sessions are resumed from signed, single-use tokens (see session_token and claim).
+    """
+
+    def __init__(self, db_path: str, blob_dir: str, memory_cap_bytes: int, idle_seconds: float = SESSION_IDLE_MINUTES * 60,
+                 retention_seconds: float = SESSION_RETENTION_DAYS * 86400, secret: bytes = None):
+        self.blob_dir = blob_dir
+        self.memory_cap_bytes = memory_cap_bytes
+        self.idle_seconds = idle_seconds
+        self.retention_seconds = retention_seconds
+        self._resident = OrderedDict()
+        self._active = {}
+        self._last_seen = {}
+        self._seen_written = {}
+        self._session_locks = {}
+        self._claimed = set()
+        self._last_purge = 0.0
+        self._lock = threading.RLock()
+        os.makedirs(blob_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chats (chat_id TEXT PRIMARY KEY, session_id TEXT, df_name TEXT, frame_path TEXT, dashboard_paths TEXT, updated_at REAL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS messages (chat_id TEXT, position INTEGER, role TEXT, payload TEXT, PRIMARY KEY (chat_id, position))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, last_seen REAL)")
+        self._conn.commit()
+        self._secret = secret or self._load_secret(os.path.join(os.path.dirname(os.path.abspath(db_path)), "session.key"))
+
+    @staticmethod
+    def _load_secret(path: str) -> bytes:
+        """Reads the signing key, creating it readable by this user only on first use."""
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            with open(path, "rb") as f:
+                return f.read()
+        key = os.urandom(32)
+        with os.fdopen(fd, "wb") as f:
+            f.write(key)
+        return key
+
+    def _signature(self, session_id: str) -> str:
+        return hmac.new(self._secret, session_id.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def session_token(self, session_id: str) -> str:
+        """The token that resumes session_id, signed so ids cannot be guessed or forged."""
+        return f"{session_id}.{self._signature(session_id)}"
+
+    def claim(self, token: str):
+        """
+        Resumes the session behind a token under a new session id, which is returned, or None
+        for a forged token. The old token stops working, so a leaked link is only good until its
+        owner next opens the app, and a tab still open on the old id no longer writes its chats.
+        """
+        session_id, _, signature = (token or "").partition(".")
+        if not session_id or not hmac.compare_digest(signature, self._signature(session_id)): return None
+        with self._lock:
+            self._claimed.add(session_id)
+            new_id = uuid.uuid4().hex
+            self._conn.execute("UPDATE chats SET session_id = ? WHERE session_id = ?", (new_id, session_id))
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+            return new_id
+
+    def claimed(self, session_id: str) -> bool:
+        """True if the session was resumed elsewhere and this copy of it must start over."""
+        with self._lock:
+            return session_id in self._claimed
+
+    def _chat_dir(self, chat_id: str) -> str:
+        path = os.path.join(self.blob_dir, chat_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @staticmethod
+    def _write_frame(df: pd.DataFrame, path: str) -> str:
+        """Writes df as Parquet, falling back to pickle when Arrow cannot represent it; returns the path used."""
+        try:
+            df.to_parquet(path)
+            return path
+        except Exception:
+            if os.path.exists(path): os.remove(path)
+            path = os.path.splitext(path)[0] + ".pkl"
+            with open(path, "wb") as f:
+                pickle.dump(df, f, protocol=5)
+            return path
+
+    @staticmethod
+    def _read_frame(path: str) -> pd.DataFrame:
+        if path.endswith(".pkl"):
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        return pd.read_parquet(path)
+
+    @staticmethod
+    def _write_figure(fig, path: str) -> str:
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write(fig.to_json())
+        return path
+
+    @staticmethod
+    def _read_figure(path: str):
+        import plotly.io as pio
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return pio.from_json(f.read())
+
+    def _encode_message(self, chat_id: str, position: int, content) -> str:
+        """Serializes a message, moving figures and frames into blobs that the payload references."""
+        if not isinstance(content, dict):
+            return json.dumps({"text": content})
+        directory, payload = self._chat_dir(chat_id), {}
+        for key, value in content.items():
+            if _is_figure(value):
+                payload[key] = {"figure": self._write_figure(value, os.path.join(directory, f"msg{position}_{key}.json.gz"))}
+            elif isinstance(value, list) and value and all(_is_figure(v) for v in value):
+                payload[key] = {"figures": [self._write_figure(v, os.path.join(directory, f"msg{position}_{key}{i}.json.gz")) for i, v in enumerate(value)]}
+            elif isinstance(value, pd.DataFrame):
+                payload[key] = {"frame": self._write_frame(value, os.path.join(directory, f"msg{position}_{key}.parquet"))}
+            else:
+                payload[key] = {"value": value}
+        return json.dumps({"content": payload}, default=str)
+
+    def _decode_message(self, payload: str):
+        payload = json.loads(payload)
+        if "text" in payload: return payload["text"]
+        content = {}
+        for key, value in payload["content"].items():
+            if "figure" in value: content[key] = self._read_figure(value["figure"])
+            elif "figures" in value: content[key] = [self._read_figure(path) for path in value["figures"]]
+            elif "frame" in value: content[key] = self._read_frame(value["frame"])
+            else: content[key] = value["value"]
+        return content
+
+    def checkpoint(self, session_id: str, chat_id: str, chat: dict):
+        """Writes whatever part of the chat is not on disk yet: the frame, new messages and a new dashboard."""
+        if chat.get("spilled"): return
+        with self._lock:
+            if session_id in self._claimed: return
+            directory = self._chat_dir(chat_id)
+            if chat.get("df") is not None and not chat.get("frame_path"):
+                chat["frame_path"] = self._write_frame(chat["df"], os.path.join(directory, "frame.parquet"))
+            dashboard = chat.get("dashboard_figures")
+            if dashboard and dashboard is not chat.get("persisted_dashboard"):
+                chat["dashboard_paths"] = [self._write_figure(fig, os.path.join(directory, f"dashboard{i}.json.gz")) for i, fig in enumerate(dashboard) if fig]
+                chat["persisted_dashboard"] = dashboard
+            messages = chat.get("messages", [])
+            start = chat.get("persisted_messages", 0)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?)",
+                [(chat_id, i, messages[i]["role"], self._encode_message(chat_id, i, messages[i]["content"])) for i in range(start, len(messages))],
+            )
+            chat["persisted_messages"] = len(messages)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chats VALUES (?, ?, ?, ?, ?, ?)",
+                (chat_id, session_id, chat.get("df_name"), chat.get("frame_path"), json.dumps(chat.get("dashboard_paths") or []), time.time()),
+            )
+            self._conn.commit()
+
+    def spill(self, session_id: str, chat_id: str, chat: dict):
+        """Checkpoints the chat and drops its frame, messages, figures and agent from memory."""
+        with self._lock:
+            self.checkpoint(session_id, chat_id, chat)
+            chat.update({"df": None, "dataset": None, "messages": [], "agent": None, "data_summary": None, "dashboard_figures": None,
+                         "persisted_dashboard": None, "chat_export": None, "df_bytes": 0, "spilled": True})
+            self._resident.pop(chat_id, None)
+
+    def rehydrate(self, chat_id: str, chat: dict):
+        """Reloads a spilled chat in place."""
+        if not chat.get("spilled"): return
+        with self._lock:
+            row = self._conn.execute("SELECT frame_path, dashboard_paths FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()
+            rows = self._conn.execute("SELECT role, payload FROM messages WHERE chat_id = ? ORDER BY position", (chat_id,)).fetchall()
+        frame_path, dashboard_paths = row if row else (None, "[]")
+        dashboard = [self._read_figure(path) for path in json.loads(dashboard_paths or "[]")] or None
+        # If another chat still holds the same data, share its frame instead of keeping the copy just read.
+        dataset = get_dataset_registry().acquire(self._read_frame(frame_path)) if frame_path else None
+        chat.update({
+            "df": dataset.df if dataset else None,
+            "dataset": dataset,
+            "frame_path": frame_path,
+            "messages": [{"role": role, "content": self._decode_message(payload)} for role, payload in rows],
+            "persisted_messages": len(rows),
+            "dashboard_figures": dashboard, "persisted_dashboard": dashboard,
+            "dashboard_paths": json.loads(dashboard_paths or "[]"),
+            "spilled": False,
+        })
+        chat.pop("df_bytes", None)
+
+    def list_chats(self, session_id: str):
+        """Returns (chat_id, df_name) for a session's persisted chats, oldest first."""
+        with self._lock:
+            return self._conn.execute("SELECT chat_id, df_name FROM chats WHERE session_id = ? ORDER BY updated_at", (session_id,)).fetchall()
+
+    def session_lock(self, session_id: str) -> threading.RLock:
+        """Returns the lock a session holds while its script runs."""
+        with self._lock:
+            return self._session_locks.setdefault(session_id, threading.RLock())
+
+    def _try_spill(self, session_id: str, chat_id: str, chat: dict) -> bool:
+        """Spills the chat unless its session is running right now."""
+        lock = self.session_lock(session_id)
+        if not lock.acquire(blocking=False): return False
+        try:
+            self.spill(session_id, chat_id, chat)
+        finally:
+            lock.release()
+        return True
+
+    def track(self, session_id: str, chat_id: str, chat: dict):
+        """Marks the chat as the session's active one, expires idle sessions and spills other chats while over the memory cap."""
+        with self.session_lock(session_id), self._lock:
+            now = time.time()
+            self.rehydrate(chat_id, chat)
+            if chat.get("df_bytes") is None:
+                chat["df_bytes"] = int(chat["df"].memory_usage(deep=True).sum()) if chat.get("df") is not None else 0
+            self._active[session_id] = chat_id
+            self._resident[chat_id] = (session_id, chat)
+            self._resident.move_to_end(chat_id)
+            self._touch(session_id, now)
+            self.expire_idle(now)
+            active = set(self._active.values())
+            for victim_id, (victim_session, victim) in list(self._resident.items()):
+                if self.resident_bytes() <= self.memory_cap_bytes: break
+                if victim_id not in active:
+                    self._try_spill(victim_session, victim_id, victim)
+            if now - self._last_purge >= SESSION_SWEEP_SECONDS:
+                self.purge_expired(now)
+
+    def _touch(self, session_id: str, now: float):
+        self._last_seen[session_id] = now
+        if now - self._seen_written.get(session_id, 0.0) >= SESSION_SWEEP_SECONDS:
+            self._conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?)", (session_id, now))
+            self._conn.commit()
+            self._seen_written[session_id] = now
+
+    def expire_idle(self, now: float = None):
+        """Spills the chats of sessions not seen for idle_seconds and stops tracking them."""
+        now = time.time() if now is None else now
+        with self._lock:
+            for session_id, seen in list(self._last_seen.items()):
+                if now - seen < self.idle_seconds: continue
+                lock = self.session_lock(session_id)
+                if not lock.acquire(blocking=False): continue
+                try:
+                    for chat_id, (owner, chat) in list(self._resident.items()):
+                        if owner == session_id: self.spill(session_id, chat_id, chat)
+                finally:
+                    lock.release()
+                for state in (self._active, self._last_seen, self._seen_written, self._session_locks):
+                    state.pop(session_id, None)
+
+    def purge_expired(self, now: float = None) -> int:
+        """Deletes the rows and blobs of chats whose session was not seen for retention_seconds; returns how many."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._last_purge = now
+            rows = self._conn.execute(
+                "SELECT c.chat_id, c.session_id FROM chats c LEFT JOIN sessions s ON s.session_id = c.session_id "
+                "WHERE COALESCE(s.last_seen, c.updated_at) < ?",
+                (now - self.retention_seconds,),
+            ).fetchall()
+            chat_ids = [(chat_id,) for chat_id, session_id in rows if session_id not in self._last_seen]
+            self._conn.executemany("DELETE FROM messages WHERE chat_id = ?", chat_ids)
+            self._conn.executemany("DELETE FROM chats WHERE chat_id = ?", chat_ids)
+            self._conn.execute("DELETE FROM sessions WHERE last_seen < ?", (now - self.retention_seconds,))
+            self._conn.commit()
+        for (chat_id,) in chat_ids:
+            shutil.rmtree(os.path.join(self.blob_dir, chat_id), ignore_errors=True)
+        return len(chat_ids)
+
+    def resident_bytes(self) -> int:
+        # Chats sharing a registry frame count it once.
+        return sum({id(chat.get("df")): chat.get("df_bytes") or 0 for _, chat in self._resident.values()}.values())
+
+_session_store = None
+_session_store_lock = threading.Lock()
+
+def get_session_store() -> SessionStore:
+    """Returns the process-wide session store."""
+    global _session_store
+    with _session_store_lock:
+        if _session_store is None:
+            secret = SESSION_SECRET.encode("utf-8") if SESSION_SECRET else None
+            _session_store = SessionStore(SESSION_DB_PATH, SESSION_BLOB_DIR, int(SESSION_MEMORY_MB * 1024 * 1024), secret=secret)
+    return _session_store
@@ -0,0 +1,174 @@
+import contextlib
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from upload_cache import CACHE_DIR
+
+METRICS_PATH = os.getenv("DATASENSE_METRICS_FILE", os.path.join(CACHE_DIR, "metrics.prom"))
+# Request logs identify prompts by hash and length; their text is only logged when this is set.
+LOG_PROMPTS = os.getenv("DATASENSE_LOG_PROMPTS", "0") == "1"
+logger = logging.getLogger("datasense.telemetry")
+_current_span = contextvars.ContextVar("datasense_span", default=None)
+
+def _estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+def _response_text(response) -> str:
+    content = getattr(response, "content", None)
+    if content: return content if isinstance(content, str) else json.dumps(content, default=str)
+    tool_calls = getattr(response, "tool_calls", None)
+    if tool_calls: return json.dumps([call.get("args") for call in tool_calls], default=str)
+    return response if isinstance(response, str) else json.dumps(response, default=str)
+
+class Span:
+    """Timing, token and error record for one graph node execution."""
+
+    def __init__(self, node: str, retries: int = 0):
+        self.node = node
+        self.retries = retries
+        self.started = time.time()
+        self.wall_s = None
+        self.llm_calls = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.queue_wait_s = 0.0
+        self.error = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+class RequestTrace:
+    """The spans of one agent request, logged as a JSON line and folded into the metrics when finished."""
+
+    def __init__(self, prompt: str):
+        self.request_id = uuid.uuid4().hex
+        self.prompt = prompt
+        self.started = time.time()
+        self.total_s = None
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, node: str, retries: int = 0):
+        span = Span(node, retries)
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.wall_s = time.perf_counter() - start
+            _current_span.reset(token)
+            with self._lock:
+                self.spans.append(span)
+
+    def finish(self):
+        self.total_s = time.time() - self.started
+        metrics.observe(self)
+        logger.info(json.dumps(self.to_dict(), default=str))
+        metrics.write(METRICS_PATH)
+
+    def to_dict(self) -> Dict[str, Any]:
+        prompt = {"prompt_sha256": hashlib.sha256(self.prompt.encode("utf-8")).hexdigest(), "prompt_chars": len(self.prompt)}
+        if LOG_PROMPTS: prompt["prompt"] = self.prompt
+        return {"request_id": self.request_id, **prompt, "started": self.started, "total_s": self.total_s,
+                "replans": sum(span.node == "replan_node" for span in self.spans), "spans": [span.to_dict() for span in self.spans]}
+
+def record_llm_call(prompt: str, response=None, response_text: Optional[str] = None):
+    """Adds an LLM round-trip to the current span, preferring the provider's token usage over an estimate."""
+    span = _current_span.get()
+    if span is None: return
+    span.llm_calls += 1
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        span.prompt_tokens += usage.get("input_tokens", 0)
+        span.response_tokens += usage.get("output_tokens", 0)
+    else:
+        span.prompt_tokens += _estimate_tokens(prompt)
+        span.response_tokens += _estimate_tokens(response_text if response_text is not None else _response_text(response))
+
+def record_cache_lookup(hit: bool):
+    span = _current_span.get()
+    if span is not None and hit: span.cache_hits += 1
+
+def record_queue_wait(seconds: float):
+    span = _current_span.get()
+    if span is not None: span.queue_wait_s += seconds
+
+def record_error(error):
+    """Marks the current span as failed; nodes call this for exceptions they turn into an error state. The first error wins."""
+    span = _current_span.get()
+    if span is not None and span.error is None: span.error = error if isinstance(error, str) else type(error).__name__
+
+class MetricsRegistry:
+    """Process-wide counters over finished requests, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._counters = defaultdict(float)
+        self._gauges = []
+        self._lock = threading.Lock()
+
+    def register_gauges(self, collect):
+        """Adds a callable returning {metric_name: value}; it is sampled whenever the metrics are rendered."""
+        with self._lock:
+            self._gauges.append(collect)
+
+    def observe(self, trace: RequestTrace):
+        with self._lock:
+            self._counters[("datasense_requests_total", ())] += 1
+            self._counters[("datasense_request_duration_seconds_sum", ())] += trace.total_s
+            for span in trace.spans:
+                node = (("node", span.node),)
+                self._counters[("datasense_node_duration_seconds_sum", node)] += span.wall_s
+                self._counters[("datasense_node_duration_seconds_count", node)] += 1
+                self._counters[("datasense_node_queue_wait_seconds_sum", node)] += span.queue_wait_s
+                self._counters[("datasense_llm_calls_total", node)] += span.llm_calls
+                self._counters[("datasense_llm_cache_hits_total", node)] += span.cache_hits
+                self._counters[("datasense_llm_tokens_total", node + (("direction", "prompt"),))] += span.prompt_tokens
+                self._counters[("datasense_llm_tokens_total", node + (("direction", "response"),))] += span.response_tokens
+                if span.error:
+                    self._counters[("datasense_node_errors_total", node + (("error", span.error),))] += 1
+            self._counters[("datasense_replans_total", ())] += sum(span.node == "replan_node" for span in trace.spans)
+
+    def render(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = list(self._gauges)
+        lines, typed = [], set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'untyped'}")
+                typed.add(name)
+            label_text = "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+            lines.append(f"{name}{label_text} {value:g}")
+        for collect in gauges:
+            for name, value in sorted(collect().items()):
+                lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+                lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """Atomically replaces path with the current metrics, for a node-exporter style textfile collector."""
+        if not path: return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                f.write(self.render())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not write metrics to %s: %s", path, e)
+
+metrics = MetricsRegistry()
@@ -0,0 +1,24 @@
+import glob
+import os
+import tempfile
+
+import pandas as pd
+
+import chat_export
+from chat_export import export_chat_html
+
+MESSAGES = [
+    {"role": "user", "content": "Show the <first> rows"},
+    {"role": "assistant", "content": "Here they are.", "result": pd.DataFrame({"value": range(5)})},
+]
+
+def leftover_exports():
+    return set(glob.glob(os.path.join(tempfile.gettempdir(), "datasense-chat-*.html")))
+
+def test_export_returns_the_page_and_leaves_no_file_behind(monkeypatch):
+    before = leftover_exports()
+    # A tiny spool forces the rollover to a file on disk.
+    monkeypatch.setattr(chat_export, "EXPORT_SPOOL_MB", 0.0001)
+    page = export_chat_html(MESSAGES, title="Sales").decode("utf-8")
+    assert "&lt;first&gt;" in page and "Sales" in page
+    assert leftover_exports() == before
@@ -0,0 +1,74 @@
+import pytest
+
+from code_validator import validate_code, writes_in_place
+
+COLUMNS = ["Region", "unit_price", "quantity"]
+
+@pytest.mark.parametrize("code", [
+    "result = df.groupby('region')['price'].mean()",
+    "df['revenue'] = df['price'] * df['quantity']\nresult = df",
+    "for col in ['price', 'quantity']:\n    df[col] = df[col].fillna(0)\nresult = df",
+    "df = df.drop_duplicates()\nresult = len(df)",
+    "df.columns = ['a', 'b']\nresult = df",
+    "result = {}\nresult['mean'] = df['price'].mean()",
+    "result = df['price'].apply(lambda v: v * 2)",
+])
+def test_column_level_changes_and_reads_run_on_a_shallow_copy(code):
+    assert not writes_in_place(code)
+
+@pytest.mark.parametrize("code", [
+    "df.loc[df['price'] < 0, 'price'] = 0\nresult = df",
+    "df.fillna(0, inplace=True)\nresult = df",
+    "prices = df['price']\nprices[0] = 5\nresult = prices",
+    "df['price'][0] = 5\nresult = df",
+    "df['price'] += 1\nresult = df",
+    "df[df['price'] < 0] = 0\nresult = df",
+    "import numpy as np\nnp.random.shuffle(df.values)\nresult = df",
+    "df.index.name = 'row'\nresult = df",
+    "def clip(frame):\n    frame.iloc[0, 0] = 0\nclip(df)\nresult = df",
+    "for name, column in df.items():\n    column.iloc[0] = 0\nresult = df",
+    "df.update(df.fillna(0))\nresult = df",
+])
+def test_writes_into_arrays_need_a_deep_copy(code):
+    assert writes_in_place(code)
+
+@pytest.mark.parametrize("code, message", [
+    ("import os\nresult = os.listdir('.')", "`import os` is not allowed"),
+    ("from subprocess import run\nresult = run(['ls'])", "`from subprocess import ...` is not allowed"),
+    ("result = open('/etc/passwd').read()", "`open` is not allowed"),
+    ("result = getattr(df, 'to_csv')('out.csv')", "`getattr` is not allowed"),
+    ("result = ().__class__", "`__class__` is not allowed"),
+    ("result = ().__class__.__mro__[1].__subclasses__()", "`__subclasses__` is not allowed"),
+    ("result = df.__dict__", "`__dict__` is not allowed"),
+])
+def test_unsafe_code_is_rejected(code, message):
+    check = validate_code(code, COLUMNS)
+    assert not check.ok and any(message in error for error in check.errors)
+
+def test_harmless_imports_are_allowed():
+    assert validate_code("import numpy as np\nresult = np.log(df['quantity'])", COLUMNS).ok
+
+@pytest.mark.parametrize("code, repaired", [
+    ("result = df.groupby('region')['unit price'].mean()", "result = df.groupby('Region')['unit_price'].mean()"),
+    ("result = df['quantty'].sum()", "result = df['quantity'].sum()"),
+    ("result = px.bar(df, x='REGION', y='Quantity')", "result = px.bar(df, x='Region', y='quantity')"),
+])
+def test_near_miss_column_names_are_repaired(code, repaired):
+    check = validate_code(code, COLUMNS)
+    assert check.ok and check.code == repaired and check.repaired_columns
+
+def test_unknown_columns_and_columns_the_code_creates():
+    check = validate_code("result = df['customer'].nunique()", COLUMNS)
+    assert not check.ok and "column 'customer' is not in df" in check.errors[0]
+    created = "df['revenue'] = df['unit_price'] * df['quantity']\nresult = df.sort_values('revenue')"
+    assert validate_code(created, COLUMNS).ok and validate_code(created, COLUMNS).code == created
+
+def test_a_trailing_expression_becomes_the_result():
+    check = validate_code("totals = df.groupby('Region')['quantity'].sum()\ntotals.sort_values()", COLUMNS)
+    assert check.ok and check.code.endswith("result = totals.sort_values()")
+    assert check.repairs == ["assigned the last expression to `result`"] and not check.repaired_columns
+
+@pytest.mark.parametrize("code", ["print(df['quantity'].sum())", "total = df['quantity'].sum()"])
+def test_code_without_a_result_is_rejected(code):
+    check = validate_code(code, COLUMNS)
+    assert not check.ok and "never assigns a variable named `result`" in check.errors[0]
@@ -0,0 +1,92 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_handler
+from data_handler import DataProfile, DistinctSketch, load_data, optimize_dtypes
+from upload_cache import UploadCache
+
+class Upload(io.BytesIO):
+    """Stands in for a Streamlit UploadedFile."""
+
+    def __init__(self, data: bytes, name: str):
+        super().__init__(data)
+        self.name, self.size = name, len(data)
+
+def test_floats_keep_float64_so_large_sums_stay_exact():
+    values = np.arange(2_000_000) + 0.5
+    df = optimize_dtypes(pd.DataFrame({"half": values}))
+    assert df["half"].dtype == "float64"
+    assert df["half"].sum() == values.sum()
+
+def test_integers_stay_int64_and_repeated_text_becomes_categorical():
+    df = optimize_dtypes(pd.DataFrame({"count": [50_000] * 4, "region": ["north", "south"] * 2}))
+    assert df["count"].dtype == "int64" and (df["count"] * 100_000).iloc[0] == 5_000_000_000
+    assert isinstance(df["region"].dtype, pd.CategoricalDtype)
+
+def test_csv_load_keeps_number_widths(monkeypatch, tmp_path):
+    cache = UploadCache(str(tmp_path / "uploads"), 64 * 1024 * 1024)
+    monkeypatch.setattr(data_handler, "get_upload_cache", lambda: cache)
+    csv = "price,quantity\n" + "".join(f"{i}.5,{i}\n" for i in range(1_000))
+    df = load_data(Upload(csv.encode(), "sales.csv"))
+    assert df.dtypes.to_dict() == {"price": np.dtype("float64"), "quantity": np.dtype("int64")}
+
+@pytest.fixture
+def sketched(monkeypatch):
+    monkeypatch.setattr(data_handler, "PROFILE_SKETCH_ROWS", 1_000)
+
+def make_profiled_frame(rows=5_000, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "region": pd.Categorical(rng.choice(["North", "South", "East", "West"], rows)),
+        "product": rng.choice([f"SKU-{i}" for i in range(800)], rows).astype(object),
+        "quantity": rng.integers(1, 50, rows),
+        "price": rng.normal(100, 25, rows).round(2),
+    })
+    df.loc[rng.random(rows) < 0.05, "price"] = np.nan
+    # Duplicate rows, so the row hash has something to find.
+    return pd.concat([df, df.iloc[:100]], ignore_index=True)
+
+def assert_same_profile(incremental, full):
+    assert incremental.rows == full.rows
+    assert incremental.columns == full.columns
+    assert (incremental.row_hash == full.row_hash).all()
+    assert incremental.duplicate_rows == full.duplicate_rows
+
+def test_distinct_sketch_estimate_and_removal():
+    hashes = pd.util.hash_array(np.arange(50_000))
+    sketch = DistinctSketch().add(hashes)
+    assert abs(sketch.estimate() - 50_000) / 50_000 < 0.05
+    # Removing hashes leaves exactly the sketch of the rest, and copies are independent.
+    removed = sketch.copy().remove(hashes[:20_000])
+    assert (removed.counts == DistinctSketch().add(hashes[20_000:]).counts).all()
+    assert sketch.estimate() != removed.estimate()
+
+@pytest.mark.parametrize("edit", [
+    lambda df: df.drop_duplicates(),
+    lambda df: df[df["quantity"] > 10],
+    lambda df: df.sample(frac=1.0, random_state=0),
+    lambda df: df.sort_values("price").head(3_000),
+    lambda df: df.assign(price=df["price"].fillna(0)),
+    lambda df: df.assign(revenue=df["price"] * df["quantity"]),
+    lambda df: df.drop(columns=["product"]),
+    lambda df: df.drop_duplicates().assign(quantity=lambda d: d["quantity"] * 2).drop(columns=["region"]),
+])
+def test_incremental_profile_matches_a_full_profile(sketched, edit):
+    df = make_profiled_frame()
+    profile = DataProfile(df)
+    edited = edit(df)
+    assert_same_profile(profile.updated(edited), DataProfile(edited))
+
+def test_incremental_profile_keeps_unchanged_columns(sketched, monkeypatch):
+    df = make_profiled_frame()
+    profile = DataProfile(df)
+    edited = df.drop(columns=["product"]).assign(revenue=df["price"] * df["quantity"])
+    hashed = []
+    original_hash = data_handler._column_hash
+    monkeypatch.setattr(data_handler, "_column_hash", lambda series: hashed.append(series.name) or original_hash(series))
+    profile.updated(edited)
+    # Only the new column is hashed, plus the dropped one to take it out of the row hash.
+    assert sorted(hashed) == ["product", "revenue"]
@@ -0,0 +1,48 @@
+import json
+import queue
+import threading
+
+import pytest
+
+from dtale_host import DtaleHost
+
+class FakeProcess:
+    """Stands in for the host process: answers each request line through answer(message)."""
+
+    def __init__(self, host, answer):
+        self.host, self.answer, self.sent = host, answer, []
+        self.stdin = self
+
+    def write(self, line):
+        self.sent.append(json.loads(line))
+
+    def flush(self):
+        for reply in self.answer(self.sent[-1]):
+            self.host._replies.put(reply)
+
+    def poll(self):
+        return None
+
+def make_host(answer):
+    host = DtaleHost.__new__(DtaleHost)
+    host._replies, host.port = queue.Queue(), 1234
+    host._lock = threading.Lock()
+    host.process = FakeProcess(host, answer)
+    return host
+
+def test_late_reply_to_a_timed_out_request_is_not_taken_for_the_next():
+    pending = []
+    def answer(message):
+        # The first request is answered only after the second one was sent.
+        pending.append(message)
+        if len(pending) == 1: return []
+        return [{"ok": True, "id": m["id"], "data_id": m["data_id"]} for m in pending]
+    host = make_host(answer)
+    with pytest.raises(TimeoutError):
+        host._request({"op": "drop", "data_id": "first"}, timeout=0.05)
+    assert host._request({"op": "drop", "data_id": "second"}, timeout=1)["data_id"] == "second"
+
+def test_host_exit_ends_the_wait():
+    host = make_host(lambda message: [{"ok": False, "error": "The interactive analysis host exited."}])
+    with pytest.raises(RuntimeError, match="exited"):
+        host._request({"op": "drop", "data_id": "x"}, timeout=1)
@@ -0,0 +1,30 @@
+import numpy as np
+import plotly.graph_objects as go
+import pytest
+
+from figure_utils import optimize_figure
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+def test_decimated_line_without_x_keeps_point_positions(method):
+    y = np.sin(np.linspace(0, 20, 50_000))
+    fig = optimize_figure(go.Figure(go.Scatter(y=y, mode="lines")), line_points=2_000, method=method)
+    trace = fig.data[0]
+    assert trace.type == "scattergl" and len(trace.y) <= 2_000
+    x = np.asarray(trace.x)
+    assert x[0] == 0 and x[-1] == len(y) - 1
+    assert (np.asarray(trace.y) == y[x.astype(int)]).all()
+
+def test_decimated_line_without_x_honours_x0_and_dx():
+    fig = optimize_figure(go.Figure(go.Scatter(y=np.arange(10_000.0), x0=100, dx=0.5, mode="lines")), line_points=1_000)
+    x = np.asarray(fig.data[0].x)
+    assert x[0] == 100 and x[-1] == 100 + 9_999 * 0.5
+
+def test_decimated_line_with_x_keeps_matching_pairs():
+    x = np.arange(20_000) * 3.0
+    y = np.cos(x / 1000)
+    trace = optimize_figure(go.Figure(go.Scatter(x=x, y=y, mode="lines")), line_points=1_000).data[0]
+    assert (np.cos(np.asarray(trace.x) / 1000) == np.asarray(trace.y)).all()
+
+def test_small_figures_are_returned_unchanged():
+    fig = go.Figure(go.Scatter(y=[1, 2, 3]))
+    assert optimize_figure(fig) is fig
@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+
+import llm_agent
+from benchmarks import FakeLLM, make_fake_agent, make_synthetic_frame
+
+@pytest.fixture(autouse=True)
+def in_process(monkeypatch):
+    monkeypatch.setattr(llm_agent, "SANDBOX_ENABLED", False)
+
+@pytest.fixture
+def duplicated():
+    df = make_synthetic_frame(1_000)
+    return pd.concat([df, df.iloc[:10]], ignore_index=True)
+
+@pytest.mark.parametrize("code", [
+    "df = df.drop_duplicates()\nresult = len(df)",
+    "df.drop_duplicates(inplace=True)\nresult = len(df)",
+])
+def test_rebound_and_in_place_changes_are_both_adopted(duplicated, code):
+    agent = make_fake_agent(duplicated, FakeLLM(code=code))
+    agent.invoke_agent("Remove the duplicate rows")
+    assert len(agent.df) == 1_000
+    assert len(duplicated) == 1_010
+
+def test_new_column_is_adopted_without_touching_the_original(duplicated):
+    agent = make_fake_agent(duplicated, FakeLLM(code="df['revenue'] = df['price'] * df['quantity']\nresult = df['revenue'].sum()"))
+    agent.invoke_agent("Add a revenue column")
+    assert "revenue" in agent.df.columns and "revenue" not in duplicated.columns
+
+def test_read_only_code_keeps_the_frame(duplicated):
+    agent = make_fake_agent(duplicated, FakeLLM(code="result = df['price'].mean()"))
+    agent.invoke_agent("What is the average price?")
+    assert agent.df is duplicated
+
+def test_rebinding_df_to_a_non_frame_is_ignored(duplicated):
+    agent = make_fake_agent(duplicated, FakeLLM(code="df = df['price']\nresult = df.mean()"))
+    agent.invoke_agent("What is the average price?")
+    assert agent.df is duplicated
+
+def test_a_repeated_prompt_is_answered_from_the_llm_cache(duplicated):
+    llm = FakeLLM(code="result = df['price'].mean()")
+    agent = make_fake_agent(duplicated, llm)
+    first = agent.invoke_agent("What is the typical price?")
+    calls = llm.calls
+    second = agent.invoke_agent("What is the typical price?")
+    assert llm.calls == calls and sum(agent.llm_cache.hits.values()) > 0
+    assert second["response_text"] == first["response_text"]
+
+def test_the_llm_cache_misses_for_other_data(duplicated):
+    llm = FakeLLM(code="result = df['price'].mean()")
+    agent = make_fake_agent(duplicated, llm)
+    agent.invoke_agent("What is the typical price?")
+    calls = llm.calls
+    other = make_fake_agent(make_synthetic_frame(500, seed=1), llm, llm_cache=agent.llm_cache)
+    other.invoke_agent("What is the typical price?")
+    assert llm.calls > calls
+
+def test_the_llm_cache_misses_after_generated_code_changes_the_data(duplicated):
+    llm = FakeLLM(code="df = df.drop_duplicates()\nresult = len(df)")
+    agent = make_fake_agent(duplicated, llm)
+    agent.invoke_agent("How many rows are left without duplicates?")
+    assert len(agent.df) == 1_000
+    calls = llm.calls
+    agent.invoke_agent("How many rows are left without duplicates?")
+    assert llm.calls > calls
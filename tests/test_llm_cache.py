@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+import llm_cache
+from llm_cache import LLMCache
+
+SUMMARY = "summary-hash"
+
+class FakeLLM:
+    """Counts calls and answers with a fresh value each time, so a cached answer is recognizable."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return {"answer": self.calls}
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+    return now
+
+def test_memory_hit():
+    cache, llm = LLMCache(), FakeLLM()
+    first = cache.get_or_call("intent_router", "What is the average price?", SUMMARY, llm)
+    second = cache.get_or_call("intent_router", "What is the average price?", SUMMARY, llm)
+    assert first == second == {"answer": 1}
+    assert llm.calls == 1
+    assert cache.stats()["intent_router"] == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+
+def test_whitespace_only_differences_share_an_entry():
+    cache, llm = LLMCache(), FakeLLM()
+    cache.get_or_call("code_generator", "Plot  price\nby region", SUMMARY, llm)
+    cache.get_or_call("code_generator", " Plot price by region ", SUMMARY, llm)
+    assert llm.calls == 1
+
+def test_async_hit():
+    cache, llm = LLMCache(), FakeLLM()
+    async def acall():
+        return llm()
+    async def ask():
+        return await cache.aget_or_call("follow_up", "Suggest questions", SUMMARY, acall)
+    assert asyncio.run(ask()) == asyncio.run(ask()) == {"answer": 1}
+    assert llm.calls == 1
+
+def test_sqlite_hit_across_instances(tmp_path):
+    path = str(tmp_path / "llm_cache.sqlite")
+    llm = FakeLLM()
+    LLMCache(sqlite_path=path).get_or_call("intent_router", "Which region sells most?", SUMMARY, llm)
+    # A new instance has an empty memory tier, as after a restart or in another process.
+    restarted = LLMCache(sqlite_path=path)
+    assert restarted.get_or_call("intent_router", "Which region sells most?", SUMMARY, llm) == {"answer": 1}
+    assert llm.calls == 1
+    assert restarted.stats()["intent_router"]["hits"] == 1
+
+def test_ttl_expiry(clock):
+    cache, llm = LLMCache(ttl_seconds=60), FakeLLM()
+    cache.get_or_call("intent_router", "prompt", SUMMARY, llm)
+    clock[0] += 59
+    assert cache.get_or_call("intent_router", "prompt", SUMMARY, llm) == {"answer": 1}
+    clock[0] += 2
+    assert cache.get_or_call("intent_router", "prompt", SUMMARY, llm) == {"answer": 2}
+    assert llm.calls == 2
+
+def test_ttl_expiry_in_sqlite(tmp_path, clock):
+    path = str(tmp_path / "llm_cache.sqlite")
+    llm = FakeLLM()
+    LLMCache(ttl_seconds=60, sqlite_path=path).get_or_call("intent_router", "prompt", SUMMARY, llm)
+    clock[0] += 61
+    assert LLMCache(ttl_seconds=60, sqlite_path=path).get_or_call("intent_router", "prompt", SUMMARY, llm) == {"answer": 2}
+
+def test_size_eviction():
+    cache, llm = LLMCache(max_entries=2), FakeLLM()
+    for prompt in ("a", "b", "a", "c"):
+        cache.get_or_call("intent_router", prompt, SUMMARY, llm)
+    # "b" was least recently used when "c" arrived.
+    cache.get_or_call("intent_router", "a", SUMMARY, llm)
+    assert llm.calls == 3
+    cache.get_or_call("intent_router", "b", SUMMARY, llm)
+    assert llm.calls == 4
+
+def test_keys_are_separated_by_node():
+    cache, llm = LLMCache(), FakeLLM()
+    cache.get_or_call("intent_router", "prompt", SUMMARY, llm)
+    assert cache.get_or_call("code_generator", "prompt", SUMMARY, llm) == {"answer": 2}
+    assert cache.stats()["code_generator"]["misses"] == 1
+
+def test_keys_are_separated_by_model():
+    cache, llm = LLMCache(), FakeLLM()
+    cache.get_or_call("intent_router", "prompt", SUMMARY, llm, model="models/gemini-2.5-flash")
+    assert cache.get_or_call("intent_router", "prompt", SUMMARY, llm, model="models/gemini-2.5-pro") == {"answer": 2}
+    assert cache.get_or_call("intent_router", "prompt", SUMMARY, llm, model="models/gemini-2.5-flash") == {"answer": 1}
+
+def test_keys_are_separated_by_data_summary():
+    cache, llm = LLMCache(), FakeLLM()
+    cache.get_or_call("intent_router", "prompt", "sales.csv", llm)
+    assert cache.get_or_call("intent_router", "prompt", "churn.csv", llm) == {"answer": 2}
+
+def test_invalidate():
+    cache, llm = LLMCache(), FakeLLM()
+    cache.get_or_call("code_generator", "prompt", SUMMARY, llm)
+    cache.invalidate(LLMCache.make_key("code_generator", "prompt", SUMMARY))
+    assert cache.get_or_call("code_generator", "prompt", SUMMARY, llm) == {"answer": 2}
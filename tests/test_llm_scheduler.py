@@ -0,0 +1,209 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import llm_scheduler
+from benchmarks import FakeLLMServer, FakeRateLimitError, HTTPScriptedLLM
+from llm_scheduler import PRIORITY_DASHBOARD, PRIORITY_FOLLOW_UP, PRIORITY_INTERACTIVE, LLMScheduler, SchedulerTimeout
+
+class FakeLLM:
+    """A local stand-in for the provider: records calls and can be held open or made to fail."""
+
+    def __init__(self, error: Exception = None):
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+        self.error = error
+        self._lock = threading.Lock()
+
+    def call(self, name):
+        def request():
+            with self._lock:
+                self.calls.append(name)
+            self.release.wait(5)
+            if self.error is not None: raise self.error
+            return f"answer to {name}"
+        return request
+
+@pytest.fixture
+def server():
+    server = FakeLLMServer(delay=0.1, max_concurrency=2, rate_per_second=3)
+    yield server
+    server.close()
+
+def post(server, prompt):
+    """An LLM call that goes over HTTP to the fake server; a 429 surfaces as the provider's quota error."""
+    llm = HTTPScriptedLLM(server.url)
+    return lambda: llm.wait(prompt) or f"answer to {prompt}"
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+def start(func, *args):
+    thread = threading.Thread(target=func, args=args, daemon=True)
+    thread.start()
+    return thread
+
+def test_interactive_requests_overtake_queued_dashboard_requests():
+    scheduler, llm = LLMScheduler(max_concurrency=1, rate_per_second=0), FakeLLM()
+    llm.release.clear()
+    threads = [start(scheduler.run, None, llm.call("running"), PRIORITY_DASHBOARD)]
+    wait_for(lambda: scheduler.stats()["active"] == 1)
+    for name, priority in (("dashboard", PRIORITY_DASHBOARD), ("follow_up", PRIORITY_FOLLOW_UP), ("interactive", PRIORITY_INTERACTIVE)):
+        threads.append(start(scheduler.run, None, llm.call(name), priority))
+        wait_for(lambda: scheduler.stats()["queue_depth"] == len(threads) - 1)
+    llm.release.set()
+    for thread in threads: thread.join(5)
+    assert llm.calls == ["running", "interactive", "follow_up", "dashboard"]
+
+def test_equal_priorities_are_served_in_arrival_order():
+    scheduler, llm = LLMScheduler(max_concurrency=1, rate_per_second=0), FakeLLM()
+    llm.release.clear()
+    threads = [start(scheduler.run, None, llm.call("running"))]
+    wait_for(lambda: scheduler.stats()["active"] == 1)
+    for i in range(3):
+        threads.append(start(scheduler.run, None, llm.call(i)))
+        wait_for(lambda: scheduler.stats()["queue_depth"] == i + 1)
+    llm.release.set()
+    for thread in threads: thread.join(5)
+    assert llm.calls == ["running", 0, 1, 2]
+
+def test_concurrency_is_bounded():
+    scheduler, llm = LLMScheduler(max_concurrency=2, rate_per_second=0), FakeLLM()
+    llm.release.clear()
+    threads = [start(scheduler.run, None, llm.call(i)) for i in range(5)]
+    wait_for(lambda: scheduler.stats()["queue_depth"] == 3)
+    assert scheduler.stats()["active"] == 2 and len(llm.calls) == 2
+    llm.release.set()
+    for thread in threads: thread.join(5)
+    assert len(llm.calls) == 5 and scheduler.stats()["completed"] == 5
+
+def test_token_bucket_limits_the_request_rate():
+    scheduler, llm = LLMScheduler(max_concurrency=8, rate_per_second=20, burst=2), FakeLLM()
+    start_time = time.monotonic()
+    for i in range(6):
+        scheduler.run(None, llm.call(i))
+    elapsed = time.monotonic() - start_time
+    # Two requests use the burst, the other four wait for a token each at 20 per second.
+    assert elapsed >= 4 / 20 * 0.9
+    assert scheduler.stats()["throttled"] == 4
+
+def test_identical_in_flight_requests_are_coalesced():
+    scheduler, llm = LLMScheduler(rate_per_second=0), FakeLLM()
+    llm.release.clear()
+    results = []
+    threads = [start(lambda: results.append(scheduler.run("same-prompt", llm.call("leader"))))]
+    wait_for(lambda: len(llm.calls) == 1)
+    threads += [start(lambda: results.append(scheduler.run("same-prompt", llm.call("follower")))) for _ in range(3)]
+    wait_for(lambda: scheduler.stats()["coalesced"] == 3)
+    llm.release.set()
+    for thread in threads: thread.join(5)
+    assert llm.calls == ["leader"]
+    assert results == ["answer to leader"] * 4
+    # Once landed, the same key is a new request again.
+    assert scheduler.run("same-prompt", llm.call("later")) == "answer to later"
+
+def test_coalesced_followers_share_the_leaders_error():
+    scheduler, llm = LLMScheduler(rate_per_second=0), FakeLLM(error=ValueError("bad response"))
+    llm.release.clear()
+    errors = []
+    def ask():
+        try:
+            scheduler.run("same-prompt", llm.call("request"))
+        except ValueError as e:
+            errors.append(e)
+    threads = [start(ask)]
+    wait_for(lambda: len(llm.calls) == 1)
+    threads.append(start(ask))
+    wait_for(lambda: scheduler.stats()["coalesced"] == 1)
+    llm.release.set()
+    for thread in threads: thread.join(5)
+    assert len(errors) == 2 and llm.calls == ["request"]
+
+def test_async_requests_are_coalesced():
+    scheduler, calls = LLMScheduler(rate_per_second=0), []
+    async def request():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+    async def main():
+        return await asyncio.gather(*(scheduler.arun("same-prompt", request) for _ in range(3)))
+    assert asyncio.run(main()) == ["answer"] * 3
+    assert len(calls) == 1 and scheduler.stats()["coalesced"] == 2
+
+def test_rate_limit_error_empties_the_bucket_for_the_cooldown(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, "RATE_LIMIT_COOLDOWN", 0.3)
+    scheduler = LLMScheduler(max_concurrency=8, rate_per_second=100, burst=5)
+    throttled = FakeLLM(error=RuntimeError("429 Resource has been exhausted (e.g. check quota)."))
+    with pytest.raises(RuntimeError):
+        scheduler.run(None, throttled.call("throttled"))
+    assert scheduler.stats()["rate_limited"] == 1
+    start_time = time.monotonic()
+    scheduler.run(None, FakeLLM().call("retry"))
+    assert time.monotonic() - start_time >= 0.3 * 0.9
+
+def test_other_errors_do_not_trigger_the_cooldown():
+    scheduler = LLMScheduler(max_concurrency=8, rate_per_second=100, burst=5)
+    with pytest.raises(ValueError):
+        scheduler.run(None, FakeLLM(error=ValueError("bad response")).call("failed"))
+    start_time = time.monotonic()
+    scheduler.run(None, FakeLLM().call("next"))
+    assert time.monotonic() - start_time < 0.1
+    assert scheduler.stats()["rate_limited"] == 0 and scheduler.stats()["failed"] == 1
+
+def test_queue_timeout():
+    scheduler, llm = LLMScheduler(max_concurrency=1, rate_per_second=0, queue_timeout=0.1), FakeLLM()
+    llm.release.clear()
+    thread = start(scheduler.run, None, llm.call("running"))
+    wait_for(lambda: scheduler.stats()["active"] == 1)
+    with pytest.raises(SchedulerTimeout):
+        scheduler.run(None, llm.call("waiting"))
+    llm.release.set()
+    thread.join(5)
+    assert scheduler.stats()["timeouts"] == 1 and scheduler.stats()["queue_depth"] == 0
+
+def test_http_requests_within_the_servers_quota_are_never_rejected(server):
+    scheduler = LLMScheduler(max_concurrency=2, rate_per_second=2, burst=1)
+    results = []
+    threads = [start(lambda i=i: results.append(scheduler.run(None, post(server, f"prompt {i}")))) for i in range(5)]
+    for thread in threads: thread.join(10)
+    assert len(results) == 5 and server.served == 5 and server.rejected == 0
+
+def test_unscheduled_http_requests_over_the_quota_get_429(server):
+    errors = []
+    def ask(i):
+        try:
+            post(server, f"prompt {i}")()
+        except FakeRateLimitError as e:
+            errors.append(e)
+    threads = [start(ask, i) for i in range(5)]
+    for thread in threads: thread.join(10)
+    assert server.rejected == len(errors) > 0
+
+def test_a_retry_after_an_http_429_waits_out_the_cooldown(monkeypatch, server):
+    monkeypatch.setattr(llm_scheduler, "RATE_LIMIT_COOLDOWN", 1.0)
+    # Sized above the server's 3 per second, so the fourth request in a second is rejected.
+    scheduler = LLMScheduler(max_concurrency=1, rate_per_second=10, burst=10)
+    for i in range(3):
+        scheduler.run(None, post(server, f"prompt {i}"))
+    with pytest.raises(FakeRateLimitError):
+        scheduler.run(None, post(server, "prompt 3"))
+    assert scheduler.stats()["rate_limited"] == 1
+    start_time = time.monotonic()
+    assert scheduler.run(None, post(server, "prompt 3")) == "answer to prompt 3"
+    assert time.monotonic() - start_time >= 0.9
+    assert server.rejected == 1 and server.served == 4
+
+def test_identical_http_requests_in_flight_reach_the_server_once(server):
+    server.delay = 0.3
+    scheduler = LLMScheduler(max_concurrency=2, rate_per_second=0)
+    results = []
+    threads = [start(lambda: results.append(scheduler.run("same-prompt", post(server, "same prompt")))) for _ in range(4)]
+    for thread in threads: thread.join(10)
+    assert results == ["answer to same prompt"] * 4
+    assert server.served == 1 and scheduler.stats()["coalesced"] == 3
@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import pytest
+
+import sandbox
+from sandbox import SandboxError, SandboxPool, _decode_result, _encode_result
+
+needs_rlimits = pytest.mark.skipif(sandbox.resource is None, reason="resource limits need a POSIX system")
+
+@pytest.fixture(scope="module")
+def frame():
+    return pd.DataFrame({
+        "region": pd.Categorical(["north", "south", "north"]),
+        "price": [1.5, 2.0, np.nan],
+        "when": pd.date_range("2024-01-01", periods=3, tz="UTC"),
+        "mixed": [1, "two", None],
+    })
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = SandboxPool(workers=1, wall_seconds=2, cpu_seconds=1, memory_mb=1024)
+    yield pool
+    pool.shutdown()
+
+def worker_process(pool):
+    return pool._idle.queue[0].process
+
+def test_results_are_encoded_as_json_and_arrow(frame):
+    value = {"table": frame.drop(columns="mixed"), "prices": frame["price"].rename("price"), 3: (np.int64(7), None), "chart": px.bar(x=["a"], y=[1])}
+    blobs = []
+    # The worker sends exactly this: a JSON header plus the blobs it refers to.
+    encoded = json.loads(json.dumps(_encode_result(value, blobs)))
+    assert all(blob.startswith(b"\xff\xff\xff\xff") for blob in blobs)  # Arrow IPC stream messages
+    decoded = _decode_result(encoded, blobs)
+    pd.testing.assert_frame_equal(decoded["table"], frame.drop(columns="mixed"))
+    pd.testing.assert_series_equal(decoded["prices"], frame["price"].rename("price"))
+    assert decoded[3] == (7, None) and decoded["chart"].data[0].type == "bar"
+
+def test_a_job_returns_its_result_and_a_rebound_frame(pool, frame):
+    path = pool.share_frame(frame)
+    try:
+        result, changed = pool.run("result = df.groupby('region', observed=True)['price'].sum()", path)
+        assert result.to_dict() == {"north": 1.5, "south": 2.0} and changed is None
+        result, changed = pool.run("df = df[df['price'] > 1.8]\nresult = len(df)", path)
+        assert result == 1 and changed["price"].tolist() == [2.0]
+        # Mixed object columns are handed over as text, missing values kept.
+        assert pool.run("result = df['mixed'].tolist()", path)[0] == ["1", "two", None]
+    finally:
+        pool.release_frame(path)
+    assert not os.path.exists(path)
+
+def test_data_arrow_cannot_hold_is_refused_not_pickled(pool):
+    df = pd.DataFrame([[1, 2]], columns=["a", "a"])
+    with pytest.raises(SandboxError, match="could not be handed"):
+        pool.share_frame(df)
+    assert not pool._shared_paths
+
+def run_killed(pool, code, match, cancel=None):
+    path = pool.share_frame(pd.DataFrame({"a": [1]}))
+    try:
+        before = worker_process(pool)
+        with pytest.raises(SandboxError, match=match):
+            pool.run(code, path, cancel=cancel)
+        assert before.poll() is not None and worker_process(pool) is not before
+        # The replacement worker serves the next job.
+        assert pool.run("result = int(df['a'].sum())", path)[0] == 1
+    finally:
+        pool.release_frame(path)
+
+def test_a_job_over_the_wall_clock_limit_is_killed_and_the_worker_replaced(pool):
+    run_killed(pool, "import time\ntime.sleep(30)", "timed out")
+
+def test_a_cancelled_job_is_killed(pool):
+    cancel = threading.Event()
+    threading.Timer(0.3, cancel.set).start()
+    run_killed(pool, "import time\ntime.sleep(30)", "cancelled", cancel)
+
+@needs_rlimits
+def test_a_job_over_the_cpu_limit_is_killed(monkeypatch, pool):
+    monkeypatch.setattr(pool, "wall_seconds", 20)
+    run_killed(pool, "while True:\n    pass", "CPU or memory limit")
+
+@needs_rlimits
+def test_a_job_over_the_memory_limit_fails_and_the_worker_survives(pool):
+    path = pool.share_frame(pd.DataFrame({"a": [1]}))
+    try:
+        before = worker_process(pool)
+        with pytest.raises(RuntimeError, match="1024 MB memory limit"):
+            pool.run("result = bytearray(2 * 1024 ** 3)", path)
+        assert worker_process(pool) is before and pool.run("result = 1", path)[0] == 1
+    finally:
+        pool.release_frame(path)
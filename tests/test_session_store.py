@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from session_store import SessionStore
+
+def make_chat(rows=1_000):
+    df = pd.DataFrame({"value": range(rows)})
+    return {"df": df, "df_name": "data.csv", "messages": [{"role": "user", "content": "hello"}], "dashboard_figures": None}
+
+@pytest.fixture
+def store(tmp_path):
+    return SessionStore(str(tmp_path / "sessions.sqlite"), str(tmp_path / "blobs"), memory_cap_bytes=1, idle_seconds=60, retention_seconds=3600)
+
+def test_inactive_chats_are_spilled_over_the_cap_and_rehydrated(store):
+    first, second = make_chat(), make_chat()
+    store.track("a", "chat1", first)
+    store.track("a", "chat2", second)
+    assert first["spilled"] and first["df"] is None and not second.get("spilled")
+    store.track("a", "chat1", first)
+    assert first["df"]["value"].sum() == sum(range(1_000))
+    assert first["messages"] == [{"role": "user", "content": "hello"}]
+
+def test_a_running_session_is_not_spilled_by_another(store):
+    store.memory_cap_bytes = 10**9
+    chat = make_chat()
+    store.track("a", "chat1", chat)
+    store.track("a", "chat2", make_chat())
+    store.memory_cap_bytes = 1
+    held, release = threading.Event(), threading.Event()
+    def run_session_a():
+        with store.session_lock("a"):
+            held.set()
+            release.wait(5)
+    thread = threading.Thread(target=run_session_a, daemon=True)
+    thread.start()
+    held.wait(5)
+    store.track("b", "chat3", make_chat())
+    assert chat["df"] is not None and not chat.get("spilled")
+    release.set()
+    thread.join(5)
+    store.track("b", "chat3", make_chat())
+    assert chat["spilled"]
+
+def test_idle_sessions_are_spilled_and_forgotten(store):
+    chat = make_chat()
+    store.track("a", "chat1", chat)
+    store.expire_idle(now=time.time() + 61)
+    assert chat["spilled"] and chat["df"] is None
+    assert store.resident_bytes() == 0
+    assert store.list_chats("a") == [("chat1", "data.csv")]
+
+def test_expired_sessions_are_deleted_from_disk(store):
+    store.track("a", "chat1", make_chat())
+    store.checkpoint("a", "chat1", store._resident["chat1"][1])
+    chat_dir = os.path.join(store.blob_dir, "chat1")
+    assert os.path.isdir(chat_dir)
+    later = time.time() + 3601
+    # A session still tracked in memory is kept until it goes idle.
+    assert store.purge_expired(now=later) == 0
+    store.expire_idle(now=later)
+    assert store.purge_expired(now=later) == 1
+    assert store.list_chats("a") == [] and not os.path.exists(chat_dir)
+
+def test_forged_or_unsigned_tokens_resume_nothing(store, tmp_path):
+    store.checkpoint("a", "chat1", make_chat())
+    other = SessionStore(str(tmp_path / "other.sqlite"), str(tmp_path / "other"), 1, secret=b"another key")
+    assert store.claim("a") is None
+    assert store.claim("a.0123456789abcdef") is None
+    assert store.claim(other.session_token("a")) is None
+    assert store.list_chats("a") == [("chat1", "data.csv")]
+
+def test_claiming_a_token_moves_the_chats_and_retires_the_old_session(store):
+    chat = make_chat()
+    store.checkpoint("a", "chat1", chat)
+    token = store.session_token("a")
+    resumed = store.claim(token)
+    assert resumed not in (None, "a")
+    assert store.list_chats(resumed) == [("chat1", "data.csv")] and store.list_chats("a") == []
+    # The tab still open on the old id no longer writes the chats the new owner holds.
+    assert store.claimed("a") and not store.claimed(resumed)
+    chat["messages"].append({"role": "assistant", "content": "stale"})
+    store.checkpoint("a", "chat1", chat)
+    assert store.list_chats(resumed) == [("chat1", "data.csv")]
+    # Claiming the old token again finds nothing left behind it.
+    assert store.list_chats(store.claim(token)) == []
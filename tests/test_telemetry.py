@@ -0,0 +1,27 @@
+import hashlib
+import json
+import logging
+
+import telemetry
+from telemetry import RequestTrace
+
+PROMPT = "Which customers at acme.example spent over $10k?"
+
+def finished_trace(monkeypatch, tmp_path, caplog):
+    monkeypatch.setattr(telemetry, "METRICS_PATH", str(tmp_path / "metrics.prom"))
+    trace = RequestTrace(PROMPT)
+    with trace.span("intent_router"):
+        pass
+    with caplog.at_level(logging.INFO, logger="datasense.telemetry"):
+        trace.finish()
+    return json.loads(caplog.records[-1].getMessage())
+
+def test_request_logs_identify_the_prompt_without_its_text(monkeypatch, tmp_path, caplog):
+    logged = finished_trace(monkeypatch, tmp_path, caplog)
+    assert "prompt" not in logged and "acme" not in caplog.text
+    assert logged["prompt_sha256"] == hashlib.sha256(PROMPT.encode("utf-8")).hexdigest()
+    assert logged["prompt_chars"] == len(PROMPT) and logged["spans"][0]["node"] == "intent_router"
+
+def test_prompt_text_is_logged_when_opted_in(monkeypatch, tmp_path, caplog):
+    monkeypatch.setattr(telemetry, "LOG_PROMPTS", True)
+    assert finished_trace(monkeypatch, tmp_path, caplog)["prompt"] == PROMPT
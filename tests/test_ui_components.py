@@ -0,0 +1,30 @@
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import ui_components
+
+def render_both():
+    import plotly.express as px
+    import streamlit as st
+    from figure_utils import figure_json
+    from ui_components import _plotly_chart_from_json
+    fig = px.line(x=[1, 2, 3], y=[3, 1, 2], title="Trend")
+    _plotly_chart_from_json(st, figure_json(fig))
+    st.plotly_chart(fig, use_container_width=True)
+    column = st.columns(2)[1]
+    _plotly_chart_from_json(column, figure_json(fig))
+    column.plotly_chart(fig, use_container_width=True)
+    with st.form("chart"):
+        _plotly_chart_from_json(st, figure_json(fig))
+        st.plotly_chart(fig, use_container_width=True)
+        st.form_submit_button()
+
+def test_the_fast_path_adds_the_element_st_plotly_chart_adds():
+    assert st.__version__.startswith(ui_components.FAST_FIGURE_STREAMLIT), "recheck _plotly_chart_from_json against this Streamlit release"
+    app = AppTest.from_function(render_both).run()
+    assert not app.exception
+    charts = [element.proto for element in app.get("plotly_chart")]
+    assert len(charts) == 6
+    assert charts[0] == charts[1] and charts[2] == charts[3] and charts[4] == charts[5]
+    assert len(app.columns[1].get("plotly_chart")) == 2
+    assert charts[4].form_id == "chart" and charts[0].id != charts[4].id
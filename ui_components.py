@@ -3,43 +3,186 @@ import pandas as pd
 import base64
 import time
 import os
-from utils import start_new_chat, switch_chat, get_image_download_link, get_chat_download_link
+import json
+from chart_export import get_chart_exporter
+from chat_export import export_chat_html
+from figure_utils import figure_json
+from upload_cache import get_upload_cache
+from fast_router import router_stats
+from code_validator import validator_stats
+from dataset_registry import get_dataset_registry
+from llm_scheduler import get_llm_scheduler
+from result_cache import get_result_cache
+from utils import start_new_chat, switch_chat, get_active_chat_state
 
-def display_chat_messages(messages, agent):
-    """Displays chat messages and handles UI for follow-up questions."""
-    for i, message in enumerate(messages):
+CHAT_RENDER_WINDOW = int(os.getenv("DATASENSE_CHAT_WINDOW", "10"))
+
+# _plotly_chart_from_json relies on Streamlit internals checked against this release only
+# (requirements.txt pins it, tests/test_ui_components.py checks it); any other version takes
+# the public st.plotly_chart path.
+FAST_FIGURE_STREAMLIT = "1.35."
+PLOTLY_CONFIG = {"showLink": False, "linkText": False}
+
+def _plotly_chart_from_json(container, spec: str):
+    """
+    Adds the element st.plotly_chart(fig, use_container_width=True) would add, from the figure's
+    already serialized JSON. This is the only place that touches Streamlit internals.
+    """
+    from streamlit.elements.form import current_form_id
+    from streamlit.proto.PlotlyChart_pb2 import PlotlyChart as PlotlyChartProto
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    from streamlit.runtime.state.common import compute_widget_id
+    dg = st._main if container is st else container
+    proto = PlotlyChartProto(use_container_width=True, theme="streamlit", spec=spec, config=json.dumps(PLOTLY_CONFIG))
+    proto.form_id = current_form_id(dg)
+    ctx = get_script_run_ctx()
+    proto.id = compute_widget_id(
+        "plotly_chart", user_key=None, key=None, plotly_spec=proto.spec, plotly_config=proto.config,
+        selection_mode=("points", "box", "lasso"), is_selection_activated=False, theme="streamlit",
+        form_id=proto.form_id, use_container_width=True, page=ctx.page_script_hash if ctx else None,
+    )
+    dg._enqueue("plotly_chart", proto)
+
+def render_figure(fig, container=None):
+    """Renders a Plotly figure from its cached JSON, skipping the validation and serialization st.plotly_chart repeats on every rerun."""
+    container = container if container is not None else st
+    if st.__version__.startswith(FAST_FIGURE_STREAMLIT):
+        try:
+            _plotly_chart_from_json(container, figure_json(fig))
+            return
+        except Exception:
+            pass
+    container.plotly_chart(fig, use_container_width=True)
+
+def render_response_content(content, message_index):
+    """Renders an assistant response dict: text, charts, dashboards, data and follow-ups."""
+    if "response_text" in content:
+        st.markdown(content["response_text"])
+
+    if "plotly_fig" in content and content["plotly_fig"]:
+        render_figure(content["plotly_fig"])
+
+    if "plotly_dashboard" in content and content["plotly_dashboard"]:
+        dashboard_figs = content["plotly_dashboard"]
+        if dashboard_figs and isinstance(dashboard_figs, list):
+            cols = st.columns(2)
+            for j, fig in enumerate(dashboard_figs):
+                if fig: render_figure(fig, cols[j % 2])
+        else:
+            st.warning("The agent returned an empty or invalid dashboard.")
+
+    if "dataframe" in content and isinstance(content.get("dataframe"), pd.DataFrame) and not content["dataframe"].empty:
+        st.dataframe(content["dataframe"])
+
+    if "follow_up_questions" in content and content["follow_up_questions"]:
+        st.markdown("**Suggested Follow-ups:**")
+        cols = st.columns(min(len(content["follow_up_questions"]), 3))
+        for k, question in enumerate(content["follow_up_questions"]):
+            if cols[k].button(question, key=f"follow_up_{message_index}_{k}_{st.session_state.current_chat_id}"):
+                st.session_state.user_prompt_from_followup = question
+                st.rerun()
+
+def _preview(content) -> str:
+    text = content if isinstance(content, str) else content.get("response_text", "")
+    first_line = text.strip().splitlines()[0] if text.strip() else "(chart or data)"
+    return first_line[:120] + ("…" if len(first_line) > 120 else "")
+
+def display_chat_messages(messages, agent, window=CHAT_RENDER_WINDOW):
+    """
+    Displays chat messages and handles UI for follow-up questions. Only the last
+    `window` messages are rendered in full; older ones collapse to a one-line
+    preview and render their charts and tables only when toggled open.
+    """
+    older = len(messages) - window if window is not None and len(messages) > window else 0
+    if older:
+        with st.expander(f"Earlier messages ({older})"):
+            for i, message in enumerate(messages[:older]):
+                key = f"expand_{i}_{st.session_state.current_chat_id}"
+                with st.chat_message(message["role"]):
+                    if st.toggle(_preview(message["content"]), key=key):
+                        _render_message(message["content"], i)
+
+    for i, message in enumerate(messages[older:], start=older):
         with st.chat_message(message["role"]):
-            content = message["content"]
-            
-            if isinstance(content, str):
-                st.markdown(content)
-                continue
-
-            if "response_text" in content:
-                st.markdown(content["response_text"])
-
-            if "plotly_fig" in content and content["plotly_fig"]:
-                st.plotly_chart(content["plotly_fig"], use_container_width=True)
-
-            if "plotly_dashboard" in content and content["plotly_dashboard"]:
-                dashboard_figs = content["plotly_dashboard"]
-                if dashboard_figs and isinstance(dashboard_figs, list):
-                    cols = st.columns(2)
-                    for j, fig in enumerate(dashboard_figs):
-                        if fig: cols[j % 2].plotly_chart(fig, use_container_width=True)
-                else:
-                    st.warning("The agent returned an empty or invalid dashboard.")
+            _render_message(message["content"], i)
+
+def _render_message(content, message_index):
+    if isinstance(content, str):
+        st.markdown(content)
+    else:
+        render_response_content(content, message_index)
 
-            if "dataframe" in content and isinstance(content.get("dataframe"), pd.DataFrame) and not content["dataframe"].empty:
-                st.dataframe(content["dataframe"])
+def display_agent_stream(events, message_index):
+    """Renders agent progress, streamed code and the answer as events arrive; returns the final response."""
+    response = {"response_text": "Sorry, I couldn't process your request."}
+    with st.chat_message("assistant"):
+        status = st.status("Thinking...", expanded=False)
+        streamed_text, code_placeholder = "", status.empty()
+        answer_placeholder = st.empty()
+        for event in events:
+            if event["type"] == "node":
+                status.update(label=f"{event['label']}...")
+                if event["node"] == "code_generator":
+                    streamed_text = ""
+            elif event["type"] == "token":
+                streamed_text += event["text"]
+                code_placeholder.markdown(streamed_text)
+            elif event["type"] == "preview":
+                status.update(label="Computing the exact result...")
+                preview = event["response"]["preview"]
+                with answer_placeholder.container():
+                    st.caption(f"Preview from {preview['rows']:,} of {preview['total_rows']:,} sampled rows; the exact result replaces it when ready.")
+                    render_response_content(event["response"], message_index)
+            elif event["type"] == "progress":
+                status.update(label=event["label"])
+            elif event["type"] == "answer":
+                status.update(label="Done", state="complete")
+                with answer_placeholder.container():
+                    render_response_content({k: v for k, v in event["response"].items() if k != "follow_up_questions"}, message_index)
+            elif event["type"] == "final":
+                response = event["response"]
+        status.update(label="Done", state="complete")
+    return response
 
-            if "follow_up_questions" in content and content["follow_up_questions"]:
-                st.markdown("**Suggested Follow-ups:**")
-                cols = st.columns(min(len(content["follow_up_questions"]), 3))
-                for k, question in enumerate(content["follow_up_questions"]):
-                    if cols[k].button(question, key=f"follow_up_{i}_{k}_{st.session_state.current_chat_id}"):
-                        st.session_state.user_prompt_from_followup = question
-                        st.rerun()
+def render_export_button(figs, filename, key):
+    """
+    Offers the figures as a PNG (or a zip of PNGs when there are several). Nothing is
+    rendered until the user asks; renders are cached, so later reruns go straight to the download.
+    """
+    exporter = get_chart_exporter()
+    exporter.warm()
+    ready = all(exporter.cached(fig) is not None for fig in figs)
+    label = "Prepare PNG" if len(figs) == 1 else f"Prepare {len(figs)} PNGs"
+    if not ready and st.button(label, key=f"prepare_{key}", use_container_width=True):
+        try:
+            with st.spinner("Rendering..."):
+                for fig in figs: exporter.export(fig)
+            ready = True
+        except Exception:
+            st.error("Could not export chart.")
+    if ready:
+        if len(figs) == 1:
+            st.download_button("Download PNG", exporter.export(figs[0]), filename, "image/png", key=f"download_{key}", use_container_width=True)
+        else:
+            st.download_button("Download ZIP", exporter.export_zip(figs), filename, "application/zip", key=f"download_{key}", use_container_width=True)
+
+def render_chat_export_button(chat):
+    """
+    Offers the chat as a standalone HTML file. The export is rendered only when the
+    user asks, and reused until new messages arrive.
+    """
+    count, data = chat.get("chat_export") or (0, None)
+    ready = data is not None and count == len(chat["messages"])
+    if not ready and st.button("Prepare HTML export", key="prepare_chat_export", use_container_width=True):
+        try:
+            with st.spinner("Writing export..."):
+                data = export_chat_html(chat["messages"], title=f"DataSense AI: {chat.get('df_name', 'Chat')}")
+            chat["chat_export"] = (len(chat["messages"]), data)
+            ready = True
+        except (OSError, ValueError):
+            st.error("Could not export chat.")
+    if ready:
+        st.download_button("Export as HTML", data, "chat_history.html", "text/html", key="download_chat_export", use_container_width=True)
 
 def setup_sidebar():
     """Sets up the sidebar with session management and export buttons."""
@@ -73,13 +216,51 @@ def setup_sidebar():
         
         st.markdown("---")
         
-        active_chat = st.session_state.chat_history[st.session_state.current_chat_id]
+        active_chat = get_active_chat_state()
         
         last_fig_msg = next((msg for msg in reversed(active_chat.get("messages", [])) if isinstance(msg["content"], dict) and "plotly_fig" in msg["content"]), None)
         if last_fig_msg:
             st.markdown("**Export Last Chart**")
-            st.markdown(get_image_download_link(last_fig_msg["content"]["plotly_fig"], "chart.png"), unsafe_allow_html=True)
+            render_export_button([last_fig_msg["content"]["plotly_fig"]], "chart.png", key="last_chart")
         
         if active_chat.get("messages", []):
             st.markdown("**Export Chat**")
-            st.markdown(get_chat_download_link(active_chat["messages"], "chat_history.html"), unsafe_allow_html=True)
\ No newline at end of file
+            render_chat_export_button(active_chat)
+
+        dataset = active_chat.get("dataset")
+        if dataset is not None:
+            # Rendered from the dataset's profile, which in-chat edits update incrementally.
+            with st.expander("Data quality (current data)"):
+                st.markdown(dataset.report)
+
+        cache_stats = get_upload_cache().stats()
+        st.markdown("---")
+        st.caption(f"Upload cache: {cache_stats['hits']} hits · {cache_stats['misses']} misses · {cache_stats['entries']} files ({cache_stats['size_bytes'] / 1024 / 1024:.1f} MB)")
+        registry_stats = get_dataset_registry().stats()
+        st.caption(f"Datasets in memory: {registry_stats['datasets']} shared by {registry_stats['references']} handles ({registry_stats['size_bytes'] / 1024 / 1024:.1f} MB)")
+        results = get_result_cache().stats()
+        if results["hits"] or results["misses"]:
+            st.caption(f"Result cache: {results['hits']} hits · {results['misses']} misses · {results['entries']} results ({results['size_bytes'] / 1024 / 1024:.1f} MB)")
+        agent = active_chat.get("agent")
+        if agent is not None and agent.stream_timings:
+            timings = agent.stream_timings[-1]
+            preview = f" · preview after {timings['preview_s']:.2f}s" if timings.get("preview_s") is not None else ""
+            st.caption(f"Last response: first update after {timings['ttfb_s']:.2f}s{preview} · answer after {timings['answer_s']:.2f}s · total {timings['total_s']:.2f}s")
+        routing = router_stats.snapshot()
+        if routing["requests"]:
+            st.caption(f"Fast-path routing: {routing['hit_ratio']:.0%} of {routing['requests']} requests · ~{routing['last_saved_seconds']:.2f}s saved on the last request")
+        checks = validator_stats.snapshot()
+        if checks["checked"]:
+            st.caption(f"Code checks: {checks['rejected']} of {checks['checked']} snippets rejected before running · {checks['repaired']} repaired locally · ~{checks['llm_calls_saved']} LLM calls saved")
+        scheduler = get_llm_scheduler().stats()
+        if scheduler["submitted"]:
+            st.caption(f"LLM scheduler: {scheduler['active']} running · {scheduler['queue_depth']} queued (peak {scheduler['max_queue_depth']}) · "
+                       f"{scheduler['coalesced']} coalesced · {scheduler['rate_limited']} rate-limited · avg wait {scheduler['avg_wait_s']:.2f}s")
+        trace = getattr(agent, "last_trace", None) if agent is not None else None
+        if trace is not None:
+            with st.expander("Debug: last request"):
+                st.caption(f"Request {trace.request_id[:8]} · {trace.total_s:.2f}s · {sum(span.llm_calls for span in trace.spans)} LLM calls")
+                st.dataframe(pd.DataFrame([{
+                    "node": span.node, "wall ms": round(span.wall_s * 1000, 1), "queued ms": round(span.queue_wait_s * 1000, 1), "LLM calls": span.llm_calls, "cache hits": span.cache_hits,
+                    "tokens in": span.prompt_tokens, "tokens out": span.response_tokens, "retries": span.retries, "error": span.error or "",
+                } for span in trace.spans]), hide_index=True, use_container_width=True)
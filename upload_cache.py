@@ -0,0 +1,134 @@
+import hashlib
+import os
+import pickle
+import threading
+
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+CACHE_DIR = os.getenv("DATASENSE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "datasense"))
+UPLOAD_CACHE_MB = float(os.getenv("DATASENSE_UPLOAD_CACHE_MB", "2048"))
+# Part of every key; bump it when parsing changes so frames parsed the old way are not served.
+PARSER_VERSION = b"3"
+
+class UploadCache:
+    """
+    A content-addressed, size-bounded cache of parsed uploads.
+    Frames are stored as uncompressed Feather files (memory-mapped on read) and fall
+    back to pickle protocol 5 when Arrow cannot represent them. File modification
+    times act as the LRU clock: hits touch the file, eviction removes the oldest.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key_for(uploaded_file) -> str:
+        """Hashes the raw bytes of an uploaded file without copying them."""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(PARSER_VERSION)
+        with uploaded_file.getbuffer() as view:
+            digest.update(view)
+        return digest.hexdigest()
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.{suffix}")
+
+    def get(self, key: str):
+        """Returns the cached DataFrame for key, or None on a miss."""
+        for suffix, reader in (("feather", self._read_feather), ("pkl", self._read_pickle)):
+            path = self._path(key, suffix)
+            if os.path.exists(path):
+                try:
+                    df = reader(path)
+                    os.utime(path)
+                    with self._lock: self.hits += 1
+                    return df
+                except Exception:
+                    os.remove(path)
+        with self._lock: self.misses += 1
+        return None
+
+    def put(self, key: str, df: pd.DataFrame) -> bool:
+        """Stores df under key and evicts least recently used entries beyond the size limit."""
+        try:
+            if feather is None or not isinstance(df.index, pd.RangeIndex):
+                raise TypeError("Frame is not Feather-compatible.")
+            self._atomic_write(self._path(key, "feather"), lambda path: feather.write_feather(df, path, compression="uncompressed"))
+        except Exception:
+            try:
+                self._atomic_write(self._path(key, "pkl"), lambda path: self._write_pickle(df, path))
+            except Exception:
+                return False
+        self._evict()
+        return True
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        return {"hits": self.hits, "misses": self.misses, "entries": len(entries), "size_bytes": sum(size for _, size, _ in entries)}
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith((".feather", ".pkl")):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            while entries and total > self.max_bytes:
+                path, size, _ = entries.pop(0)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    @staticmethod
+    def _atomic_write(path, writer):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            writer(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def _read_feather(path):
+        return feather.read_table(path, memory_map=True).to_pandas()
+
+    @staticmethod
+    def _read_pickle(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    @staticmethod
+    def _write_pickle(df, path):
+        with open(path, "wb") as f:
+            pickle.dump(df, f, protocol=5)
+
+_upload_cache = None
+
+def get_upload_cache() -> UploadCache:
+    """Returns the process-wide upload cache."""
+    global _upload_cache
+    if _upload_cache is None:
+        _upload_cache = UploadCache(os.path.join(CACHE_DIR, "uploads"), int(UPLOAD_CACHE_MB * 1024 * 1024))
+    return _upload_cache
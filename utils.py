@@ -1,53 +1,80 @@
 import streamlit as st
-import base64
 import pandas as pd
 from datetime import datetime
 import uuid
 import os
+from session_store import get_session_store
+
+def _new_chat(**fields):
+    chat = {
+        "df": None, "df_name": "New Analysis", "messages": [], "agent": None,
+        "data_summary": None, "dashboard_figures": None, "dtale_data_id": None,
+        "dtale_url": None, "dataset": None,
+    }
+    chat.update(fields)
+    return chat
 
 def initialize_session_state():
     """
     Initializes a session-isolated, multi-chat state. Each user session
     gets its own st.session_state, and we store all chat histories within it.
+    A signed, single-use resume token lives in the URL, so a reload or a server
+    restart picks up the session's persisted chats (spilled, to be rehydrated on demand).
     """
+    store = get_session_store()
+    if "session_id" in st.session_state and store.claimed(st.session_state.session_id):
+        # Another tab resumed this session from its link and now owns its chats.
+        for key in ("session_id", "chat_history", "current_chat_id"): st.session_state.pop(key, None)
+        st.toast("This analysis was opened in another tab; starting a new session here.")
+
+    if "session_id" not in st.session_state:
+        token = st.query_params.get("session")
+        st.session_state.session_id = (store.claim(token) if token else None) or uuid.uuid4().hex
+        st.query_params["session"] = store.session_token(st.session_state.session_id)
+
     if "chat_history" not in st.session_state:
-        st.session_state.chat_history = {}
+        persisted = store.list_chats(st.session_state.session_id)
+        st.session_state.chat_history = {chat_id: _new_chat(df_name=df_name, spilled=True) for chat_id, df_name in persisted}
 
     if "current_chat_id" not in st.session_state:
-        st.session_state.current_chat_id = None
+        st.session_state.current_chat_id = next(reversed(st.session_state.chat_history), None)
 
     if not st.session_state.current_chat_id or st.session_state.current_chat_id not in st.session_state.chat_history:
         first_chat_id = f"chat_{uuid.uuid4()}"
         st.session_state.current_chat_id = first_chat_id
-        st.session_state.chat_history[first_chat_id] = {
-            "df": None, "df_name": "New Analysis", "messages": [], "agent": None,
-            "data_summary": None, "dashboard_figures": None, "dtale_process": None,
-            "dtale_temp_csv_file": None, "dtale_temp_script_file": None,
-        }
+        st.session_state.chat_history[first_chat_id] = _new_chat()
+
+def session_lock():
+    """Returns the lock this session holds while its script runs; other sessions never spill its chats mid-run."""
+    return get_session_store().session_lock(st.session_state.session_id)
 
 def get_active_chat_state():
-    """Returns the state dictionary of the currently active chat."""
+    """Returns the state dictionary of the currently active chat, rehydrating it if it was spilled."""
     chat_id = st.session_state.current_chat_id
-    return st.session_state.chat_history.get(chat_id)
+    chat = st.session_state.chat_history.get(chat_id)
+    if chat is not None:
+        get_session_store().track(st.session_state.session_id, chat_id, chat)
+    return chat
+
+def save_active_chat():
+    """Checkpoints the active chat's new messages, frame and dashboard to the session store."""
+    get_session_store().checkpoint(st.session_state.session_id, st.session_state.current_chat_id, get_active_chat_state())
 
 def start_new_chat():
     """Creates a new, blank chat session and switches to it."""
     new_chat_id = f"chat_{uuid.uuid4()}"
-    st.session_state.chat_history[new_chat_id] = {
-        "df": None, "df_name": "New Analysis", "messages": [], "agent": None,
-        "data_summary": None, "dashboard_figures": None, "dtale_process": None,
-        "dtale_temp_csv_file": None, "dtale_temp_script_file": None,
-    }
+    st.session_state.chat_history[new_chat_id] = _new_chat()
     st.session_state.current_chat_id = new_chat_id
     
 def switch_chat(chat_id: str):
     """Switches the active chat to the given chat_id."""
     if chat_id in st.session_state.chat_history:
         st.session_state.current_chat_id = chat_id
+        get_active_chat_state()
     
-def create_chat_for_new_upload(df, df_name, report):
+def create_chat_for_new_upload(dataset, df_name, report):
     """
-    Creates a new chat for an uploaded file, or repurposes the current
+    Creates a new chat for an uploaded dataset handle, or repurposes the current
     chat if it's an empty "New Analysis" session.
     """
     active_chat = get_active_chat_state()
@@ -55,20 +82,20 @@ def create_chat_for_new_upload(df, df_name, report):
     if active_chat and active_chat['df'] is None:
         chat_id_to_update = st.session_state.current_chat_id
         st.session_state.chat_history[chat_id_to_update].update({
-            "df": df,
+            "df": dataset.df,
+            "dataset": dataset,
             "df_name": df_name,
             "messages": [{"role": "assistant", "content": {"response_text": report}}],
             "agent": None,
         })
     else:
         new_chat_id = f"chat_{uuid.uuid4()}"
-        st.session_state.chat_history[new_chat_id] = {
-            "df": df, "df_name": df_name, "messages": [{"role": "assistant", "content": {"response_text": report}}],
-            "agent": None, "data_summary": None, "dashboard_figures": None,
-            "dtale_process": None, "dtale_temp_csv_file": None, "dtale_temp_script_file": None,
-        }
+        st.session_state.chat_history[new_chat_id] = _new_chat(
+            df=dataset.df, dataset=dataset, df_name=df_name, messages=[{"role": "assistant", "content": {"response_text": report}}],
+        )
         st.session_state.current_chat_id = new_chat_id
     
+    save_active_chat()
     st.rerun() 
 
 
@@ -76,26 +103,3 @@ def load_css(file_name):
     """Loads a CSS file."""
     with open(file_name) as f:
         st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
-
-def get_image_download_link(fig, filename):
-    """Generates a download link for a Plotly figure."""
-    try:
-        img_bytes = fig.to_image(format="png", scale=2)
-        b64 = base64.b64encode(img_bytes).decode()
-        return f'<a href="data:image/png;base64,{b64}" download="{filename}" class="st-emotion-cache-1oe5cao e1nzilvr5"><button class="st-emotion-cache-7ym5gk e1nzilvr4">Export as PNG</button></a>'
-    except Exception:
-        return "<p style='color:red;'>Could not export chart.</p>"
-
-def get_chat_download_link(messages, filename):
-    """Generates a download link for the chat history."""
-    html = "<html><head><title>Chat History</title><style>body {font-family: sans-serif;} .user {color: blue;} .assistant {color: green;}</style></head><body>"
-    for msg in messages:
-        role = msg['role']
-        if isinstance(msg['content'], dict):
-            content = msg['content'].get('response_text', str(msg['content']))
-        else:
-            content = msg['content']
-        html += f'<div class="{role}"><b>{role.title()}:</b> {content}</div><hr>'
-    html += "</body></html>"
-    b64 = base64.b64encode(html.encode()).decode()
-    return f'<a href="data:text/html;base64,{b64}" download="{filename}" class="st-emotion-cache-1oe5cao e1nzilvr5"><button class="st-emotion-cache-7ym5gk e1nzilvr4">Export as HTML</button></a>'
\ No newline at end of file